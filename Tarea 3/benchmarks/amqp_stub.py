@@ -0,0 +1,375 @@
+"""Minimal in-memory AMQP 0-9-1 broker, a local stand-in for RabbitMQ.
+
+Speaks enough of the protocol for pika's BlockingConnection so the
+benchmarks can run without a RabbitMQ server: connection and channel
+handshakes, exchange (direct/fanout) and queue declaration and binding,
+publishing, publisher confirms, transactions, Basic.Qos, Basic.Consume,
+Basic.Get, acks and nacks, and the ``x-message-ttl`` and
+``x-dead-letter-exchange``/``x-dead-letter-routing-key`` queue arguments
+(without RabbitMQ's ``x-death`` header). Messages only live in memory and
+there is no authentication. Numbers measured against it show client-side costs
+(round trips, handshakes, encoding), not RabbitMQ's own throughput.
+
+    from amqp_stub import start_broker
+    broker = start_broker()           # listens on 127.0.0.1:broker.port
+    ...
+    broker.shutdown()
+"""
+import itertools
+import socket
+import socketserver
+import threading
+from collections import defaultdict, deque
+
+import pika.frame
+import pika.spec as spec
+
+FRAME_MAX = 131072
+
+
+class Message:
+    def __init__(self, exchange, routing_key, properties, body):
+        self.exchange = exchange
+        self.routing_key = routing_key
+        self.properties = properties
+        self.body = body
+        self.redelivered = False
+
+
+class Queue:
+    def __init__(self, name, arguments=None):
+        self.name = name
+        self.arguments = arguments or {}
+        self.messages = deque()
+        self.consumers = deque()  # (connection, channel, consumer_tag, no_ack)
+
+
+class Channel:
+    def __init__(self, number):
+        self.number = number
+        self.confirm = False
+        self.transactional = False
+        self.published = 0      # publish sequence number, for confirms
+        self.prefetch = 0
+        self.delivery_tags = itertools.count(1)
+        self.unacked = {}       # delivery tag -> (queue, message)
+        self.pending = None     # [method, properties, body size, chunks]
+        self.uncommitted = []
+
+
+class Broker:
+    """Exchanges, queues and bindings shared by every connection."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.exchanges = {"": "direct"}
+        self.queues = {}
+        self.bindings = defaultdict(set)  # exchange -> {(queue, routing key)}
+        self.names = itertools.count(1)
+
+    def declare_queue(self, name, arguments):
+        with self.lock:
+            name = name or f"amq.gen-{next(self.names)}"
+            if name not in self.queues:
+                self.queues[name] = Queue(name, arguments)
+            return self.queues[name]
+
+    def route(self, message):
+        with self.lock:
+            if message.exchange == "":
+                names = [message.routing_key]
+            elif self.exchanges.get(message.exchange) == "fanout":
+                names = [queue for queue, _ in self.bindings[message.exchange]]
+            else:
+                names = [queue for queue, key in self.bindings[message.exchange]
+                         if key == message.routing_key]
+            for name in names:
+                queue = self.queues.get(name)
+                if queue is not None:
+                    queue.messages.append(message)
+                    ttl = queue.arguments.get("x-message-ttl")
+                    if ttl is not None:
+                        timer = threading.Timer(ttl / 1000, self.expire, (queue, message))
+                        timer.daemon = True
+                        timer.start()
+                    self.dispatch(queue)
+
+    def expire(self, queue, message):
+        with self.lock:
+            try:
+                queue.messages.remove(message)
+            except ValueError:
+                return  # Already delivered
+            self.dead_letter(queue, message)
+
+    def dead_letter(self, queue, message):
+        """Route an expired or rejected message to the queue's dead-letter exchange."""
+        exchange = queue.arguments.get("x-dead-letter-exchange")
+        if exchange is None:
+            return
+        routing_key = queue.arguments.get("x-dead-letter-routing-key", message.routing_key)
+        self.route(Message(exchange, routing_key, message.properties, message.body))
+
+    def dispatch(self, queue):
+        """Hand queued messages to consumers that have prefetch room."""
+        with self.lock:
+            idle = 0
+            while queue.messages and queue.consumers and idle < len(queue.consumers):
+                connection, channel, tag, no_ack = queue.consumers[0]
+                queue.consumers.rotate(-1)
+                if not no_ack and channel.prefetch and len(channel.unacked) >= channel.prefetch:
+                    idle += 1
+                    continue
+                idle = 0
+                message = queue.messages.popleft()
+                delivery_tag = next(channel.delivery_tags)
+                if not no_ack:
+                    channel.unacked[delivery_tag] = (queue, message)
+                connection.send_message(channel.number, spec.Basic.Deliver(
+                    consumer_tag=tag, delivery_tag=delivery_tag,
+                    redelivered=message.redelivered, exchange=message.exchange,
+                    routing_key=message.routing_key), message)
+
+    def settle(self, channel, delivery_tag, multiple, requeue=None):
+        """Ack (``requeue`` None) or reject deliveries of ``channel``."""
+        with self.lock:
+            if multiple:
+                tags = [tag for tag in channel.unacked if tag <= delivery_tag or not delivery_tag]
+            else:
+                tags = [delivery_tag]
+            touched = set()
+            for tag in tags:
+                queue, message = channel.unacked.pop(tag, (None, None))
+                if queue is None:
+                    continue
+                touched.add(queue)
+                if requeue:
+                    message.redelivered = True
+                    queue.messages.appendleft(message)
+                elif requeue is not None:
+                    self.dead_letter(queue, message)
+            for queue in touched:
+                self.dispatch(queue)
+            # Room freed on this channel may unblock its other queues.
+            for queue in self.queues.values():
+                if any(consumer[1] is channel for consumer in queue.consumers):
+                    self.dispatch(queue)
+
+    def release(self, connection, channel):
+        """Requeue a closed channel's unacked messages and drop its consumers."""
+        with self.lock:
+            for queue in self.queues.values():
+                queue.consumers = deque(c for c in queue.consumers if c[1] is not channel)
+            self.settle(channel, 0, True, requeue=True)
+
+
+class Connection(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.request.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.broker = self.server.broker
+        self.channels = {}
+        self.send_lock = threading.Lock()
+        self.consumer_tags = itertools.count(1)
+
+    def handle(self):
+        buffer = b""
+        try:
+            while True:
+                data = self.request.recv(65536)
+                if not data:
+                    return
+                buffer += data
+                while buffer:
+                    consumed, frame = pika.frame.decode_frame(buffer)
+                    if frame is None:
+                        break
+                    buffer = buffer[consumed:]
+                    if self.on_frame(frame) is False:
+                        return
+        except OSError:
+            pass
+        finally:
+            for channel in self.channels.values():
+                self.broker.release(self, channel)
+
+    # --------------------------- Frames ----------------------------
+
+    def on_frame(self, frame):
+        if isinstance(frame, pika.frame.ProtocolHeader):
+            self.send(0, spec.Connection.Start(server_properties={
+                "product": "amqp_stub",
+                "capabilities": {"publisher_confirms": True, "basic.nack": True,
+                                 "consumer_cancel_notify": True}}))
+        elif isinstance(frame, pika.frame.Heartbeat):
+            self.send_raw(pika.frame.Heartbeat().marshal())
+        elif isinstance(frame, pika.frame.Method):
+            return self.on_method(frame.channel_number, frame.method)
+        elif isinstance(frame, pika.frame.Header):
+            pending = self.channels[frame.channel_number].pending
+            pending[1], pending[2] = frame.properties, frame.body_size
+            if frame.body_size == 0:
+                self.on_body(self.channels[frame.channel_number])
+        elif isinstance(frame, pika.frame.Body):
+            channel = self.channels[frame.channel_number]
+            channel.pending[3].append(frame.fragment)
+            if sum(map(len, channel.pending[3])) >= channel.pending[2]:
+                self.on_body(channel)
+
+    def on_method(self, number, method):
+        broker = self.broker
+        channel = self.channels.get(number)
+        if isinstance(method, spec.Connection.StartOk):
+            self.send(0, spec.Connection.Tune(channel_max=2047, frame_max=FRAME_MAX,
+                                              heartbeat=0))
+        elif isinstance(method, spec.Connection.Open):
+            self.send(0, spec.Connection.OpenOk())
+        elif isinstance(method, spec.Connection.Close):
+            self.send(0, spec.Connection.CloseOk())
+            return False
+        elif isinstance(method, spec.Channel.Open):
+            self.channels[number] = Channel(number)
+            self.send(number, spec.Channel.OpenOk())
+        elif isinstance(method, spec.Channel.Close):
+            broker.release(self, self.channels.pop(number))
+            self.send(number, spec.Channel.CloseOk())
+        elif isinstance(method, spec.Exchange.Declare):
+            broker.exchanges.setdefault(method.exchange, method.type)
+            self.reply(number, method, spec.Exchange.DeclareOk())
+        elif isinstance(method, spec.Queue.Declare):
+            queue = broker.declare_queue(method.queue, method.arguments)
+            self.reply(number, method, spec.Queue.DeclareOk(
+                queue=queue.name, message_count=len(queue.messages),
+                consumer_count=len(queue.consumers)))
+        elif isinstance(method, spec.Queue.Bind):
+            with broker.lock:
+                broker.bindings[method.exchange].add((method.queue, method.routing_key))
+            self.reply(number, method, spec.Queue.BindOk())
+        elif isinstance(method, spec.Queue.Purge):
+            with broker.lock:
+                queue = broker.queues[method.queue]
+                count = len(queue.messages)
+                queue.messages.clear()
+            self.reply(number, method, spec.Queue.PurgeOk(message_count=count))
+        elif isinstance(method, spec.Queue.Delete):
+            with broker.lock:
+                queue = broker.queues.pop(method.queue, None)
+            count = len(queue.messages) if queue else 0
+            self.reply(number, method, spec.Queue.DeleteOk(message_count=count))
+        elif isinstance(method, spec.Basic.Qos):
+            channel.prefetch = method.prefetch_count
+            self.send(number, spec.Basic.QosOk())
+        elif isinstance(method, spec.Confirm.Select):
+            channel.confirm = True
+            self.reply(number, method, spec.Confirm.SelectOk())
+        elif isinstance(method, spec.Tx.Select):
+            channel.transactional = True
+            self.send(number, spec.Tx.SelectOk())
+        elif isinstance(method, spec.Tx.Commit):
+            messages, channel.uncommitted = channel.uncommitted, []
+            for message in messages:
+                broker.route(message)
+            self.send(number, spec.Tx.CommitOk())
+        elif isinstance(method, spec.Tx.Rollback):
+            channel.uncommitted = []
+            self.send(number, spec.Tx.RollbackOk())
+        elif isinstance(method, spec.Basic.Publish):
+            channel.pending = [method, None, 0, []]
+        elif isinstance(method, spec.Basic.Consume):
+            tag = method.consumer_tag or f"ctag-{next(self.consumer_tags)}"
+            self.reply(number, method, spec.Basic.ConsumeOk(consumer_tag=tag))
+            with broker.lock:
+                queue = broker.declare_queue(method.queue, None)
+                queue.consumers.append((self, channel, tag, method.no_ack))
+                broker.dispatch(queue)
+        elif isinstance(method, spec.Basic.Cancel):
+            with broker.lock:
+                for queue in broker.queues.values():
+                    queue.consumers = deque(c for c in queue.consumers
+                                            if c[2] != method.consumer_tag)
+            self.reply(number, method, spec.Basic.CancelOk(consumer_tag=method.consumer_tag))
+        elif isinstance(method, spec.Basic.Get):
+            with broker.lock:
+                queue = broker.queues.get(method.queue)
+                if queue is None or not queue.messages:
+                    self.send(number, spec.Basic.GetEmpty())
+                    return
+                message = queue.messages.popleft()
+                delivery_tag = next(channel.delivery_tags)
+                if not method.no_ack:
+                    channel.unacked[delivery_tag] = (queue, message)
+                self.send_message(number, spec.Basic.GetOk(
+                    delivery_tag=delivery_tag, redelivered=message.redelivered,
+                    exchange=message.exchange, routing_key=message.routing_key,
+                    message_count=len(queue.messages)), message)
+        elif isinstance(method, spec.Basic.Ack):
+            broker.settle(channel, method.delivery_tag, method.multiple)
+        elif isinstance(method, spec.Basic.Nack):
+            broker.settle(channel, method.delivery_tag, method.multiple, method.requeue)
+        elif isinstance(method, spec.Basic.Reject):
+            broker.settle(channel, method.delivery_tag, False, method.requeue)
+
+    def on_body(self, channel):
+        method, properties, _, chunks = channel.pending
+        channel.pending = None
+        message = Message(method.exchange, method.routing_key, properties, b"".join(chunks))
+        if channel.transactional:
+            channel.uncommitted.append(message)
+        else:
+            self.broker.route(message)
+        if channel.confirm:
+            channel.published += 1
+            self.send(channel.number, spec.Basic.Ack(delivery_tag=channel.published))
+
+    # ---------------------------- Output ---------------------------
+
+    def reply(self, number, method, response):
+        if not getattr(method, "nowait", False):
+            self.send(number, response)
+
+    def send(self, number, method):
+        self.send_raw(pika.frame.Method(number, method).marshal())
+
+    def send_message(self, number, method, message):
+        frames = [pika.frame.Method(number, method).marshal(),
+                  pika.frame.Header(number, len(message.body), message.properties).marshal()]
+        chunk = FRAME_MAX - 8
+        for start in range(0, len(message.body), chunk):
+            frames.append(pika.frame.Body(number, message.body[start:start + chunk]).marshal())
+        self.send_raw(b"".join(frames))
+
+    def send_raw(self, data):
+        with self.send_lock:
+            try:
+                self.request.sendall(data)
+            except OSError:
+                pass
+
+
+class Server(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address):
+        super().__init__(address, Connection)
+        self.broker = Broker()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+
+def start_broker(port=0):
+    """Start a stub broker on a background thread; ``port`` 0 picks a free one."""
+    server = Server(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, name="amqp-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--port", type=int, default=5672)
+    args = parser.parse_args()
+    print(f"AMQP stub listening on 127.0.0.1:{args.port}")
+    Server(("127.0.0.1", args.port)).serve_forever()
@@ -0,0 +1,77 @@
+"""Sustained rate of notification-auto-sender with batched publisher confirms.
+
+Compares the old sender (a new connection per message, no confirms),
+a single blocking connection waiting for each confirm, and AutoSender
+with several batch sizes, all sending --messages messages as fast as
+possible. Runs against the in-memory AMQP stub (benchmarks/amqp_stub.py)
+unless --host is given.
+
+Usage (from the Tarea 3 directory):
+
+    python benchmarks/bench_auto_sender.py
+    python benchmarks/bench_auto_sender.py --messages 50000 --batch-sizes 100 1000
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "notification-auto-sender"))
+
+import pika  # noqa: E402
+from amqp_stub import start_broker  # noqa: E402
+from auto_sender import QUEUE, AutoSender  # noqa: E402
+from bench_sender import BODY, publish_per_connection  # noqa: E402
+
+
+def timed(func, messages):
+    start = time.perf_counter()
+    func()
+    return messages / (time.perf_counter() - start)
+
+
+def blocking_confirms(parameters, messages):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE)
+    channel.confirm_delivery()
+    for _ in range(messages):
+        channel.basic_publish(exchange="", routing_key=QUEUE, body=BODY)
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 10, 100, 1000])
+    parser.add_argument("--host", help="RabbitMQ host (default: local AMQP stub)")
+    parser.add_argument("--port", type=int, default=5672)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    stub = None
+    if args.host is None:
+        stub = start_broker()
+        args.host, args.port = "127.0.0.1", stub.port
+    parameters = pika.ConnectionParameters(args.host, args.port)
+
+    old = args.messages // 50
+    print(f"connection per message, no confirms: "
+          f"{timed(lambda: [publish_per_connection(parameters) for _ in range(old)], old):,.0f} msg/s")
+    print(f"one connection, blocking confirm per message: "
+          f"{timed(lambda: blocking_confirms(parameters, args.messages), args.messages):,.0f} msg/s")
+    for batch_size in args.batch_sizes:
+        sender = AutoSender(parameters, batch_size=batch_size, max_messages=args.messages)
+        rate = timed(sender.run, args.messages)
+        assert sender.confirmed == args.messages, sender.confirmed
+        print(f"AutoSender, batches of {batch_size}: {rate:,.0f} msg/s")
+
+    if stub is not None:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,130 @@
+"""Drain rate of notification-receiver: auto-ack callback vs worker pool.
+
+Fills the queue with --messages notifications, then measures how fast
+the old consumer (auto_ack, processing inline on the connection thread)
+and Consumer (manual acks, prefetch, a pool of workers) empty it. Each
+message costs --work-ms of processing: ``sleep`` simulates waiting on
+I/O, ``cpu`` a busy loop (only processes spread it over the cores).
+Runs against the in-memory AMQP stub (benchmarks/amqp_stub.py) unless
+--host is given.
+
+Usage (from the Tarea 3 directory):
+
+    python benchmarks/bench_consumer.py
+    python benchmarks/bench_consumer.py --work cpu --workers 1 4 --modes process
+"""
+import argparse
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "notification-receiver"))
+
+import pika  # noqa: E402
+from amqp_stub import start_broker  # noqa: E402
+from bench_sender import BODY  # noqa: E402
+from consumer import QUEUE, Consumer  # noqa: E402
+
+
+def work(kind, seconds, body, content_type):
+    """Processing of one message; top level so process pools can pickle it."""
+    if kind == "sleep":
+        time.sleep(seconds)
+    else:
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            pass
+
+
+def fill(parameters, messages):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE)
+    channel.queue_purge(queue=QUEUE)
+    for _ in range(messages):
+        channel.basic_publish(exchange="", routing_key=QUEUE, body=BODY)
+    connection.close()
+
+
+def auto_ack_consumer(parameters, messages, process):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    received = 0
+
+    def callback(ch, method, properties, body):
+        nonlocal received
+        process(body, properties.content_type)
+        received += 1
+        if received == messages:
+            ch.stop_consuming()
+
+    channel.basic_consume(queue=QUEUE, on_message_callback=callback, auto_ack=True)
+    channel.start_consuming()
+    connection.close()
+
+
+def pool_consumer(parameters, messages, process, workers, prefetch, mode):
+    consumer = Consumer(parameters, process=process, workers=workers,
+                        prefetch=prefetch, mode=mode)
+
+    def watch():
+        while consumer.acked < messages:
+            time.sleep(0.01)
+        consumer.stop_threadsafe()
+
+    threading.Thread(target=watch, daemon=True).start()
+    consumer.run()
+    assert consumer.acked == messages, consumer.acked
+
+
+def timed(func, messages):
+    start = time.perf_counter()
+    func()
+    return messages / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--work", choices=["sleep", "cpu"], default="sleep")
+    parser.add_argument("--work-ms", type=float, default=2.0)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--modes", nargs="+", default=["thread", "process"])
+    parser.add_argument("--prefetch-per-worker", type=int, default=4)
+    parser.add_argument("--host", help="RabbitMQ host (default: local AMQP stub)")
+    parser.add_argument("--port", type=int, default=5672)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    stub = None
+    if args.host is None:
+        stub = start_broker()
+        args.host, args.port = "127.0.0.1", stub.port
+    parameters = pika.ConnectionParameters(args.host, args.port)
+    process = functools.partial(work, args.work, args.work_ms / 1e3)
+    print(f"{args.messages:,} messages, {args.work_ms} ms of {args.work} each, "
+          f"{os.cpu_count()} cores")
+
+    fill(parameters, args.messages)
+    rate = timed(lambda: auto_ack_consumer(parameters, args.messages, process), args.messages)
+    print(f"auto-ack, inline callback: {rate:,.0f} msg/s")
+    for mode in args.modes:
+        for workers in args.workers:
+            prefetch = workers * args.prefetch_per_worker
+            fill(parameters, args.messages)
+            rate = timed(lambda: pool_consumer(parameters, args.messages, process,
+                                               workers, prefetch, mode), args.messages)
+            print(f"manual ack, {workers} {mode} workers, prefetch {prefetch}: "
+                  f"{rate:,.0f} msg/s")
+
+    if stub is not None:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""Encode and decode cost per message: str(dict) vs JSON vs msgpack envelopes.
+
+"legacy" is what the senders used to publish (``str(dict)``, parsed with
+ast.literal_eval); "json" and "msgpack" are the envelopes of messages.py,
+encoded and decoded with messages.encode() and messages.decode(). Each
+format is timed for a small notification and one padded to --padding
+bytes. msgpack is skipped when the package is not installed.
+
+Usage (from the Tarea 3 directory):
+
+    python benchmarks/bench_encoding.py
+    python benchmarks/bench_encoding.py --messages 50000 --padding 10000
+"""
+import argparse
+import ast
+import os
+import sys
+import timeit
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "notification-sender"))
+
+import messages  # noqa: E402
+
+
+def formats():
+    yield "legacy", lambda message: str(message).encode(), \
+        lambda body: ast.literal_eval(body.decode())
+    content_types = [messages.JSON] + ([messages.MSGPACK] if messages.msgpack else [])
+    for content_type in content_types:
+        yield (content_type.split("/")[1],
+               lambda message, content_type=content_type: messages.encode(message, content_type),
+               lambda body, content_type=content_type: messages.decode(body, content_type))
+
+
+def per_message(func, arg, messages_count):
+    return timeit.timeit(lambda: func(arg), number=messages_count) / messages_count * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--padding", type=int, default=2000)
+    args = parser.parse_args()
+
+    if messages.msgpack is None:
+        print("msgpack is not installed: skipping it (pip install msgpack)")
+    payloads = {
+        "small": {"user": "user_1", "notification": "Notificación automática #1",
+                  "sender": "auto-0"},
+        "padded": {"user": "user_1", "notification": "Notificación automática #1",
+                   "sender": "auto-0", "padding": "x" * args.padding},
+    }
+    print(f"{'message':<8} {'format':<8} {'bytes':>7} {'encode µs':>10} {'decode µs':>10}")
+    for size, payload in payloads.items():
+        message = messages.envelope(payload)
+        for name, encode, decode in formats():
+            body = encode(message)
+            print(f"{size:<8} {name:<8} {len(body):>7,} "
+                  f"{per_message(encode, message, args.messages):>10.2f} "
+                  f"{per_message(decode, body, args.messages):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Good-message throughput of notification-receiver when some messages always fail.
+
+Fills the queue with --messages notifications, --poison of them failing
+on every attempt, and measures how long the consumer takes to process
+all the good ones: with a plain nack-and-requeue (a failing message goes
+straight back to the head of the queue and is redelivered again and
+again) and with the retry queues and dead-letter queue of retries.py.
+Runs against the in-memory AMQP stub (benchmarks/amqp_stub.py), which
+implements queue TTLs and dead-lettering, unless --host is given.
+
+Usage (from the Tarea 3 directory):
+
+    python benchmarks/bench_retries.py
+    python benchmarks/bench_retries.py --messages 5000 --poison 0.05 --workers 8
+"""
+import argparse
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "notification-receiver"))
+
+import pika  # noqa: E402
+import messages  # noqa: E402
+from amqp_stub import start_broker  # noqa: E402
+from consumer import QUEUE, Consumer  # noqa: E402
+from retries import RetryPolicy  # noqa: E402
+
+
+def work(seconds, body, content_type):
+    time.sleep(seconds)
+    if messages.decode(body, content_type)["payload"]["poison"]:
+        raise RuntimeError("poison message")
+
+
+class RequeueConsumer(Consumer):
+    """Manual acks without retry queues: failures are nacked with requeue."""
+
+    def _settle(self, channel, method, properties, body, error):
+        if not channel.is_open:
+            return
+        if error is None:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            self.acked += 1
+        else:
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            self.retried += 1
+
+
+def fill(parameters, policy, messages_count, poison):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    policy.declare(channel)
+    for queue in (policy.queue, policy.dead_letter_queue):
+        channel.queue_purge(queue=queue)
+    every = round(1 / poison) if poison else 0
+    for i in range(messages_count):
+        message = messages.envelope({"i": i, "poison": bool(every) and i % every == 0})
+        channel.basic_publish(exchange="", routing_key=QUEUE, body=messages.encode(message),
+                              properties=messages.properties(message))
+    connection.close()
+    return messages_count - (len(range(0, messages_count, every)) if every else 0)
+
+
+def drain(consumer, good, timeout):
+    start = time.perf_counter()
+
+    def watch():
+        while consumer.acked < good and time.perf_counter() - start < timeout:
+            time.sleep(0.01)
+        consumer.stop_threadsafe()
+
+    threading.Thread(target=watch, daemon=True).start()
+    consumer.run()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--poison", type=float, default=0.05, help="fraction that always fails")
+    parser.add_argument("--work-ms", type=float, default=1.0)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--host", help="RabbitMQ host (default: local AMQP stub)")
+    parser.add_argument("--port", type=int, default=5672)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.CRITICAL)
+    stub = None
+    if args.host is None:
+        stub = start_broker()
+        args.host, args.port = "127.0.0.1", stub.port
+    parameters = pika.ConnectionParameters(args.host, args.port)
+    policy = RetryPolicy(QUEUE, max_attempts=5, base_delay=0.1, max_delay=1.0)
+    process = functools.partial(work, args.work_ms / 1e3)
+
+    for name, consumer_class in (("nack + requeue", RequeueConsumer),
+                                 ("retry queues + DLQ", Consumer)):
+        good = fill(parameters, policy, args.messages, args.poison)
+        consumer = consumer_class(parameters, process=process, workers=args.workers,
+                                  prefetch=4 * args.workers, mode="thread",
+                                  retry_policy=policy)
+        elapsed = drain(consumer, good, args.timeout)
+        print(f"{name}: {consumer.acked:,}/{good:,} good messages in {elapsed:.2f} s "
+              f"({consumer.acked / elapsed:,.0f} msg/s), {consumer.retried:,} redeliveries "
+              f"of failed messages")
+
+    if stub is not None:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
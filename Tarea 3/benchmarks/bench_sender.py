@@ -0,0 +1,99 @@
+"""Messages per second of notification-sender: connection per message vs channel pool.
+
+"before" repeats what POST /rabbitmq used to do for every message (open a
+connection, declare the queue, publish, close); "after" publishes through
+the ChannelPool, and "endpoint" times POST /rabbitmq itself through
+Flask's test client. Runs against the in-memory AMQP stub
+(benchmarks/amqp_stub.py) unless --host is given.
+
+Usage (from the Tarea 3 directory):
+
+    python benchmarks/bench_sender.py
+    python benchmarks/bench_sender.py --messages 5000 --threads 8
+    python benchmarks/bench_sender.py --host localhost   # real RabbitMQ
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), "notification-sender"))
+
+import pika  # noqa: E402
+from amqp_stub import start_broker  # noqa: E402
+from channel_pool import ChannelPool  # noqa: E402
+
+QUEUE = "cola-de-notificaciones"
+BODY = str({"usuario": "user_1", "notificacion": "Hola"})
+
+
+def publish_per_connection(parameters):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE)
+    channel.basic_publish(exchange="", routing_key=QUEUE, body=BODY)
+    connection.close()
+
+
+def rate(send, messages, threads):
+    """Messages per second sending ``messages`` split over ``threads``."""
+    def worker(count):
+        for _ in range(count):
+            send()
+
+    counts = [messages // threads + (i < messages % threads) for i in range(threads)]
+    workers = [threading.Thread(target=worker, args=(count,)) for count in counts]
+    start = time.perf_counter()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return messages / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--host", help="RabbitMQ host (default: local AMQP stub)")
+    parser.add_argument("--port", type=int, default=5672)
+    args = parser.parse_args()
+
+    stub = None
+    if args.host is None:
+        stub = start_broker()
+        args.host, args.port = "127.0.0.1", stub.port
+    parameters = pika.ConnectionParameters(args.host, args.port)
+
+    before = rate(lambda: publish_per_connection(parameters),
+                  args.messages // 10, args.threads)
+    pool = ChannelPool(parameters, size=args.threads,
+                       setup=lambda channel: channel.queue_declare(queue=QUEUE))
+    after = rate(lambda: pool.publish("", QUEUE, BODY), args.messages, args.threads)
+    pool.close()
+    print(f"{args.threads} threads | before (connection per message): {before:,.0f} msg/s"
+          f" | after (channel pool): {after:,.0f} msg/s | {after / before:.0f}x")
+
+    os.environ["RABBITMQ_HOST"] = args.host
+    import app as sender_app
+    sender_app.pool = ChannelPool(
+        pika.ConnectionParameters(args.host, args.port), size=args.threads,
+        setup=lambda channel: channel.queue_declare(queue=QUEUE))
+    clients = threading.local()
+
+    def post():
+        if not hasattr(clients, "client"):
+            clients.client = sender_app.app.test_client()
+        clients.client.post("/rabbitmq", json={"usuario": "user_1", "notificacion": "Hola"})
+
+    endpoint = rate(post, args.messages, args.threads)
+    print(f"POST /rabbitmq with the pool: {endpoint:,.0f} req/s")
+    if stub is not None:
+        stub.shutdown()
+
+
+if __name__ == "__main__":
+    main()
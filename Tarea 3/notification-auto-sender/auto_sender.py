@@ -1,31 +1,312 @@
+"""Automatic notification sender and load generator for cola-de-notificaciones.
+
+Without arguments it sends the demo trickle configured in config.env.
+The flags turn it into a load generator; at the end (or on Ctrl+C) it
+prints the throughput and the publish latency percentiles, measured from
+basic_publish to the broker's confirm. Every message envelope carries its
+send time (``sentAt``, epoch seconds) so the consumer can measure end to end.
+
+    python auto_sender.py --rate 5000 --burst 100 --concurrency 4 \\
+        --size uniform:100:2000 --duration 30
+"""
+import argparse
 import pika
 import os
+import random
+import threading
 import time
 from dotenv import load_dotenv
 import logging
+import messages
 
 load_dotenv("config.env")
 logging.basicConfig(level=logging.INFO)
 
 rabbitmq_host = os.getenv("RABBITMQ_HOST", "localhost")
 
-def send_notification(user, notification):
-    connection = pika.BlockingConnection(pika.ConnectionParameters(rabbitmq_host))
-    channel = connection.channel()
-    channel.queue_declare(queue='cola-de-notificaciones')
+QUEUE = 'cola-de-notificaciones'
+
+
+class AutoSender:
+    """Publishes automatic notifications over one long-lived connection.
+
+    Messages go out in batches of ``batch_size`` with publisher confirms
+    on: the whole batch is written at once and the next one starts when
+    the broker has confirmed all of it (RabbitMQ acks several messages
+    per frame), so there is one wait per batch instead of one round trip
+    per message. Nacked messages are published again, and so are the
+    unconfirmed ones after a reconnection, so every message is delivered
+    at least once.
+
+    ``interval`` seconds separate two batches; with a ``rate`` (messages
+    per second) batches are instead scheduled to keep that average.
+    ``max_messages`` and ``duration`` (seconds) stop the sender; 0 means
+    no limit. ``latencies`` keeps a uniform sample of at most
+    ``MAX_LATENCY_SAMPLES`` publish-to-confirm times, so a sender running
+    for days uses constant memory. ``payload_size()`` returns the padding
+    added to each message, and ``content_type`` the encoding of the
+    envelopes (see messages.py). The connection is asynchronous
+    (SelectConnection) because pika's blocking channel waits for each
+    confirm separately.
+    """
+
+    MAX_LATENCY_SAMPLES = 100000
+
+    def __init__(self, parameters, batch_size=100, interval=0.0, max_messages=0,
+                 reconnect_delay=5, rate=0.0, duration=0.0, payload_size=lambda: 0,
+                 name="auto", content_type=messages.JSON):
+        self._parameters = parameters
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_messages = max_messages
+        self.reconnect_delay = reconnect_delay
+        self.rate = rate
+        self.duration = duration
+        self._payload_size = payload_size
+        self.name = name
+        self.content_type = content_type
+        self.confirmed = 0
+        self.nacked = 0
+        self.latencies = []     # sample of seconds from publish to confirm
+        self._latencies_seen = 0
+        self.started_at = self.finished_at = None
+        self._counter = 0
+        self._unconfirmed = {}  # delivery tag -> (message, published at)
+        self._resend = []
+        self._delivery_tag = 0
+        self._connection = self._channel = None
+        self._stopping = False
+        self._wakeup = threading.Event()
+
+    def run(self):
+        self.started_at = time.monotonic()
+        while not self._stopping and not self._expired():
+            self._connection = pika.SelectConnection(
+                self._parameters,
+                on_open_callback=self._on_connection_open,
+                on_open_error_callback=self._on_connection_error,
+                on_close_callback=self._on_connection_closed)
+            self._connection.ioloop.start()
+            if not self._stopping:
+                logging.warning("Conexión con RabbitMQ perdida, reintentando en %s s",
+                                self.reconnect_delay)
+                delay = self.reconnect_delay
+                if self.duration:
+                    delay = min(delay, self.started_at + self.duration - time.monotonic())
+                self._wakeup.wait(max(0.0, delay))
+        self.finished_at = time.monotonic()
+
+    def stop(self):
+        self._stopping = True
+        if self._connection is not None and self._connection.is_open:
+            self._connection.close()
+
+    def stop_threadsafe(self):
+        """stop() from another thread: the close runs on the connection's ioloop."""
+        # Set here too: the ioloop is not running while waiting to reconnect.
+        self._stopping = True
+        self._wakeup.set()
+        if self._connection is not None:
+            self._connection.ioloop.add_callback_threadsafe(self.stop)
+
+    # ------------------------- Connection --------------------------
+
+    def _on_connection_open(self, connection):
+        connection.channel(on_open_callback=self._on_channel_open)
+
+    def _on_connection_error(self, connection, error):
+        logging.error("No se pudo conectar a RabbitMQ: %s", error)
+        connection.ioloop.stop()
+
+    def _on_connection_closed(self, connection, reason):
+        self._channel = None
+        connection.ioloop.stop()
+
+    def _on_channel_open(self, channel):
+        self._channel = channel
+        channel.add_on_close_callback(self._on_channel_closed)
+        channel.confirm_delivery(self._on_confirm,
+                                 callback=lambda _: channel.queue_declare(
+                                     queue=QUEUE, callback=self._on_queue_declared))
+
+    def _on_channel_closed(self, channel, reason):
+        if not self._stopping:
+            logging.warning("Canal cerrado: %s", reason)
+        if self._connection.is_open:
+            self._connection.close()
+
+    def _on_queue_declared(self, frame):
+        # Delivery tags restart on every channel: resend what was in flight.
+        self._resend.extend(message for message, _ in self._unconfirmed.values())
+        self._unconfirmed.clear()
+        self._delivery_tag = 0
+        self._publish_batch()
+
+    # ------------------------- Publishing --------------------------
+
+    def _publish_batch(self):
+        if self._stopping or self._channel is None:
+            return
+        batch, self._resend = self._resend, []
+        while len(batch) < self.batch_size and not self._finished():
+            self._counter += 1
+            payload = {
+                "user": f"user_{self._counter}",
+                "notification": f"Notificación automática #{self._counter}",
+                "sender": self.name,
+            }
+            padding = self._payload_size()
+            if padding:
+                payload["padding"] = "x" * padding
+            batch.append(messages.envelope(payload))
+        if not batch:
+            self.stop()
+            return
+        for message in batch:
+            # Stamped when actually published, also for resent messages.
+            message["sentAt"] = time.time()
+            self._channel.basic_publish(
+                exchange='', routing_key=QUEUE,
+                body=messages.encode(message, self.content_type),
+                properties=messages.properties(message, self.content_type))
+            self._delivery_tag += 1
+            self._unconfirmed[self._delivery_tag] = (message, time.perf_counter())
+
+    def _finished(self):
+        if self.max_messages and self._counter >= self.max_messages:
+            return True
+        return self._expired()
+
+    def _expired(self):
+        return bool(self.duration) and time.monotonic() - self.started_at >= self.duration
+
+    def _record_latency(self, latency):
+        # Reservoir sampling: every latency has the same chance to be kept.
+        self._latencies_seen += 1
+        if len(self.latencies) < self.MAX_LATENCY_SAMPLES:
+            self.latencies.append(latency)
+        else:
+            slot = random.randrange(self._latencies_seen)
+            if slot < self.MAX_LATENCY_SAMPLES:
+                self.latencies[slot] = latency
+
+    def _next_batch_delay(self):
+        if not self.rate:
+            return self.interval
+        due = self.started_at + self._counter / self.rate
+        return max(0.0, due - time.monotonic())
+
+    def _on_confirm(self, frame):
+        method = frame.method
+        if method.multiple:
+            tags = [tag for tag in self._unconfirmed if tag <= method.delivery_tag]
+        else:
+            tags = [method.delivery_tag]
+        entries = [self._unconfirmed.pop(tag) for tag in tags if tag in self._unconfirmed]
+        if isinstance(method, pika.spec.Basic.Nack):
+            logging.warning("RabbitMQ rechazó %d mensajes, se reenviarán", len(entries))
+            self.nacked += len(entries)
+            self._resend.extend(message for message, _ in entries)
+        else:
+            confirmed_at = time.perf_counter()
+            for _, published_at in entries:
+                self._record_latency(confirmed_at - published_at)
+            self.confirmed += len(entries)
+
+        if not self._unconfirmed:
+            # One line per batch at the demo pace; silent under load.
+            log = logging.info if self.interval and not self.rate else logging.debug
+            log("Lote confirmado, %d mensajes enviados en total", self.confirmed)
+            self._connection.ioloop.call_later(self._next_batch_delay(), self._publish_batch)
+
+
+# ------------------------------ Load ------------------------------
+
+def size_sampler(spec):
+    """Payload sizes in bytes: ``N``, ``uniform:MIN:MAX`` or ``normal:MEAN:STDDEV``."""
+    kind, _, params = spec.partition(":")
+    if not params:
+        size = int(kind)
+        return lambda: size
+    values = [float(value) for value in params.split(":")]
+    if kind == "uniform":
+        low, high = map(int, values)
+        return lambda: random.randint(low, high)
+    if kind == "normal":
+        mean, stddev = values
+        return lambda: max(0, int(random.gauss(mean, stddev)))
+    raise ValueError(f"Unknown size distribution: {spec}")
+
+
+def percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def report(senders):
+    confirmed = sum(sender.confirmed for sender in senders)
+    nacked = sum(sender.nacked for sender in senders)
+    elapsed = (max(sender.finished_at or time.monotonic() for sender in senders)
+               - min(sender.started_at for sender in senders))
+    latencies = sorted(latency for sender in senders for latency in sender.latencies)
+    lines = [f"{confirmed:,} mensajes confirmados ({nacked:,} rechazados) en {elapsed:.2f} s: "
+             f"{confirmed / elapsed:,.0f} msg/s"]
+    if latencies:
+        lines.append("latencia de publicación (ms): " + " | ".join(
+            f"{name} {percentile(latencies, fraction) * 1e3:.2f}"
+            for name, fraction in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99),
+                                   ("p99.9", 0.999), ("max", 1.0))))
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rate", type=float, default=0,
+                        help="target messages/s over all connections (0 = no limit)")
+    parser.add_argument("--burst", type=int, default=int(os.getenv("BATCH_SIZE", "100")),
+                        help="messages per batch (one confirm wait per batch)")
+    parser.add_argument("--interval", type=float, default=float(os.getenv("SEND_INTERVAL", "0")),
+                        help="seconds between batches when there is no --rate")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="publishing connections, each on its own thread")
+    parser.add_argument("--size", default="0",
+                        help="payload bytes: N, uniform:MIN:MAX or normal:MEAN:STDDEV")
+    parser.add_argument("--duration", type=float, default=0, help="seconds (0 = no limit)")
+    parser.add_argument("--messages", type=int, default=int(os.getenv("MAX_MESSAGES", "0")),
+                        help="messages over all connections (0 = no limit)")
+    parser.add_argument("--encoding", choices=sorted(messages.ENCODINGS),
+                        default=os.getenv("MESSAGE_ENCODING", "json"))
+    parser.add_argument("--host", default=rabbitmq_host)
+    parser.add_argument("--port", type=int, default=5672)
+    args = parser.parse_args()
 
-    data = {
-        "user": user,
-        "notification": notification
-    }
-    channel.basic_publish(exchange='', routing_key='cola-de-notificaciones', body=str(data))
-    logging.info(f"Mensaje enviado: {data}")
+    payload_size = size_sampler(args.size)
+    content_type = messages.content_type(args.encoding)
+    parameters = pika.ConnectionParameters(args.host, args.port, heartbeat=30)
+    concurrency = min(args.concurrency, args.messages) if args.messages else args.concurrency
+    senders = [AutoSender(parameters, batch_size=args.burst, interval=args.interval,
+                          max_messages=args.messages // concurrency
+                          + (i < args.messages % concurrency),
+                          rate=args.rate / concurrency, duration=args.duration,
+                          payload_size=payload_size, name=f"auto-{i}",
+                          content_type=content_type)
+               for i in range(concurrency)]
+    threads = [threading.Thread(target=sender.run, name=sender.name) for sender in senders]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        for sender in senders:
+            sender.stop_threadsafe()
+        for thread in threads:
+            thread.join()
+    print(report(senders))
 
-    connection.close()
 
 if __name__ == "__main__":
-    counter = 1
-    while True:
-        send_notification(f"user_{counter}", f"Notificación automática #{counter}")
-        counter += 1
-        time.sleep(5)
+    main()
@@ -0,0 +1,103 @@
+"""Envelope of the messages on cola-de-notificaciones and their encodings.
+
+Every message is a dict::
+
+    {"version": 1, "id": "...", "type": "notification",
+     "correlationId": "..." | None, "sentAt": 1700000000.0, "payload": {...}}
+
+encoded as JSON or, when the msgpack package is installed, as MessagePack.
+The encoding travels in the AMQP ``content_type`` property, so each sender
+picks one and consumers decode whatever arrives. This file is copied in
+every service that sends or receives notifications; keep the copies equal.
+"""
+import ast
+import json
+import time
+import uuid
+
+import pika
+
+try:
+    import msgpack
+except ImportError:  # Optional: JSON is always available
+    msgpack = None
+
+SCHEMA_VERSION = 1
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+ENCODINGS = {"json": JSON, "msgpack": MSGPACK}
+
+
+class MessageError(ValueError):
+    """A body that cannot be decoded into a supported envelope."""
+
+
+def envelope(payload, type="notification", correlation_id=None):
+    return {
+        "version": SCHEMA_VERSION,
+        "id": uuid.uuid4().hex,
+        "type": type,
+        "correlationId": correlation_id,
+        "sentAt": time.time(),
+        "payload": payload,
+    }
+
+
+def content_type(encoding):
+    """Content type of an encoding name ("json" or "msgpack")."""
+    if encoding not in ENCODINGS:
+        raise ValueError(f"Unknown message encoding: {encoding}")
+    if ENCODINGS[encoding] == MSGPACK and msgpack is None:
+        raise ValueError("The msgpack encoding needs the msgpack package")
+    return ENCODINGS[encoding]
+
+
+def encode(message, content_type=JSON):
+    if content_type == JSON:
+        return json.dumps(message, separators=(",", ":")).encode()
+    if content_type == MSGPACK and msgpack is not None:
+        return msgpack.packb(message)
+    raise MessageError(f"Unsupported content type: {content_type}")
+
+
+def decode(body, content_type=None):
+    """Envelope of a body; ``content_type`` comes from the AMQP properties.
+
+    Bodies without a content type are the ``str(dict)`` sent by older
+    versions of the senders; they are parsed as Python literals (never
+    evaluated) and wrapped in an envelope.
+    """
+    try:
+        if content_type == JSON:
+            message = json.loads(body)
+        elif content_type == MSGPACK and msgpack is not None:
+            message = msgpack.unpackb(body)
+        elif content_type is None:
+            payload = ast.literal_eval(body.decode())
+            message = {"version": 0, "id": None, "type": "notification",
+                       "correlationId": None, "sentAt": payload.pop("sentAt", None),
+                       "payload": payload}
+        else:
+            raise MessageError(f"Unsupported content type: {content_type}")
+    except MessageError:
+        raise
+    except Exception as error:
+        raise MessageError(f"Malformed {content_type or 'legacy'} message: {error}") from error
+    if not isinstance(message, dict) or "payload" not in message:
+        raise MessageError("Message without an envelope")
+    if message.get("version", 0) > SCHEMA_VERSION:
+        raise MessageError(f"Unsupported message version: {message['version']}")
+    return message
+
+
+def properties(message, content_type=JSON):
+    """AMQP properties of an envelope, so brokers and tools can read its metadata."""
+    return pika.BasicProperties(
+        content_type=content_type,
+        message_id=message["id"],
+        correlation_id=message["correlationId"],
+        timestamp=int(message["sentAt"]),
+        type=message["type"],
+        headers={"version": message["version"]},
+    )
@@ -0,0 +1,101 @@
+import sys
+import threading
+import time
+from types import SimpleNamespace
+import pika
+import pytest
+import messages
+from auto_sender import QUEUE, AutoSender, main, percentile, report, size_sampler
+
+def queued(broker):
+    return [messages.decode(message.body, message.properties.content_type)
+            for message in broker.broker.queues[QUEUE].messages]
+
+def test_batches_are_published_and_confirmed(broker, parameters):
+    sender = AutoSender(parameters, batch_size=10, max_messages=35)
+    sender.run()
+    assert sender.confirmed == 35 and sender.nacked == 0
+    sent = queued(broker)
+    assert [message["payload"]["user"] for message in sent] == \
+        [f"user_{i}" for i in range(1, 36)]
+
+class FakeIOLoop:
+    def __init__(self):
+        self.scheduled = []
+
+    def call_later(self, delay, callback):
+        self.scheduled.append(callback)
+
+def test_nacked_messages_are_resent():
+    sender = AutoSender(None)
+    sender._connection = SimpleNamespace(ioloop=FakeIOLoop())
+    batch = [{"id": i} for i in range(3)]
+    sender._unconfirmed = {tag: (message, 0.0) for tag, message in enumerate(batch, 1)}
+
+    sender._on_confirm(SimpleNamespace(method=pika.spec.Basic.Nack(delivery_tag=2,
+                                                                    multiple=True)))
+    assert sender.nacked == 2 and sender._resend == batch[:2]
+    assert sender._connection.ioloop.scheduled == []  # Tag 3 still unconfirmed
+
+    sender._on_confirm(SimpleNamespace(method=pika.spec.Basic.Ack(delivery_tag=3)))
+    assert sender.confirmed == 1
+    assert sender._connection.ioloop.scheduled == [sender._publish_batch]
+
+# ------------------------- Load generator --------------------------
+
+def test_size_sampler():
+    assert size_sampler("300")() == 300
+    assert all(100 <= size_sampler("uniform:100:200")() <= 200 for _ in range(100))
+    assert all(size_sampler("normal:10:50")() >= 0 for _ in range(100))
+    with pytest.raises(ValueError):
+        size_sampler("pareto:1:2")
+
+def test_percentile():
+    ordered = list(range(1, 101))
+    assert percentile(ordered, 0.5) == 51
+    assert percentile(ordered, 0.99) == 100
+    assert percentile(ordered, 1.0) == 100
+    assert percentile([], 0.5) == 0.0
+
+def test_rate_and_duration_are_respected(broker, parameters):
+    sender = AutoSender(parameters, batch_size=10, rate=200, duration=0.5,
+                        payload_size=lambda: 50)
+    sender.run()
+    assert 80 <= sender.confirmed <= 110
+    assert sender.finished_at - sender.started_at < 1.5
+    assert all(len(message["payload"]["padding"]) == 50 for message in queued(broker))
+    assert all("sentAt" in message for message in queued(broker))
+    assert "mensajes confirmados" in report([sender])
+
+def test_latency_samples_are_bounded(parameters, monkeypatch):
+    monkeypatch.setattr(AutoSender, "MAX_LATENCY_SAMPLES", 50)
+    sender = AutoSender(parameters, batch_size=100, max_messages=500)
+    sender.run()
+    assert sender.confirmed == 500 and len(sender.latencies) == 50
+
+UNREACHABLE = pika.ConnectionParameters("127.0.0.1", 1, connection_attempts=1)
+
+def test_duration_is_enforced_while_the_broker_is_down():
+    sender = AutoSender(UNREACHABLE, duration=0.5, reconnect_delay=5)
+    start = time.monotonic()
+    sender.run()
+    assert time.monotonic() - start < 2
+
+def test_stop_while_waiting_to_reconnect():
+    sender = AutoSender(UNREACHABLE, reconnect_delay=30)
+    thread = threading.Thread(target=sender.run)
+    thread.start()
+    time.sleep(0.3)
+    sender.stop_threadsafe()
+    thread.join(5)
+    assert not thread.is_alive()
+
+def test_command_line_splits_messages_between_connections(broker, monkeypatch, capsys):
+    monkeypatch.setattr(sys, "argv", ["auto_sender.py", "--host", "127.0.0.1",
+                                      "--port", str(broker.port), "--messages", "101",
+                                      "--concurrency", "3", "--size", "uniform:1:10",
+                                      "--interval", "0"])
+    main()
+    assert capsys.readouterr().out.startswith("101 mensajes confirmados (0 rechazados)")
+    senders = {message["payload"]["sender"] for message in queued(broker)}
+    assert senders == {"auto-0", "auto-1", "auto-2"}
@@ -1,23 +1,158 @@
 import pika
+import functools
 import os
+import time
 import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from dotenv import load_dotenv
+import messages
+from retries import RetryPolicy
 
 load_dotenv("config.env")
 
 logging.basicConfig(level=logging.INFO)
 
-def callback_rabbitmq(ch, method, properties, body):
-    logging.info(f"Llego esto de rabbitmq: {body.decode()}")
+QUEUE = 'cola-de-notificaciones'
+
+WORKERS = int(os.getenv("WORKERS", "0")) or os.cpu_count()
+# "process" uses every core; "thread" is enough when processing waits on I/O
+WORKER_MODE = os.getenv("WORKER_MODE", "process")
+PREFETCH_COUNT = int(os.getenv("PREFETCH_COUNT", "0")) or 4 * WORKERS
+
+RETRY_POLICY = RetryPolicy(
+    QUEUE,
+    max_attempts=int(os.getenv("MAX_ATTEMPTS", "5")),
+    base_delay=float(os.getenv("RETRY_BASE_DELAY", "1")),
+    max_delay=float(os.getenv("RETRY_MAX_DELAY", "300")),
+)
+
+
+def callback_rabbitmq(body, content_type):
+    """Process one notification; runs on a worker of the pool."""
+    message = messages.decode(body, content_type)
+    if message["sentAt"] is None:
+        logging.info(f"Llego esto de rabbitmq: {message['payload']}")
+    else:
+        latency = (time.time() - message["sentAt"]) * 1e3
+        logging.info(f"Llego esto de rabbitmq ({latency:.1f} ms): {message['payload']}")
+
+
+class Consumer:
+    """Consumes the queue with manual acks and processes on a worker pool.
+
+    The connection thread only receives and acknowledges: every message is
+    handed to ``process(body, content_type)`` on a pool of ``workers``
+    threads or processes, and once it returns, its ack is sent back to the
+    connection thread with add_callback_threadsafe(), because pika
+    connections are not thread-safe. ``prefetch`` caps the unacked
+    messages RabbitMQ sends, which also bounds the pool's backlog; it
+    should be a few times ``workers`` so no worker waits for the network.
+
+    A message whose processing raised is published to the retry or
+    dead-letter queue chosen by ``retry_policy`` (see retries.py) and then
+    acked, with publisher confirms so it cannot be lost in between.
+    Messages still unacked when the connection drops are redelivered by
+    RabbitMQ, so processing must tolerate duplicates. The consumer
+    reconnects after ``reconnect_delay`` seconds.
+    """
+
+    def __init__(self, parameters, process=callback_rabbitmq, workers=WORKERS,
+                 prefetch=PREFETCH_COUNT, mode=WORKER_MODE, retry_policy=RETRY_POLICY,
+                 reconnect_delay=5):
+        self._parameters = parameters
+        self._process = process
+        self.workers = workers
+        self.prefetch = prefetch
+        self.mode = mode
+        self.retry_policy = retry_policy
+        self.reconnect_delay = reconnect_delay
+        self.acked = 0
+        self.retried = 0
+        self.dead_lettered = 0
+        self._connection = self._channel = None
+        self._stopping = False
+
+    def run(self):
+        executor_class = ProcessPoolExecutor if self.mode == "process" else ThreadPoolExecutor
+        with executor_class(max_workers=self.workers) as executor:
+            while not self._stopping:
+                try:
+                    self._consume(executor)
+                except pika.exceptions.AMQPConnectionError as error:
+                    if self._stopping:
+                        break
+                    logging.warning("Conexión con RabbitMQ perdida (%s), reintentando en %s s",
+                                    error, self.reconnect_delay)
+                    time.sleep(self.reconnect_delay)
+
+    def stop_threadsafe(self):
+        """Stop consuming from another thread (or a signal handler)."""
+        self._stopping = True
+        connection = self._connection
+        if connection is not None and connection.is_open:
+            connection.add_callback_threadsafe(self._channel.stop_consuming)
+
+    def _consume(self, executor):
+        self._connection = pika.BlockingConnection(self._parameters)
+        try:
+            self._channel = channel = self._connection.channel()
+            self.retry_policy.declare(channel)
+            channel.confirm_delivery()
+            channel.basic_qos(prefetch_count=self.prefetch)
+            channel.basic_consume(queue=self.retry_policy.queue, auto_ack=False,
+                                  on_message_callback=functools.partial(self._on_message,
+                                                                        executor))
+            logging.info("Esperando mensajes (%d workers de tipo %s, prefetch %d)...",
+                         self.workers, self.mode, self.prefetch)
+            if not self._stopping:
+                channel.start_consuming()
+        finally:
+            if self._connection.is_open:
+                self._connection.close()
+
+    def _on_message(self, executor, channel, method, properties, body):
+        future = executor.submit(self._process, body, properties.content_type)
+        future.add_done_callback(functools.partial(self._on_processed, channel, method,
+                                                   properties, body))
+
+    def _on_processed(self, channel, method, properties, body, future):
+        # Runs on a pool thread: the ack is sent from the connection thread.
+        callback = functools.partial(self._settle, channel, method, properties, body,
+                                     future.exception())
+        try:
+            channel.connection.add_callback_threadsafe(callback)
+        except pika.exceptions.ConnectionWrongStateError:
+            pass  # Connection lost: RabbitMQ redelivers the message
+
+    def _settle(self, channel, method, properties, body, error):
+        if not channel.is_open:
+            return
+        if error is None:
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            self.acked += 1
+            return
+        # Retrying cannot fix a message that does not decode.
+        queue, retry_properties = self.retry_policy.next_queue(
+            properties, error, permanent=isinstance(error, messages.MessageError))
+        try:
+            channel.basic_publish(exchange='', routing_key=queue, body=body,
+                                  properties=retry_properties)
+        except (pika.exceptions.NackError, pika.exceptions.UnroutableError):
+            channel.basic_nack(delivery_tag=method.delivery_tag, requeue=True)
+            return
+        channel.basic_ack(delivery_tag=method.delivery_tag)
+        if queue == self.retry_policy.dead_letter_queue:
+            logging.error("Mensaje %s enviado a %s: %r", properties.message_id, queue, error)
+            self.dead_lettered += 1
+        else:
+            logging.warning("No se pudo procesar el mensaje %s (%r), se reintenta desde %s",
+                            properties.message_id, error, queue)
+            self.retried += 1
+
 
 def start_consuming():
     rabbitmq_host = os.getenv("RABBITMQ_HOST", "localhost")
-    connection = pika.BlockingConnection(pika.ConnectionParameters(rabbitmq_host))
-    channel = connection.channel()
-    channel.queue_declare(queue='cola-de-notificaciones')
-    channel.basic_consume(queue='cola-de-notificaciones', on_message_callback=callback_rabbitmq, auto_ack=True)
-    logging.info("Esperando mensajes...")
-    channel.start_consuming()
+    Consumer(pika.ConnectionParameters(rabbitmq_host, heartbeat=30)).run()
 
 if __name__ == "__main__":
     start_consuming()
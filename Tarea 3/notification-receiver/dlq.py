@@ -0,0 +1,118 @@
+"""Inspect and replay the dead-letter queue of cola-de-notificaciones.
+
+    python dlq.py count
+    python dlq.py list --limit 20
+    python dlq.py replay            # every message, back to the work queue
+    python dlq.py replay --limit 100
+    python dlq.py purge
+
+``list`` reads messages without removing them. ``replay`` moves them to
+the work queue with their attempt count reset, in AMQP transactions of
+``--batch`` messages (the publishes and the acks of a batch commit
+together, so a message is never lost nor left in both queues). Only the
+messages in the queue when it starts are replayed, so messages that fail
+again while it runs are not replayed twice.
+"""
+import argparse
+import datetime
+import os
+
+import pika
+
+import messages
+import retries
+from consumer import RETRY_POLICY
+
+
+def connect(args):
+    connection = pika.BlockingConnection(pika.ConnectionParameters(args.host, args.port))
+    channel = connection.channel()
+    RETRY_POLICY.declare(channel)
+    return connection, channel
+
+
+def pending(channel):
+    return channel.queue_declare(queue=RETRY_POLICY.dead_letter_queue, passive=True) \
+        .method.message_count
+
+
+def describe(properties, body):
+    headers = properties.headers or {}
+    failed_at = headers.get(retries.FAILED_AT_HEADER)
+    if failed_at is not None:
+        failed_at = datetime.datetime.fromtimestamp(failed_at).isoformat(sep=" ")
+    try:
+        content = messages.decode(body, properties.content_type)["payload"]
+    except messages.MessageError:
+        content = body[:200]
+    return (f"{properties.message_id or '-'}  intentos={headers.get(retries.ATTEMPTS_HEADER)}  "
+            f"falló={failed_at}\n    error: {headers.get(retries.ERROR_HEADER)}\n"
+            f"    mensaje: {content}")
+
+
+def count(channel, args):
+    print(f"{pending(channel)} mensajes en {RETRY_POLICY.dead_letter_queue}")
+
+
+def show(channel, args):
+    # Unacked messages return to the queue, in order, when the connection closes.
+    for _ in range(min(args.limit, pending(channel))):
+        method, properties, body = channel.basic_get(RETRY_POLICY.dead_letter_queue)
+        if method is None:
+            break
+        print(describe(properties, body))
+
+
+def replay(channel, args):
+    total = pending(channel)
+    if args.limit:
+        total = min(total, args.limit)
+    channel.tx_select()
+    replayed = 0
+    while replayed < total:
+        batch = 0
+        while batch < min(args.batch, total - replayed):
+            method, properties, body = channel.basic_get(RETRY_POLICY.dead_letter_queue)
+            if method is None:
+                break
+            channel.basic_publish(exchange='', routing_key=RETRY_POLICY.queue, body=body,
+                                  properties=retries.reset(properties))
+            channel.basic_ack(delivery_tag=method.delivery_tag)
+            batch += 1
+        channel.tx_commit()
+        replayed += batch
+        if batch == 0:
+            break
+    print(f"{replayed} mensajes devueltos a {RETRY_POLICY.queue}")
+
+
+def purge(channel, args):
+    count = channel.queue_purge(queue=RETRY_POLICY.dead_letter_queue).method.message_count
+    print(f"{count} mensajes eliminados de {RETRY_POLICY.dead_letter_queue}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default=os.getenv("RABBITMQ_HOST", "localhost"))
+    parser.add_argument("--port", type=int, default=5672)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("count").set_defaults(run=count)
+    show_parser = commands.add_parser("list")
+    show_parser.add_argument("--limit", type=int, default=20)
+    show_parser.set_defaults(run=show)
+    replay_parser = commands.add_parser("replay")
+    replay_parser.add_argument("--limit", type=int, default=0, help="0 = every message")
+    replay_parser.add_argument("--batch", type=int, default=100)
+    replay_parser.set_defaults(run=replay)
+    commands.add_parser("purge").set_defaults(run=purge)
+    args = parser.parse_args()
+
+    connection, channel = connect(args)
+    try:
+        args.run(channel, args)
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
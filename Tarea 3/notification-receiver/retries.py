@@ -0,0 +1,76 @@
+import time
+
+import pika
+
+ATTEMPTS_HEADER = "x-attempts"
+ERROR_HEADER = "x-error"
+FAILED_AT_HEADER = "x-failed-at"
+
+
+class RetryPolicy:
+    """Retry and dead-letter queues of a work queue.
+
+    A message that fails is published to a delay queue with a message TTL
+    and the work queue as dead-letter target, so RabbitMQ moves it back to
+    ``queue`` once the delay is over and the work queue keeps flowing
+    meanwhile. The delay starts at ``base_delay`` seconds and doubles on
+    every attempt up to ``max_delay``; there is one delay queue per delay
+    (``<queue>.retry.<ms>ms``), so every message in it expires in order.
+    The ``x-attempts`` header counts the failed attempts; after
+    ``max_attempts`` of them, or right away for messages that cannot be
+    decoded, the message goes to ``<queue>.dlq`` with the last error.
+    """
+
+    def __init__(self, queue, max_attempts=5, base_delay=1.0, max_delay=300.0):
+        self.queue = queue
+        self.dead_letter_queue = f"{queue}.dlq"
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt):
+        """Seconds to wait after failed attempt number ``attempt`` (1, 2, ...)."""
+        return min(self.base_delay * 2 ** (attempt - 1), self.max_delay)
+
+    def retry_queue(self, attempt):
+        return f"{self.queue}.retry.{int(self.delay(attempt) * 1000)}ms"
+
+    def declare(self, channel):
+        channel.queue_declare(queue=self.queue)
+        # The dead-letter queue keeps messages until someone looks at them.
+        channel.queue_declare(queue=self.dead_letter_queue, durable=True)
+        for attempt in range(1, self.max_attempts):
+            channel.queue_declare(queue=self.retry_queue(attempt), arguments={
+                "x-message-ttl": int(self.delay(attempt) * 1000),
+                "x-dead-letter-exchange": "",
+                "x-dead-letter-routing-key": self.queue,
+            })
+
+    def next_queue(self, properties, error, permanent=False):
+        """Queue and properties for a message whose processing raised ``error``."""
+        headers = dict(properties.headers or {})
+        attempts = headers.get(ATTEMPTS_HEADER, 0) + 1
+        headers[ATTEMPTS_HEADER] = attempts
+        if permanent or attempts >= self.max_attempts:
+            headers[ERROR_HEADER] = repr(error)[:1000]
+            headers[FAILED_AT_HEADER] = int(time.time())
+            return self.dead_letter_queue, _with_headers(properties, headers, delivery_mode=2)
+        return self.retry_queue(attempts), _with_headers(properties, headers)
+
+
+def reset(properties):
+    """Properties of a dead-lettered message replayed as a fresh one."""
+    headers = {name: value for name, value in (properties.headers or {}).items()
+               if name not in (ATTEMPTS_HEADER, ERROR_HEADER, FAILED_AT_HEADER)}
+    return _with_headers(properties, headers, delivery_mode=None)
+
+
+def _with_headers(properties, headers, **changes):
+    return pika.BasicProperties(**{
+        **{name: getattr(properties, name) for name in (
+            "content_type", "content_encoding", "delivery_mode", "priority",
+            "correlation_id", "reply_to", "message_id", "timestamp", "type",
+            "user_id", "app_id")},
+        "headers": headers,
+        **changes,
+    })
@@ -0,0 +1,34 @@
+import os
+import sys
+import threading
+import time
+import pika
+import pytest
+
+# The in-memory AMQP broker of the benchmarks stands in for RabbitMQ.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks"))
+from amqp_stub import start_broker  # noqa: E402
+
+@pytest.fixture
+def broker():
+    server = start_broker()
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def parameters(broker):
+    return pika.ConnectionParameters("127.0.0.1", broker.port)
+
+@pytest.fixture
+def run_until():
+    """Run a consumer until ``condition()`` holds; False if it timed out."""
+    def run(consumer, condition, timeout=10):
+        deadline = time.monotonic() + timeout
+        def watch():
+            while not condition() and time.monotonic() < deadline:
+                time.sleep(0.01)
+            consumer.stop_threadsafe()
+        threading.Thread(target=watch, daemon=True).start()
+        consumer.run()
+        return condition()
+    return run
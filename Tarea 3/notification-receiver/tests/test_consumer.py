@@ -0,0 +1,63 @@
+import threading
+import time
+import pika
+import messages
+from consumer import QUEUE, Consumer
+
+def publish(parameters, payloads, content_type=messages.JSON):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=QUEUE)
+    for payload in payloads:
+        message = messages.envelope(payload)
+        channel.basic_publish(exchange="", routing_key=QUEUE,
+                              body=messages.encode(message, content_type),
+                              properties=messages.properties(message, content_type))
+    connection.close()
+
+def test_every_message_is_processed_and_acked(broker, parameters, run_until):
+    publish(parameters, [{"i": i} for i in range(50)])
+    processed = []
+    def process(body, content_type):
+        processed.append(messages.decode(body, content_type)["payload"]["i"])
+    consumer = Consumer(parameters, process=process, workers=4, prefetch=8, mode="thread")
+    assert run_until(consumer, lambda: consumer.acked == 50)
+    assert sorted(processed) == list(range(50))
+    assert not broker.broker.queues[QUEUE].messages
+
+def test_prefetch_bounds_messages_in_flight(parameters, run_until):
+    publish(parameters, [{"i": i} for i in range(20)])
+    release = threading.Event()
+    started = []
+    def process(body, content_type):
+        started.append(body)
+        release.wait()
+    consumer = Consumer(parameters, process=process, workers=8, prefetch=3, mode="thread")
+    def check():
+        time.sleep(0.5)
+        in_flight = len(started)
+        release.set()
+        return in_flight
+    in_flight = []
+    threading.Thread(target=lambda: in_flight.append(check()), daemon=True).start()
+    assert run_until(consumer, lambda: consumer.acked == 20)
+    assert in_flight == [3]
+
+def test_process_pool_runs_the_default_callback(parameters, run_until):
+    publish(parameters, [{"usuario": "ana", "notificacion": "hola"}])
+    consumer = Consumer(parameters, workers=2, prefetch=4, mode="process")
+    assert run_until(consumer, lambda: consumer.acked == 1)
+
+def test_unacked_messages_are_redelivered_after_a_disconnect(broker, parameters, run_until):
+    publish(parameters, [{"i": 1}])
+    started = threading.Event()
+    def process(body, content_type):
+        # Still running when the connection closes, so its ack is dropped.
+        started.set()
+        time.sleep(0.5)
+    consumer = Consumer(parameters, process=process, workers=1, prefetch=1, mode="thread")
+    assert not run_until(consumer, lambda: False, timeout=0.2)
+    assert started.is_set()
+    assert consumer.acked == 0
+    queued = broker.broker.queues[QUEUE].messages
+    assert len(queued) == 1 and queued[0].redelivered
@@ -0,0 +1,59 @@
+import json
+import pytest
+import messages
+
+def test_json_round_trip():
+    message = messages.envelope({"usuario": "ana"}, correlation_id="req-1")
+    body = messages.encode(message)
+    assert json.loads(body)["payload"] == {"usuario": "ana"}
+    assert messages.decode(body, messages.JSON) == message
+
+def test_msgpack_round_trip():
+    pytest.importorskip("msgpack")
+    message = messages.envelope({"usuario": "ana", "notificacion": "ñandú"})
+    body = messages.encode(message, messages.MSGPACK)
+    assert messages.decode(body, messages.MSGPACK) == message
+
+def test_newer_versions_are_rejected():
+    message = dict(messages.envelope({}), version=messages.SCHEMA_VERSION + 1)
+    with pytest.raises(messages.MessageError, match="version"):
+        messages.decode(messages.encode(message), messages.JSON)
+
+@pytest.mark.parametrize("body, content_type", [
+    (b'{"payload": {}}', "text/plain"),
+    (b'{"payload": ', messages.JSON),
+    (b'[1, 2]', messages.JSON),
+    (b'{"version": 1}', messages.JSON),
+    (b"__import__('os')", None),
+])
+def test_undecodable_bodies_raise_message_error(body, content_type):
+    with pytest.raises(messages.MessageError):
+        messages.decode(body, content_type)
+
+def test_legacy_bodies_are_wrapped_in_an_envelope():
+    body = str({"usuario": "ana", "notificacion": "hola", "sentAt": 1700000000.0}).encode()
+    message = messages.decode(body)
+    assert message["version"] == 0 and message["sentAt"] == 1700000000.0
+    assert message["payload"] == {"usuario": "ana", "notificacion": "hola"}
+
+def test_properties_carry_the_envelope_metadata():
+    message = messages.envelope({}, type="reminder", correlation_id="req-1")
+    properties = messages.properties(message, messages.JSON)
+    assert properties.content_type == messages.JSON
+    assert properties.message_id == message["id"]
+    assert properties.correlation_id == "req-1"
+    assert properties.type == "reminder"
+    assert properties.timestamp == int(message["sentAt"])
+    assert properties.headers == {"version": messages.SCHEMA_VERSION}
+
+def test_content_type_of_an_encoding():
+    assert messages.content_type("json") == messages.JSON
+    with pytest.raises(ValueError):
+        messages.content_type("xml")
+
+def test_msgpack_encoding_needs_the_package(monkeypatch):
+    monkeypatch.setattr(messages, "msgpack", None)
+    with pytest.raises(ValueError):
+        messages.content_type("msgpack")
+    with pytest.raises(messages.MessageError):
+        messages.encode(messages.envelope({}), messages.MSGPACK)
@@ -0,0 +1,115 @@
+import time
+from types import SimpleNamespace
+import pika
+import dlq
+import messages
+import retries
+from consumer import QUEUE, Consumer
+from retries import RetryPolicy
+
+def publish(parameters, queue, body, properties):
+    connection = pika.BlockingConnection(parameters)
+    channel = connection.channel()
+    channel.queue_declare(queue=queue)
+    channel.basic_publish(exchange="", routing_key=queue, body=body, properties=properties)
+    connection.close()
+
+def test_delay_doubles_up_to_the_maximum():
+    policy = RetryPolicy("q", base_delay=1.0, max_delay=5.0)
+    assert [policy.delay(attempt) for attempt in range(1, 6)] == [1.0, 2.0, 4.0, 5.0, 5.0]
+    assert policy.retry_queue(2) == "q.retry.2000ms"
+    assert policy.dead_letter_queue == "q.dlq"
+
+def test_declare_creates_one_delay_queue_per_retry():
+    declared = {}
+    channel = SimpleNamespace(queue_declare=lambda queue, durable=False, arguments=None:
+                              declared.setdefault(queue, (durable, arguments)))
+    RetryPolicy("q", max_attempts=3, base_delay=0.5).declare(channel)
+    assert declared == {
+        "q": (False, None),
+        "q.dlq": (True, None),
+        "q.retry.500ms": (False, {"x-message-ttl": 500, "x-dead-letter-exchange": "",
+                                  "x-dead-letter-routing-key": "q"}),
+        "q.retry.1000ms": (False, {"x-message-ttl": 1000, "x-dead-letter-exchange": "",
+                                   "x-dead-letter-routing-key": "q"}),
+    }
+
+def test_failures_go_to_the_next_delay_queue():
+    policy = RetryPolicy("q", max_attempts=3)
+    properties = pika.BasicProperties(message_id="m1", headers={"version": 1})
+    queue, properties = policy.next_queue(properties, RuntimeError("boom"))
+    assert queue == "q.retry.1000ms"
+    assert properties.headers == {"version": 1, retries.ATTEMPTS_HEADER: 1}
+    assert properties.message_id == "m1"
+    queue, properties = policy.next_queue(properties, RuntimeError("boom"))
+    assert queue == "q.retry.2000ms"
+    assert properties.headers[retries.ATTEMPTS_HEADER] == 2
+
+def test_last_attempt_goes_to_the_dead_letter_queue():
+    policy = RetryPolicy("q", max_attempts=3)
+    properties = pika.BasicProperties(headers={retries.ATTEMPTS_HEADER: 2})
+    queue, properties = policy.next_queue(properties, RuntimeError("boom"))
+    assert queue == "q.dlq"
+    assert properties.delivery_mode == 2
+    assert properties.headers[retries.ATTEMPTS_HEADER] == 3
+    assert properties.headers[retries.ERROR_HEADER] == "RuntimeError('boom')"
+    assert properties.headers[retries.FAILED_AT_HEADER] <= time.time()
+
+def test_permanent_failures_skip_the_retries():
+    queue, properties = RetryPolicy("q").next_queue(
+        pika.BasicProperties(), messages.MessageError("bad"), permanent=True)
+    assert queue == "q.dlq"
+    assert properties.headers[retries.ATTEMPTS_HEADER] == 1
+
+def test_reset_strips_the_failure_headers():
+    properties = pika.BasicProperties(message_id="m1", delivery_mode=2, headers={
+        "version": 1, retries.ATTEMPTS_HEADER: 5, retries.ERROR_HEADER: "boom",
+        retries.FAILED_AT_HEADER: 1700000000})
+    fresh = retries.reset(properties)
+    assert fresh.headers == {"version": 1}
+    assert fresh.message_id == "m1" and fresh.delivery_mode is None
+
+def test_poison_message_is_dead_lettered_after_max_attempts(broker, parameters, run_until):
+    attempts = []
+    def process(body, content_type):
+        attempts.append(body)
+        raise RuntimeError("boom")
+    message = messages.envelope({"usuario": "ana"})
+    publish(parameters, QUEUE, messages.encode(message), messages.properties(message))
+    policy = RetryPolicy(QUEUE, max_attempts=3, base_delay=0.05)
+    consumer = Consumer(parameters, process=process, workers=1, prefetch=1, mode="thread",
+                        retry_policy=policy)
+    assert run_until(consumer, lambda: consumer.dead_lettered == 1)
+    assert len(attempts) == 3 and consumer.retried == 2 and consumer.acked == 0
+    [dead] = broker.broker.queues[policy.dead_letter_queue].messages
+    assert dead.properties.message_id == message["id"]
+    assert dead.properties.headers[retries.ATTEMPTS_HEADER] == 3
+    assert dead.properties.headers[retries.ERROR_HEADER] == "RuntimeError('boom')"
+    assert not broker.broker.queues[QUEUE].messages
+
+def test_undecodable_message_is_dead_lettered_without_retries(broker, parameters, run_until):
+    publish(parameters, QUEUE, b"not a message", pika.BasicProperties(
+        content_type=messages.JSON))
+    policy = RetryPolicy(QUEUE, max_attempts=3, base_delay=0.05)
+    consumer = Consumer(parameters, workers=1, prefetch=1, mode="thread",
+                        retry_policy=policy)
+    assert run_until(consumer, lambda: consumer.dead_lettered == 1)
+    assert consumer.retried == 0
+    assert len(broker.broker.queues[policy.dead_letter_queue].messages) == 1
+
+def test_replay_moves_dead_letters_back_to_the_work_queue(broker, parameters, capsys):
+    failed = pika.BasicProperties(content_type=messages.JSON, message_id="m1", headers={
+        retries.ATTEMPTS_HEADER: 5, retries.ERROR_HEADER: "boom",
+        retries.FAILED_AT_HEADER: 1700000000})
+    for _ in range(3):
+        publish(parameters, dlq.RETRY_POLICY.dead_letter_queue, b"{}", failed)
+    connection, channel = dlq.connect(SimpleNamespace(host="127.0.0.1", port=broker.port))
+    try:
+        dlq.replay(channel, SimpleNamespace(limit=2, batch=1))
+    finally:
+        connection.close()
+    assert "2 mensajes devueltos" in capsys.readouterr().out
+    assert len(broker.broker.queues[dlq.RETRY_POLICY.dead_letter_queue].messages) == 1
+    replayed = broker.broker.queues[QUEUE].messages
+    assert len(replayed) == 2
+    assert all(message.properties.headers == {} for message in replayed)
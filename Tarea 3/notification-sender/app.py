@@ -3,12 +3,25 @@ from flasgger import Swagger, swag_from
 import pika
 from dotenv import load_dotenv
 import os
+from channel_pool import ChannelPool
+import messages
 
 app = Flask(__name__)
 swagger = Swagger(app)
 
 load_dotenv("config.env")
 
+QUEUE = 'cola-de-notificaciones'
+CONTENT_TYPE = messages.content_type(os.getenv("MESSAGE_ENCODING", "json"))
+
+# One pool per gunicorn worker; connections open on first use, after the fork.
+# The queue is declared once per connection instead of once per message.
+pool = ChannelPool(
+    pika.ConnectionParameters(os.getenv("RABBITMQ_HOST"), heartbeat=30),
+    size=int(os.getenv("CHANNEL_POOL_SIZE", "4")),
+    setup=lambda channel: channel.queue_declare(queue=QUEUE),
+)
+
 
 @app.route('/rabbitmq', methods=['POST'])
 @swag_from({
@@ -25,6 +38,12 @@ load_dotenv("config.env")
                 },
                 'required': ['usuario', 'notificacion']
             }
+        },
+        {
+            'name': 'X-Correlation-ID',
+            'in': 'header',
+            'required': False,
+            'type': 'string'
         }
     ],
     'responses': {
@@ -41,22 +60,13 @@ def rabbitmq():
       - RabbitMQ
     """
     content = request.get_json()
+    message = messages.envelope(content, correlation_id=request.headers.get("X-Correlation-ID"))
 
-    rabbitmq_host = os.getenv("RABBITMQ_HOST")
-
-    connection = pika.BlockingConnection(
-        pika.ConnectionParameters(rabbitmq_host))
-    channel = connection.channel()
-    channel.queue_declare(queue='cola-de-notificaciones')
-
-    channel.basic_publish(
-        exchange='',
-        routing_key='cola-de-notificaciones',
-        body=str(content)
-    )
-    connection.close()
+    pool.publish(exchange='', routing_key=QUEUE, body=messages.encode(message, CONTENT_TYPE),
+                 properties=messages.properties(message, CONTENT_TYPE))
 
-    return jsonify({"mensaje": "Notificación enviada a RabbitMQ", "data": content}), 200
+    return jsonify({"mensaje": "Notificación enviada a RabbitMQ", "id": message["id"],
+                    "data": content}), 200
 
 
 if __name__ == '__main__':
@@ -0,0 +1,119 @@
+import logging
+import queue
+import threading
+from contextlib import contextmanager
+
+import pika
+
+logger = logging.getLogger(__name__)
+
+
+class ChannelPool:
+    """Long-lived RabbitMQ channels shared by the threads of one worker.
+
+    pika's BlockingConnection is not thread-safe, so the pool keeps up to
+    ``size`` connections with one channel each and lends every channel to
+    a single thread at a time. Connections are opened lazily, the first
+    time no idle channel is left, so each gunicorn worker opens its own
+    after forking. ``setup(channel)`` (e.g. declaring the queue) runs once
+    per new connection instead of once per message.
+
+    A channel that fails is closed and replaced by a new connection the
+    next time it is needed; publish() retries once on a fresh one.
+    """
+
+    def __init__(self, parameters, size=4, setup=None):
+        self._parameters = parameters
+        self.size = size
+        self._setup = setup
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def channel(self):
+        """Borrow a channel; it is replaced if the block raises.
+
+        Any exception may leave the channel half used (e.g. a publish
+        interrupted between frames), so it is never lent again.
+        """
+        connection, channel = self._acquire()
+        try:
+            yield channel
+        except BaseException:
+            self._discard(connection)
+            raise
+        else:
+            self._idle.put((connection, channel))
+
+    def publish(self, exchange, routing_key, body, properties=None):
+        for attempt in range(2):
+            try:
+                with self.channel() as channel:
+                    channel.basic_publish(exchange=exchange, routing_key=routing_key,
+                                          body=body, properties=properties)
+                return
+            except (pika.exceptions.AMQPError, OSError):
+                if attempt:
+                    raise
+                logger.warning("RabbitMQ connection lost, reconnecting")
+
+    def close(self):
+        while True:
+            try:
+                connection, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            self._discard(connection)
+
+    def _acquire(self):
+        while True:
+            try:
+                connection, channel = self._idle.get_nowait()
+            except queue.Empty:
+                with self._lock:
+                    opening = self._opened < self.size
+                    if opening:
+                        self._opened += 1
+                if opening:
+                    return self._connect()
+                # Every channel is lent out: wait for one to come back (or
+                # be discarded, which frees a slot for a new connection).
+                try:
+                    connection, channel = self._idle.get(timeout=0.1)
+                except queue.Empty:
+                    continue
+            # Serves heartbeats and notices connections closed while idle.
+            try:
+                connection.process_data_events(0)
+            except (pika.exceptions.AMQPError, OSError):
+                self._discard(connection)
+                continue
+            if channel.is_open:
+                return connection, channel
+            self._discard(connection)
+
+    def _connect(self):
+        connection = None
+        try:
+            connection = pika.BlockingConnection(self._parameters)
+            channel = connection.channel()
+            if self._setup:
+                self._setup(channel)
+        except BaseException:
+            if connection is None:
+                with self._lock:
+                    self._opened -= 1
+            else:
+                self._discard(connection)
+            raise
+        return connection, channel
+
+    def _discard(self, connection):
+        with self._lock:
+            self._opened -= 1
+        try:
+            if connection.is_open:
+                connection.close()
+        except (pika.exceptions.AMQPError, OSError):
+            pass
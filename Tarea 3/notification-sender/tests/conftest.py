@@ -0,0 +1,18 @@
+import os
+import sys
+import pika
+import pytest
+
+# The in-memory AMQP broker of the benchmarks stands in for RabbitMQ.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "benchmarks"))
+from amqp_stub import start_broker  # noqa: E402
+
+@pytest.fixture
+def broker():
+    server = start_broker()
+    yield server
+    server.shutdown()
+
+@pytest.fixture
+def parameters(broker):
+    return pika.ConnectionParameters("127.0.0.1", broker.port)
@@ -0,0 +1,24 @@
+import pytest
+import app as sender_app
+import messages
+from channel_pool import ChannelPool
+
+@pytest.fixture
+def pool(parameters, monkeypatch):
+    pool = ChannelPool(parameters, size=1,
+                       setup=lambda channel: channel.queue_declare(queue=sender_app.QUEUE))
+    monkeypatch.setattr(sender_app, "pool", pool)
+    yield pool
+    pool.close()
+
+def test_notifications_are_published_in_an_envelope(broker, pool):
+    client = sender_app.app.test_client()
+    content = {"usuario": "ana", "notificacion": "hola"}
+    response = client.post("/rabbitmq", json=content, headers={"X-Correlation-ID": "req-1"})
+    assert response.status_code == 200
+    [queued] = broker.broker.queues[sender_app.QUEUE].messages
+    message = messages.decode(queued.body, queued.properties.content_type)
+    assert message["id"] == response.get_json()["id"]
+    assert message["correlationId"] == "req-1"
+    assert message["payload"] == content
+    assert queued.properties.message_id == message["id"]
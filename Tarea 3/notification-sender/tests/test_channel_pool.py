@@ -0,0 +1,74 @@
+import pika
+import pytest
+import channel_pool
+from channel_pool import ChannelPool
+
+class FakeChannel:
+    def __init__(self):
+        self.is_open = True
+        self.published = []
+
+    def basic_publish(self, exchange, routing_key, body, properties=None):
+        self.published.append(body)
+
+class FakeConnection:
+    opened = []
+
+    def __init__(self, parameters):
+        self.is_open = True
+        self._channel = FakeChannel()
+        FakeConnection.opened.append(self)
+
+    def channel(self):
+        return self._channel
+
+    def process_data_events(self, time_limit=0):
+        pass
+
+    def close(self):
+        self.is_open = False
+
+@pytest.fixture
+def pool(monkeypatch):
+    FakeConnection.opened = []
+    monkeypatch.setattr(channel_pool.pika, "BlockingConnection", FakeConnection)
+    return ChannelPool(pika.ConnectionParameters("localhost"), size=2)
+
+def test_channels_are_reused(pool):
+    for _ in range(5):
+        pool.publish("", "queue", b"hello")
+    assert len(FakeConnection.opened) == 1
+    assert FakeConnection.opened[0]._channel.published == [b"hello"] * 5
+
+def test_setup_runs_once_per_connection(monkeypatch):
+    monkeypatch.setattr(channel_pool.pika, "BlockingConnection", FakeConnection)
+    setups = []
+    pool = ChannelPool(pika.ConnectionParameters("localhost"), setup=setups.append)
+    pool.publish("", "queue", b"a")
+    pool.publish("", "queue", b"b")
+    assert len(setups) == 1
+
+@pytest.mark.parametrize("error", [pika.exceptions.AMQPConnectionError, ValueError])
+def test_channel_is_discarded_when_the_block_raises(pool, error):
+    # More failures than the pool size: slots must be released every time.
+    for _ in range(pool.size + 1):
+        with pytest.raises(error):
+            with pool.channel():
+                raise error()
+    assert all(not connection.is_open for connection in FakeConnection.opened)
+    with pool.channel() as channel:
+        assert channel.is_open
+    assert len(FakeConnection.opened) == pool.size + 2
+
+def test_publish_retries_once_on_a_new_connection(pool, monkeypatch):
+    calls = []
+    def flaky_publish(self, exchange, routing_key, body, properties=None):
+        calls.append(body)
+        if len(calls) == 1:
+            raise pika.exceptions.StreamLostError()
+        self.published.append(body)
+    monkeypatch.setattr(FakeChannel, "basic_publish", flaky_publish)
+    pool.publish("", "queue", b"hello")
+    assert calls == [b"hello", b"hello"]
+    assert not FakeConnection.opened[0].is_open
+    assert FakeConnection.opened[1]._channel.published == [b"hello"]
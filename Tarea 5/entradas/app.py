@@ -1,21 +1,41 @@
-import json
 import os
-from flask import Flask, request, jsonify, g
-from marshmallow import Schema, fields, ValidationError
+from flask import Flask, Response, request, jsonify, g, stream_with_context
+from marshmallow import Schema, fields, validate, ValidationError
 from flasgger import Swagger
 import logging
 import requests
+import http_client
+from idempotency import IdempotencyStore, idempotent
+from holds import HELD, HoldReaper, expire_holds, reclaim_expired
+from inventory import SEATS_INDEX, Inventory, SoldOut
+from messaging import CHANGES_EXCHANGE, PURCHASES_EXCHANGE, create_broker
+from outbox import PUBLISHED_FIELD, UNPUBLISHED_INDEX, OutboxRelay
+from ref_cache import RefCache
 from dotenv import load_dotenv
 import os
 import requests
+from etags import collection_etag, not_modified
 from log_utils import init_logging, CORRELATION_ID_HEADER
+from repository import (decode_cursor, encode_cursor, iter_records, migrate_json,
+                        open_repository)
+import time
 import uuid
+from datetime import datetime, timezone
 
 load_dotenv("config.env")
 
-DATA_FILE = "tickets.json"
+DATA_FILE = os.getenv("DATA_FILE", "tickets.json")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Query parameter -> indexed field path
+TICKET_FILTERS = {"buyerId": "buyerId", "eventId": "eventId", "type": "type", "status": "status"}
+TICKET_INDEXES = [*TICKET_FILTERS.values(), SEATS_INDEX, UNPUBLISHED_INDEX]
 USERS_SERVICE = os.getenv("USUARIOS_SERVICE")
 EVENTS_SERVICE = os.getenv("EVENTOS_SERVICE")
+# Statuses accepted on POST/PUT; "held" and "expired" belong to the hold flow
+TICKET_STATUSES = ("pending", "confirmed", "cancelled")
+HOLD_SECONDS = float(os.getenv("TICKET_HOLD_SECONDS", "300"))
 
 # ---------------------------- Flask App ---------------------------
 
@@ -55,25 +75,135 @@ class TicketsSchema(Schema):
     eventId = fields.Integer(required=True)
     type = fields.String(required=True)
     price = fields.Integer(required=True)
-    status = fields.String(required=True)
+    status = fields.String(required=True, validate=validate.OneOf(TICKET_STATUSES))
 
 tickets_schema = TicketsSchema()
 
-#  ------------------------ File Helpers --------------------------
+class HoldsSchema(Schema):
+    buyerId = fields.Integer(required=True)
+    eventId = fields.Integer(required=True)
+    type = fields.String(required=True)
+    price = fields.Integer(required=True)
+
+holds_schema = HoldsSchema()
+
+class PurchasesSchema(Schema):
+    buyerId = fields.Integer(required=True)
+    eventId = fields.Integer(required=True)
+    type = fields.String(required=True)
+    price = fields.Integer(required=True)
 
-def load_tickets():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r") as fileVar:
-        return json.load(fileVar)
+purchases_schema = PurchasesSchema()
+
+class TicketsQuerySchema(Schema):
+    buyerId = fields.Integer()
+    eventId = fields.Integer()
+    type = fields.String()
+    status = fields.String()
+    limit = fields.Integer(validate=validate.Range(min=1, max=MAX_PAGE_SIZE))
+    cursor = fields.String()
+
+tickets_query_schema = TicketsQuerySchema()
+
+#  ------------------------- Repository --------------------------
+
+tickets_repository = open_repository(DATA_FILE, STORAGE_BACKEND,
+                                     indexes=TICKET_INDEXES)
+
+# Seats sold per event, enforced against the capacity from eventos
+inventory = Inventory(tickets_repository, DATA_FILE + ".inventory.lock",
+                      stripes=int(os.getenv("INVENTORY_STRIPES", "64")))
+
+# Responses to POSTs sent with an Idempotency-Key, shared by the workers
+idempotency_store = IdempotencyStore(
+    DATA_FILE + ".idempotency.db",
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", "86400")),
+    max_keys=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000")),
+)
+
+# Returns lapsed holds to the inventory
+hold_reaper = HoldReaper(tickets_repository, inventory,
+                         interval=float(os.getenv("HOLD_REAPER_INTERVAL", "1")))
+hold_reaper.start()
+
+def reclaim_holds(event_id):
+    """Expire an event's lapsed holds when it looks sold out (inventory lock held)."""
+    return reclaim_expired(tickets_repository, event_id, time.time())
+
+# ------------------------ Downstream services ------------------------
+
+# Existence answers from usuarios/eventos, reused across requests
+reference_cache = RefCache(
+    max_size=int(os.getenv("REF_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("REF_CACHE_TTL", "30")),
+    negative_ttl=float(os.getenv("REF_CACHE_NEGATIVE_TTL", "5")),
+)
+
+# Evict entries as soon as usuarios and eventos announce a change. After a
+# (re)connection the whole cache is dropped, since changes may have been
+# missed while disconnected.
+broker = create_broker()
+
+def on_reference_change(message):
+    reference_cache.invalidate((message["resource"], message["id"]))
+
+broker.subscribe(CHANGES_EXCHANGE, on_reference_change,
+                 on_connect=reference_cache.invalidate)
+
+def purchase_event(ticket):
+    """The purchase event of a ticket sold through POST /purchases."""
+    return PURCHASES_EXCHANGE, {
+        "ticketId": ticket["id"],
+        "buyerId": ticket["buyerId"],
+        "eventId": ticket["eventId"],
+        "type": ticket["type"],
+        "price": ticket["price"],
+        "purchasedAt": ticket["purchasedAt"],
+    }
 
-def save_tickets(tickets):
-    with open(DATA_FILE, "w") as fileVar:
-        json.dump(tickets, fileVar, indent=2)
+# Publishes the purchase events stored with the tickets, off the request path
+outbox_relay = OutboxRelay(tickets_repository, broker, DATA_FILE + ".outbox.lock",
+                           purchase_event,
+                           batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "100")),
+                           interval=float(os.getenv("OUTBOX_RELAY_INTERVAL", "0.5")))
+outbox_relay.start()
 
-def find_ticket(ticket_id):
-    tickets = load_tickets()
-    return next((ticket for ticket in tickets if ticket["id"] == ticket_id), None)
+def validate_references(data):
+    """Check that the buyer and the event of a ticket exist.
+
+    Returns ``(event, None)`` with the event record, or ``(None, error
+    response)``. Answers cached in ``reference_cache`` are reused; the
+    remaining services are called concurrently and the first failure
+    answers without waiting for the other call.
+    """
+    references = [(("users", data['buyerId']), f"{USERS_SERVICE}/users/{data['buyerId']}", "Buyer not found"),
+                  (("events", data['eventId']), f"{EVENTS_SERVICE}/events/{data['eventId']}", "Event not found")]
+    found = {reference: reference_cache.get(reference) for reference, _, _ in references}
+    unknown = [(reference, url) for reference, url, _ in references if found[reference] is None]
+
+    if unknown:
+        app.logger.info("Calling services to validate %s with correlation_id: %s",
+                        [reference for reference, _ in unknown], g.correlation_id)
+        try:
+            responses = http_client.get_all([url for _, url in unknown])
+        except requests.exceptions.RequestException:
+            app.logger.exception("Unable to verify buyer and event")
+            return None, (jsonify({"error": "Unable to verify buyer and event"}), 500)
+
+        for (reference, _), response in zip(unknown, responses):
+            if response is None:  # Abandoned after the other call failed
+                continue
+            app.logger.info("Response for %s %d: status=%d, correlation_id: %s",
+                            *reference, response.status_code, g.correlation_id)
+            found[reference] = response.json() if response.status_code == 200 else False
+            # Only definite answers are cached, not server errors.
+            if response.status_code in (200, 404):
+                reference_cache.put(reference, found[reference])
+
+    for reference, _, error in references:
+        if found[reference] is False:
+            return None, (jsonify({"error": error}), 404)
+    return found[("events", data['eventId'])], None
 
 # ----------------------------- Routes ----------------------------
 
@@ -83,14 +213,87 @@ def find_ticket(ticket_id):
 def get_tickets():
     """Get all tickets
     ---
+    produces:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: buyerId
+        in: query
+        type: integer
+        required: false
+        description: Only tickets bought by this user
+      - name: eventId
+        in: query
+        type: integer
+        required: false
+        description: Only tickets for this event
+      - name: type
+        in: query
+        type: string
+        required: false
+        description: Only tickets of this type
+      - name: status
+        in: query
+        type: string
+        required: false
+        description: Only tickets with this status
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-1000). Without it every match is returned.
+          With Accept application/x-ndjson it caps the streamed records.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: X-Next-Cursor header of the previous page
     responses:
       200:
         description: List of tickets
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor of the next page, absent on the last one
+      304:
+        description: Not modified since the ETag sent in If-None-Match
+      400:
+        description: Invalid query
     """
-    tickets = load_tickets()
+    try:
+        args = tickets_query_schema.load(request.args)
+        after = decode_cursor(args["cursor"]) if "cursor" in args else None
+    except ValidationError as err:
+        app.logger.info("Invalid tickets query: %s", err.messages)
+        return jsonify(err.messages), 400
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    filters = {TICKET_FILTERS[name]: value for name, value in args.items()
+               if name in TICKET_FILTERS}
+    if request.accept_mimetypes.best_match(
+            ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        app.logger.info("Streaming tickets as NDJSON")
+        records = iter_records(tickets_repository, filters, after, args.get("limit"))
+        lines = (app.json.dumps(record) + "\n" for record in records)
+        return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+
+    # The generation is read before the page: a concurrent write can only
+    # make the ETag older than the body, never newer.
+    etag = collection_etag(tickets_repository.generation())
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    tickets, next_id = tickets_repository.page(
+        filters, args.get("limit"), after)
     app.logger.info(
         "Returning list of tickets with length: %d", len(tickets))
-    return jsonify(tickets), 200
+    response = jsonify(tickets)
+    response.set_etag(etag)
+    if next_id is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_id)
+    return response, 200
 
 # >>>>>>>>>>>>>> Get ticket by ID <<<<<<<<<<<<
 
@@ -122,6 +325,8 @@ def get_ticket(ticket_id):
               type: integer
             status:
               type: string
+      304:
+        description: Not modified since the ETag sent in If-None-Match
       404:
         description: Ticket not found
         schema:
@@ -130,11 +335,17 @@ def get_ticket(ticket_id):
             error:
               type: string
     """
-    ticket = find_ticket(ticket_id)
+    ticket, etag = tickets_repository.get_versioned(ticket_id)
 
     if ticket:
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            app.logger.info("Ticket with id %d not modified", ticket_id)
+            return unchanged
         app.logger.info("Ticket with id %d found", ticket_id)
-        return jsonify(ticket), 200
+        response = jsonify(ticket)
+        response.set_etag(etag)
+        return response, 200
 
     app.logger.info("Ticket with id %d not found", ticket_id)
     return jsonify({"error": "Ticket not found"}), 404
@@ -142,11 +353,17 @@ def get_ticket(ticket_id):
 # >>>>>>>>>>>>>> Add new ticket <<<<<<<<<<<<
 
 @app.route('/tickets', methods=['POST'])
+@idempotent(lambda: idempotency_store)
 def add_ticket():
     """
     Add a new ticket
     ---
     parameters:
+      - name: Idempotency-Key
+        in: header
+        type: string
+        required: false
+        description: Retries with the same key replay the first response
       - name: body
         in: body
         required: true
@@ -168,6 +385,8 @@ def add_ticket():
         description: Ticket created
       400:
         description: Invalid input
+      409:
+        description: Event sold out
     """
 
     try:
@@ -176,41 +395,19 @@ def add_ticket():
         app.logger.info("Invalid ticket data: %s", err.messages)
         return jsonify(err.messages), 400
 
-    # Validate buyerId
-    app.logger.info("Calling users service to validate buyer %d with correlation_id: %s",
-                    data['buyerId'], g.correlation_id)
-    buyer_response = requests.get(
-        f"{USERS_SERVICE}/users/{data['buyerId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    app.logger.info("Users service response for buyer %d: status=%d, correlation_id: %s",
-                    data['buyerId'], buyer_response.status_code, g.correlation_id)
-    if buyer_response.status_code != 200:
-        return jsonify({"error": "Buyer not found"}), 404
-
-    # Validate eventId
-    app.logger.info("Calling events service to validate event %d with correlation_id: %s",
-                    data['eventId'], g.correlation_id)
-    event_response = requests.get(
-        f"{EVENTS_SERVICE}/events/{data['eventId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    app.logger.info("Events service response for event %d: status=%d, correlation_id: %s",
-                    data['eventId'], event_response.status_code, g.correlation_id)
-    if event_response.status_code != 200:
-        return jsonify({"error": "Event not found"}), 404
-
+    event, error = validate_references(data)
+    if error:
+        return error
 
     app.logger.info("Adding new ticket: %s", data)
 
-    tickets = load_tickets()
-    new_ticket = {
-        "id": tickets[-1]["id"] + 1 if tickets else 1,
-        **data
-    }
-
-    tickets.append(new_ticket)
-    save_tickets(tickets)
+    try:
+        new_ticket = inventory.admit(data, event.get("capacity"),
+                                     lambda: tickets_repository.add(data),
+                                     reclaim=reclaim_holds)
+    except SoldOut:
+        app.logger.info("Event %d is sold out", data['eventId'])
+        return jsonify({"error": "Event sold out"}), 409
     return jsonify(new_ticket), 201
 
 # >>>>>>>>>>>>>> Update ticket by ID <<<<<<<<<<<<
@@ -246,6 +443,8 @@ def update_ticket(ticket_id):
         description: Ticket updated
       404:
         description: Ticket not found
+      409:
+        description: Event sold out
     """
     # Validate request data
     try:
@@ -254,37 +453,24 @@ def update_ticket(ticket_id):
         app.logger.info("Invalid ticket data: %s", err.messages)
         return jsonify(err.messages), 400
 
-    # Validate buyerId
-    app.logger.info("Calling users service to validate buyer %d with correlation_id: %s",
-                    data['buyerId'], g.correlation_id)
-    buyer_response = requests.get(
-        f"{USERS_SERVICE}/users/{data['buyerId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    app.logger.info("Users service response for buyer %d: status=%d, correlation_id: %s",
-                    data['buyerId'], buyer_response.status_code, g.correlation_id)
-    if buyer_response.status_code != 200:
-        return jsonify({"error": "Buyer not found"}), 404
-
-    # Validate eventId
-    app.logger.info("Calling events service to validate event %d with correlation_id: %s",
-                    data['eventId'], g.correlation_id)
-    event_response = requests.get(
-        f"{EVENTS_SERVICE}/events/{data['eventId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    app.logger.info("Events service response for event %d: status=%d, correlation_id: %s",
-                    data['eventId'], event_response.status_code, g.correlation_id)
-    if event_response.status_code != 200:
-        return jsonify({"error": "Event not found"}), 404
-
-    tickets = load_tickets()
-
-    for ticket in tickets:
-        if ticket["id"] == ticket_id:
-            ticket.update(data)
-            save_tickets(tickets)
-            return jsonify(ticket), 200
+    # Before admitting: a missing ticket would otherwise take a new seat.
+    if tickets_repository.get(ticket_id) is None:
+        return jsonify({"error": "Ticket not found"}), 404
+
+    event, error = validate_references(data)
+    if error:
+        return error
+
+    try:
+        ticket = inventory.admit(data, event.get("capacity"),
+                                 lambda: tickets_repository.update(ticket_id, data),
+                                 current=lambda: tickets_repository.get(ticket_id),
+                                 reclaim=reclaim_holds)
+    except SoldOut:
+        app.logger.info("Event %d is sold out", data['eventId'])
+        return jsonify({"error": "Event sold out"}), 409
+    if ticket:
+        return jsonify(ticket), 200
 
     return jsonify({"error": "Ticket not found"}), 404
 
@@ -305,14 +491,234 @@ def delete_ticket(ticket_id):
       404:
         description: Ticket not found
     """
-    tickets = load_tickets()
-    if not any(ticket["id"] == ticket_id for ticket in tickets):
+    if not tickets_repository.delete(ticket_id):
         return jsonify({"error": "Ticket not found"}), 404
 
-    tickets = [ticket for ticket in tickets if ticket["id"] != ticket_id]
-    save_tickets(tickets)
     return "", 204
 
+# >>>>>>>>>>>>>> Hold a ticket <<<<<<<<<<<<
+
+@app.route('/tickets/holds', methods=['POST'])
+@idempotent(lambda: idempotency_store)
+def hold_ticket():
+    """
+    Reserve a seat for TICKET_HOLD_SECONDS until it is confirmed or released
+    ---
+    parameters:
+      - name: Idempotency-Key
+        in: header
+        type: string
+        required: false
+        description: Retries with the same key replay the first response
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            buyerId:
+              type: integer
+            eventId:
+              type: integer
+            type:
+              type: string
+            price:
+              type: integer
+    responses:
+      201:
+        description: Ticket held, with status "held" and holdExpiresAt (epoch seconds)
+      400:
+        description: Invalid input
+      404:
+        description: Buyer or event not found
+      409:
+        description: Event sold out
+    """
+    try:
+        data = holds_schema.load(request.get_json())
+    except ValidationError as err:
+        app.logger.info("Invalid hold data: %s", err.messages)
+        return jsonify(err.messages), 400
+
+    event, error = validate_references(data)
+    if error:
+        return error
+
+    ticket = {**data, "status": HELD, "holdExpiresAt": round(time.time() + HOLD_SECONDS, 3)}
+    try:
+        held = inventory.admit(ticket, event.get("capacity"),
+                               lambda: tickets_repository.add(ticket),
+                               reclaim=reclaim_holds)
+    except SoldOut:
+        app.logger.info("Event %d is sold out", data['eventId'])
+        return jsonify({"error": "Event sold out"}), 409
+
+    hold_reaper.track(held)
+    app.logger.info("Ticket %d held until %s", held["id"], held["holdExpiresAt"])
+    return jsonify(held), 201
+
+# >>>>>>>>>>>>>> Confirm or release a hold <<<<<<<<<<<<
+
+@app.route('/tickets/<int:ticket_id>/confirm', methods=['POST'])
+def confirm_ticket(ticket_id):
+    """
+    Confirm a held ticket before its hold expires
+    ---
+    parameters:
+      - name: ticket_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: Ticket confirmed
+      404:
+        description: Ticket not found
+      409:
+        description: The ticket is not held or the hold expired
+    """
+    return finish_hold(ticket_id, "confirmed")
+
+@app.route('/tickets/<int:ticket_id>/release', methods=['POST'])
+def release_ticket(ticket_id):
+    """
+    Release a held ticket, returning its seat to the event
+    ---
+    parameters:
+      - name: ticket_id
+        in: path
+        type: integer
+        required: true
+    responses:
+      200:
+        description: Ticket cancelled
+      404:
+        description: Ticket not found
+      409:
+        description: The ticket is not held or the hold expired
+    """
+    return finish_hold(ticket_id, "cancelled")
+
+def finish_hold(ticket_id, status):
+    ticket = tickets_repository.get(ticket_id)
+    if not ticket:
+        return jsonify({"error": "Ticket not found"}), 404
+
+    # Under the event's lock, so the reaper cannot expire it concurrently.
+    with inventory.locked(ticket["eventId"]):
+        if expire_holds(tickets_repository, [ticket_id], time.time()):
+            app.logger.info("Hold of ticket %d expired", ticket_id)
+            return jsonify({"error": "Hold expired"}), 409
+        ticket = tickets_repository.get(ticket_id)
+        if ticket["status"] != HELD:
+            return jsonify({"error": f"Ticket is {ticket['status']}, not held"}), 409
+        ticket = tickets_repository.update(ticket_id, {"status": status})
+
+    hold_reaper.wheel.cancel((ticket["eventId"], ticket_id))
+    app.logger.info("Hold of ticket %d finished as %s", ticket_id, status)
+    return jsonify(ticket), 200
+
+# >>>>>>>>>>>>>> Purchase a ticket <<<<<<<<<<<<
+
+@app.route('/purchases', methods=['POST'])
+@idempotent(lambda: idempotency_store)
+def add_purchase():
+    """
+    Buy a ticket; the bill and the confirmation notification follow asynchronously
+    ---
+    parameters:
+      - name: Idempotency-Key
+        in: header
+        type: string
+        required: false
+        description: Retries with the same key replay the first response
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            buyerId:
+              type: integer
+            eventId:
+              type: integer
+            type:
+              type: string
+            price:
+              type: integer
+    responses:
+      202:
+        description: Ticket confirmed ("published" turns true once the purchase event is sent)
+      400:
+        description: Invalid input
+      404:
+        description: Buyer or event not found
+      409:
+        description: Event sold out
+    """
+    try:
+        data = purchases_schema.load(request.get_json())
+    except ValidationError as err:
+        app.logger.info("Invalid purchase data: %s", err.messages)
+        return jsonify(err.messages), 400
+
+    event, error = validate_references(data)
+    if error:
+        return error
+
+    # The purchase event is stored with the ticket and relayed by outbox_relay.
+    ticket = {**data, "status": "confirmed",
+              "purchasedAt": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+              PUBLISHED_FIELD: False}
+    try:
+        new_ticket = inventory.admit(ticket, event.get("capacity"),
+                                     lambda: tickets_repository.add(ticket),
+                                     reclaim=reclaim_holds)
+    except SoldOut:
+        app.logger.info("Event %d is sold out", data['eventId'])
+        return jsonify({"error": "Event sold out"}), 409
+
+    outbox_relay.wake()
+    app.logger.info("Purchase of ticket %d queued", new_ticket["id"])
+    return jsonify(new_ticket), 202
+
+# >>>>>>>>>>>>>> Reference cache statistics <<<<<<<<<<<<
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit, miss and eviction counters of this worker's reference cache
+    ---
+    responses:
+      200:
+        description: Cache statistics
+        schema:
+          type: object
+          properties:
+            size:
+              type: integer
+            maxSize:
+              type: integer
+            hits:
+              type: integer
+            misses:
+              type: integer
+            evictions:
+              type: integer
+            expirations:
+              type: integer
+    """
+    return jsonify(reference_cache.stats()), 200
+
+# ------------------------------ CLI ------------------------------
+
+@app.cli.command("migrate-json")
+def migrate_json_command():
+    """Import tickets.json into the SQLite database (flask migrate-json)."""
+    repository = open_repository(DATA_FILE, "sqlite",
+                                 indexes=TICKET_INDEXES)
+    count = migrate_json(DATA_FILE, repository)
+    print(f"Imported {count} tickets from {DATA_FILE}")
+
 # ------------------------------ Main -----------------------------
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
@@ -0,0 +1,70 @@
+"""Compare per-call latency of one-off requests.get() and the pooled client.
+
+Starts a local keep-alive HTTP server that answers like a small JSON API
+and times sequential GETs against it.
+
+Usage (from the entradas directory):
+
+    python benchmarks/bench_http_client.py
+    python benchmarks/bench_http_client.py --calls 2000
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests  # noqa: E402
+import http_client  # noqa: E402
+
+BODY = b'{"id": 1, "name": "Ana", "isOrganizer": true}'
+
+
+class JsonHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, *args):
+        pass
+
+
+def timed(func, calls):
+    samples = []
+    for _ in range(calls):
+        start = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return sum(samples) / calls, samples[int(calls * 0.99) - 1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=1000)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), JsonHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/users/1"
+    try:
+        for name, func in (("requests.get (new connection)", lambda: requests.get(url)),
+                           ("http_client.get (keep-alive)", lambda: http_client.get(url))):
+            mean, p99 = timed(func, args.calls)
+            print(f"{name:32} mean {mean * 1e3:.3f} ms | p99 {p99 * 1e3:.3f} ms")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Time secondary-index lookups (tickets by buyerId / eventId).
+
+Usage (from the entradas directory):
+
+    python benchmarks/bench_indexes.py
+    python benchmarks/bench_indexes.py --size 100000 --backends json
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_repository import write_dataset  # noqa: E402
+from repository import migrate_json, open_repository  # noqa: E402
+
+INDEXES = ("buyerId", "eventId")
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", type=int, default=1_000_000)
+    parser.add_argument("--backends", nargs="+", default=["json", "sqlite"])
+    parser.add_argument("--lookups", type=int, default=1_000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tickets.json")
+        # About ten tickets per buyer and size / 100 tickets per event.
+        write_dataset(path, args.size, buyers=args.size // 10)
+        tickets = open_repository(path).all()
+        buyers = [random.randint(1, args.size // 10) for _ in range(args.lookups)]
+
+        buyer = buyers[0]
+        scan = timed(lambda: [t for t in tickets if t["buyerId"] == buyer], 3)
+        print(f"{args.size:,} tickets, full scan by buyerId: {scan * 1e3:.2f} ms")
+
+        for backend in args.backends:
+            start = time.perf_counter()
+            repository = open_repository(path, backend, indexes=INDEXES)
+            if backend == "sqlite":
+                migrate_json(path, repository)
+            print(f"[{backend}] load/import with indexes: "
+                  f"{time.perf_counter() - start:.2f} s")
+
+            lookup_buyers = iter(buyers)
+            find = timed(lambda: repository.find({"buyerId": next(lookup_buyers)}),
+                         args.lookups)
+            events = iter(random.randint(1, 100) for _ in range(args.lookups))
+            count = timed(lambda: repository.count_by("eventId", next(events)),
+                          args.lookups)
+            print(f"[{backend}] find by buyerId (~10 rows): "
+                  f"{find * 1e3:.3f} ms | count by eventId: {count * 1e3:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
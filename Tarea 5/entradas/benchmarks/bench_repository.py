@@ -0,0 +1,124 @@
+"""Compare the legacy tickets.json helpers with JsonRepository.
+
+Reads compare a legacy lookup (full parse plus linear scan) with a
+repository lookup. Writes compare the ``json`` backend (full rewrite) with
+the ``wal`` backend (one appended log line).
+
+Usage (from the entradas directory):
+
+    python benchmarks/bench_repository.py
+    python benchmarks/bench_repository.py --sizes 10000 100000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from repository import open_repository  # noqa: E402
+
+# ------------------------ Legacy helpers -------------------------
+# Copied from the previous version of app.py.
+
+
+def load_tickets(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, "r") as fileVar:
+        return json.load(fileVar)
+
+
+def find_ticket(path, ticket_id):
+    tickets = load_tickets(path)
+    return next((ticket for ticket in tickets if ticket["id"] == ticket_id), None)
+
+# --------------------------- Benchmark ---------------------------
+
+
+def write_dataset(path, size, buyers=1000):
+    tickets = [
+        {
+            "id": i,
+            "buyerId": random.randint(1, buyers),
+            "eventId": random.randint(1, 100),
+            "type": random.choice(["VIP", "General"]),
+            "price": random.randint(20, 300),
+            "status": random.choice(["confirmed", "pending", "cancelled"]),
+        }
+        for i in range(1, size + 1)
+    ]
+    with open(path, "w") as fileVar:
+        json.dump(tickets, fileVar, indent=2)
+
+
+def timed(func, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def run_reads(size, legacy_lookups, repository_lookups):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tickets.json")
+        write_dataset(path, size)
+        ids = [random.randint(1, size) for _ in range(repository_lookups)]
+
+        legacy = timed(lambda: find_ticket(path, random.choice(ids)), legacy_lookups)
+
+        start = time.perf_counter()
+        repository = open_repository(path)
+        startup = time.perf_counter() - start
+
+        lookup_ids = iter(ids)
+        lookup = timed(lambda: repository.get(next(lookup_ids)), repository_lookups)
+
+    print(f"{size:>9,} | {legacy * 1e3:>15.2f} | {startup * 1e3:>14.2f} | "
+          f"{lookup * 1e6:>13.3f} | {legacy / lookup:>10,.0f}x")
+
+
+def run_writes(size, json_writes, wal_writes):
+    ticket = {"buyerId": 1, "eventId": 1, "type": "VIP", "price": 100,
+              "status": "pending"}
+    timings = []
+    for backend, writes in (("json", json_writes), ("wal", wal_writes)):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "tickets.json")
+            write_dataset(path, size)
+            repository = open_repository(path, backend)
+            timings.append(timed(lambda: repository.add(ticket), writes))
+
+    json_write, wal_write = timings
+    print(f"{size:>9,} | {json_write * 1e3:>15.2f} | {wal_write * 1e6:>14.2f} | "
+          f"{json_write / wal_write:>10,.0f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--legacy-lookups", type=int, default=5)
+    parser.add_argument("--repository-lookups", type=int, default=100_000)
+    parser.add_argument("--json-writes", type=int, default=3)
+    parser.add_argument("--wal-writes", type=int, default=1_000)
+    args = parser.parse_args()
+
+    random.seed(1)
+    print("  tickets | legacy get (ms) | repo load (ms) | repo get (us) |    speedup")
+    print("-" * 75)
+    for size in args.sizes:
+        run_reads(size, args.legacy_lookups, args.repository_lookups)
+
+    print()
+    print("  tickets |  json add (ms) |   wal add (us) |    speedup")
+    print("-" * 58)
+    for size in args.sizes:
+        run_writes(size, args.json_writes, args.wal_writes)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Time buyer/event validation with injected downstream latency.
+
+Starts two local HTTP servers standing in for usuarios and eventos, each
+sleeping a fixed time per request, and compares calling them one after
+the other with http_client.get_all(). Also times POST /tickets end to end.
+
+Usage (from the entradas directory):
+
+    python benchmarks/bench_validation.py
+    python benchmarks/bench_validation.py --users-latency 50 --events-latency 80
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import http_client  # noqa: E402
+
+
+def start_server(latency):
+    class SlowHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            time.sleep(latency)
+            body = b'{"id": 1}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def timed(func, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users-latency", type=float, default=50, help="ms")
+    parser.add_argument("--events-latency", type=float, default=50, help="ms")
+    parser.add_argument("--calls", type=int, default=50)
+    args = parser.parse_args()
+
+    users, users_url = start_server(args.users_latency / 1000)
+    events, events_url = start_server(args.events_latency / 1000)
+    urls = [f"{users_url}/users/1", f"{events_url}/events/1"]
+    try:
+        sequential = timed(lambda: [http_client.get(url) for url in urls], args.calls)
+        concurrent = timed(lambda: http_client.get_all(urls), args.calls)
+        print(f"users {args.users_latency:g} ms, events {args.events_latency:g} ms")
+        print(f"sequential: {sequential * 1e3:.1f} ms | concurrent: {concurrent * 1e3:.1f} ms")
+
+        import app as tickets_app
+        from repository import open_repository
+        with tempfile.TemporaryDirectory() as tmp:
+            tickets_app.tickets_repository = open_repository(
+                os.path.join(tmp, "tickets.json"))
+            tickets_app.USERS_SERVICE, tickets_app.EVENTS_SERVICE = users_url, events_url
+            logging.disable(logging.INFO)
+            client = tickets_app.app.test_client()
+            ticket = {"buyerId": 1, "eventId": 1, "type": "VIP", "price": 100,
+                      "status": "pending"}
+            post = timed(lambda: client.post("/tickets", json=ticket), args.calls)
+        print(f"POST /tickets: {post * 1e3:.1f} ms")
+    finally:
+        for server in (users, events):
+            server.shutdown()
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
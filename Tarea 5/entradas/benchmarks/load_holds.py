@@ -0,0 +1,114 @@
+"""Load-test seat holds: thousands of buyers racing for one event.
+
+Every holder asks for a hold on the same event. Part of the admitted ones
+confirm, the rest walk away and let their hold expire. The report shows
+how many were admitted, checks that seats sold never exceed the capacity,
+and times how long the reaper takes to give the abandoned seats back,
+after which a second wave takes them.
+
+Usage (from the entradas directory):
+
+    python benchmarks/load_holds.py
+    python benchmarks/load_holds.py --holders 5000 --capacity 1000 --backend sqlite
+"""
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+EVENT_ID = 1
+
+
+def run_wave(tickets_app, holders, threads, confirm_ratio):
+    """Send ``holders`` holds; return (admitted, sold out, confirmed, seconds)."""
+    local = threading.local()
+    hold = {"buyerId": 1, "eventId": EVENT_ID, "type": "VIP", "price": 100}
+
+    def holder(index):
+        if not hasattr(local, "client"):
+            local.client = tickets_app.app.test_client()
+        rv = local.client.post("/tickets/holds", json=hold)
+        if rv.status_code != 201:
+            return rv.status_code, False
+        confirm = random.random() < confirm_ratio
+        if confirm:
+            ticket_id = rv.get_json()["id"]
+            confirm = local.client.post(f"/tickets/{ticket_id}/confirm").status_code == 200
+        return 201, confirm
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(holder, range(holders)))
+    elapsed = time.perf_counter() - start
+    statuses = [status for status, _ in results]
+    return (statuses.count(201), statuses.count(409),
+            sum(confirmed for _, confirmed in results), elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--holders", type=int, default=2000)
+    parser.add_argument("--capacity", type=int, default=500)
+    parser.add_argument("--threads", type=int, default=64)
+    parser.add_argument("--confirm-ratio", type=float, default=0.5)
+    parser.add_argument("--hold-seconds", type=float, default=5.0)
+    parser.add_argument("--reaper-interval", type=float, default=0.1)
+    parser.add_argument("--backend", default="wal", choices=["json", "wal", "sqlite"])
+    args = parser.parse_args()
+
+    random.seed(1)
+    import app as tickets_app
+    from holds import HoldReaper
+    from inventory import Inventory
+    from repository import open_repository
+
+    logging.disable(logging.INFO)
+    event = {"id": EVENT_ID, "capacity": args.capacity}
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "tickets.json")
+        repository = open_repository(path, args.backend, indexes=tickets_app.TICKET_INDEXES)
+        inventory = Inventory(repository, path + ".inventory.lock")
+        reaper = HoldReaper(repository, inventory, interval=args.reaper_interval)
+        tickets_app.tickets_repository = repository
+        tickets_app.inventory = inventory
+        tickets_app.hold_reaper = reaper
+        tickets_app.HOLD_SECONDS = args.hold_seconds
+        # No usuarios/eventos: every buyer and the event exist.
+        tickets_app.validate_references = lambda data: (event, None)
+        reaper.start()
+
+        admitted, sold_out, confirmed, elapsed = run_wave(
+            tickets_app, args.holders, args.threads, args.confirm_ratio)
+        sold = inventory.sold(EVENT_ID)
+        print(f"[{args.backend}] {args.holders:,} holders, capacity {args.capacity:,}: "
+              f"{admitted:,} admitted, {sold_out:,} sold out, {confirmed:,} confirmed "
+              f"in {elapsed:.2f} s ({args.holders / elapsed:,.0f} req/s)")
+        assert sold <= args.capacity, f"oversold: {sold} seats"
+
+        # Wait for the abandoned holds to come back to the pool.
+        start = time.perf_counter()
+        deadline = start + args.hold_seconds + 30
+        while inventory.sold(EVENT_ID) > confirmed and time.perf_counter() < deadline:
+            time.sleep(0.01)
+        recycled = time.perf_counter() - start
+        released = sold - inventory.sold(EVENT_ID)
+        print(f"reaper returned {released:,} seats {recycled:.2f} s after the wave "
+              f"(hold {args.hold_seconds:g} s, reaper every {args.reaper_interval:g} s)")
+
+        admitted, sold_out, _, elapsed = run_wave(
+            tickets_app, args.holders, args.threads, 0)
+        sold = inventory.sold(EVENT_ID)
+        print(f"second wave: {admitted:,} admitted, {sold_out:,} sold out "
+              f"in {elapsed:.2f} s; {sold:,}/{args.capacity:,} seats taken")
+        assert sold <= args.capacity, f"oversold: {sold} seats"
+
+
+if __name__ == "__main__":
+    main()
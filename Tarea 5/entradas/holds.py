@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+
+HELD = "held"
+EXPIRED = "expired"
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """Hashed timing wheel of deadlines.
+
+    ``slots`` buckets of ``resolution`` seconds each: scheduling and
+    cancelling are O(1), and advance() only looks at the buckets the clock
+    went through since the last call. Deadlines further away than one turn
+    of the wheel stay in their bucket until a later turn reaches them.
+    """
+
+    def __init__(self, resolution=1.0, slots=512, clock=time.time):
+        self.resolution = resolution
+        self._slots = [{} for _ in range(slots)]  # key -> deadline
+        self._slot_of = {}
+        self._tick = self._tick_of(clock())
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._slot_of)
+
+    def schedule(self, key, deadline):
+        with self._lock:
+            self._discard(key)
+            slot = max(self._tick_of(deadline), self._tick) % len(self._slots)
+            self._slots[slot][key] = deadline
+            self._slot_of[key] = slot
+
+    def cancel(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def advance(self, now):
+        """Remove and return the keys whose deadline is ``now`` or earlier."""
+        with self._lock:
+            target = self._tick_of(now)
+            first = max(self._tick, target - len(self._slots) + 1)
+            due = []
+            for tick in range(first, target + 1):
+                slot = self._slots[tick % len(self._slots)]
+                expired = [key for key, deadline in slot.items() if deadline <= now]
+                for key in expired:
+                    del slot[key]
+                    del self._slot_of[key]
+                due.extend(expired)
+            self._tick = max(self._tick, target)
+            return due
+
+    def _tick_of(self, seconds):
+        return int(seconds // self.resolution)
+
+    def _discard(self, key):
+        slot = self._slot_of.pop(key, None)
+        if slot is not None:
+            del self._slots[slot][key]
+
+
+def expire_holds(repository, ticket_ids, now):
+    """Mark the ``ticket_ids`` still held past their deadline as expired.
+
+    Returns the expired tickets; they are written in one update_many().
+    Callers hold the event's inventory lock.
+    """
+    tickets = repository.get_many(ticket_ids).values()
+    due = {ticket["id"]: {"status": EXPIRED} for ticket in tickets
+           if ticket["status"] == HELD and ticket["holdExpiresAt"] <= now}
+    return repository.update_many(due) if due else []
+
+
+def reclaim_expired(repository, event_id, now):
+    """Expire the lapsed holds of one event, found through the indexes."""
+    held = repository.find({"eventId": event_id, "status": HELD})
+    return expire_holds(repository, [ticket["id"] for ticket in held], now)
+
+
+class HoldReaper:
+    """Returns expired holds to the inventory in bulk.
+
+    Every worker tracks the holds it creates, plus every hold found when it
+    starts, in a TimerWheel. A daemon thread advances the wheel each
+    ``interval`` seconds and expires the due holds event by event, under the
+    event's inventory lock and with one repository write per event. Expiring
+    is idempotent, so holds reaped by several workers are harmless.
+    """
+
+    def __init__(self, repository, inventory, interval=1.0, clock=time.time):
+        self._repository = repository
+        self._inventory = inventory
+        self.interval = interval
+        self._clock = clock
+        self.wheel = TimerWheel(resolution=interval, clock=clock)
+        self._started = False
+
+    def track(self, ticket):
+        self.wheel.schedule((ticket["eventId"], ticket["id"]), ticket["holdExpiresAt"])
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        for ticket in self._repository.find({"status": HELD}):
+            self.track(ticket)
+        threading.Thread(target=self._run, name="hold-reaper", daemon=True).start()
+
+    def reap(self, now=None):
+        """Expire every due hold; return how many were expired."""
+        now = self._clock() if now is None else now
+        by_event = defaultdict(list)
+        for event_id, ticket_id in self.wheel.advance(now):
+            by_event[event_id].append(ticket_id)
+        expired = 0
+        for event_id, ticket_ids in by_event.items():
+            with self._inventory.locked(event_id):
+                expired += len(expire_holds(self._repository, ticket_ids, now))
+        if expired:
+            logger.info("Expired %d ticket holds", expired)
+        return expired
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.reap()
+            except Exception:
+                logger.exception("Could not expire ticket holds")
@@ -0,0 +1,91 @@
+import fcntl
+import threading
+from contextlib import contextmanager
+
+# Ticket statuses that give the seat back to the event
+RELEASED_STATUSES = ("cancelled", "expired")
+
+
+def seat_event(ticket):
+    """Id of the event whose capacity ``ticket`` takes up, or None."""
+    if ticket.get("status") in RELEASED_STATUSES:
+        return None
+    return ticket.get("eventId")
+
+
+# Derived repository index: event id -> tickets currently holding a seat
+SEATS_INDEX = ("seats", lambda ticket: [] if seat_event(ticket) is None
+               else [seat_event(ticket)])
+
+
+class SoldOut(Exception):
+    """The event has no free seat left."""
+
+    def __init__(self, event_id):
+        super().__init__(f"Event {event_id} is sold out")
+        self.event_id = event_id
+
+
+class Inventory:
+    """Seat counts per event with atomic admission.
+
+    The sold count of an event is the size of its bucket in the tickets
+    repository's ``seats`` index, which is maintained on every write, so no
+    ticket is scanned. admit() checks the count and writes the ticket while
+    holding the event's stripe lock: a thread lock inside the worker plus an
+    fcntl byte-range lock on ``lock_path`` shared by the gunicorn workers.
+    Events are spread over ``stripes`` locks, so a hot event only delays
+    the few events that share its stripe.
+    """
+
+    def __init__(self, repository, lock_path, stripes=64):
+        self._repository = repository
+        self._lock_path = lock_path
+        self.stripes = stripes
+        self._thread_locks = [threading.Lock() for _ in range(stripes)]
+        self._file = None
+        self._file_guard = threading.Lock()
+
+    def sold(self, event_id):
+        return self._repository.count_by(SEATS_INDEX[0], event_id)
+
+    def admit(self, ticket, capacity, write, current=None, reclaim=None):
+        """Run ``write()`` if ``ticket`` fits in its event; return its result.
+
+        ``current`` returns the stored ticket being replaced, for updates: a
+        ticket that already holds a seat in the same event needs no new one.
+        When the event is full, ``reclaim(event_id)`` may free seats (e.g.
+        lapsed holds) before giving up. Tickets without a seat and events
+        without a ``capacity`` are not limited. Raises SoldOut when the event
+        is full.
+        """
+        event_id = seat_event(ticket)
+        if event_id is None or capacity is None:
+            return write()
+        with self.locked(event_id):
+            held = current is not None and seat_event(current() or {}) == event_id
+            if not held and self.sold(event_id) >= capacity:
+                if reclaim is None or not reclaim(event_id) \
+                        or self.sold(event_id) >= capacity:
+                    raise SoldOut(event_id)
+            return write()
+
+    @contextmanager
+    def locked(self, event_id):
+        """Hold the event's stripe lock, in this worker and across workers."""
+        # Ids are integers, so every worker maps an event to the same stripe.
+        stripe = int(event_id) % self.stripes
+        with self._thread_locks[stripe]:
+            fileVar = self._lock_file()
+            fcntl.lockf(fileVar, fcntl.LOCK_EX, 1, stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(fileVar, fcntl.LOCK_UN, 1, stripe)
+
+    def _lock_file(self):
+        # Opened on first use, after gunicorn has forked the worker.
+        with self._file_guard:
+            if self._file is None:
+                self._file = open(self._lock_path, "a+")
+            return self._file
@@ -0,0 +1,87 @@
+import fcntl
+import logging
+import os
+import threading
+
+# Records flagged ``"published": False`` have an event waiting to be relayed
+PUBLISHED_FIELD = "published"
+UNPUBLISHED_INDEX = ("unpublished",
+                     lambda record: [1] if record.get(PUBLISHED_FIELD) is False else [])
+
+logger = logging.getLogger(__name__)
+
+
+class OutboxRelay:
+    """Publishes the events of records written with ``"published": False``.
+
+    The flag is written together with the record, in the same repository
+    write, so an event cannot be lost between the write and the publish,
+    and requests never wait for the broker. A daemon thread pages through
+    the ``unpublished`` index, publishes up to ``batch_size`` events with
+    ``broker.publish_many()`` (acknowledged by the broker as a whole) and
+    then flags the batch as published with one update_many().
+
+    Only one worker relays at a time: the leader holds an exclusive lock on
+    ``lease_path``, which the OS releases if its process dies, and the
+    other workers retry taking it every ``interval`` seconds. A crash
+    between publishing and flagging republishes the batch, so consumers
+    must skip duplicates. ``render(record)`` returns the ``(exchange,
+    message)`` of a record.
+    """
+
+    def __init__(self, repository, broker, lease_path, render, batch_size=100,
+                 interval=0.5):
+        self._repository = repository
+        self._broker = broker
+        self.lease_path = lease_path
+        self._render = render
+        self.batch_size = batch_size
+        self.interval = interval
+        self._wakeup = threading.Event()
+        self._lease = None
+        self._started = False
+
+    def start(self):
+        if self._started:
+            return
+        self._started = True
+        threading.Thread(target=self._run, name="outbox-relay", daemon=True).start()
+
+    def wake(self):
+        """Relay soon rather than after the next interval (after a write)."""
+        self._wakeup.set()
+
+    def is_leader(self):
+        if self._lease is None:
+            fd = os.open(self.lease_path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._lease = fd
+            logger.info("Relaying the outbox of %s", self.lease_path)
+        return True
+
+    def relay(self):
+        """Publish pending events in batches until none is left; return how many."""
+        published = 0
+        while True:
+            records, _ = self._repository.page({UNPUBLISHED_INDEX[0]: 1}, self.batch_size)
+            if not records:
+                return published
+            self._broker.publish_many([self._render(record) for record in records])
+            self._repository.update_many({record["id"]: {PUBLISHED_FIELD: True}
+                                          for record in records})
+            published += len(records)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                if self.is_leader():
+                    self.relay()
+            except Exception:
+                logger.exception("Could not relay the outbox, retrying in %s s",
+                                 self.interval)
@@ -0,0 +1,109 @@
+import multiprocessing
+import threading
+import time
+import pytest
+import repository as repository_module
+from repository import JsonRepository, LogStore, open_repository
+
+WORKERS = 4
+WRITES_PER_WORKER = 100
+BACKENDS = ["json", "wal", "sqlite"]
+
+
+def open_test_repository(path, backend):
+    if backend == "wal":
+        # A tiny threshold so compactions race with the other workers' appends.
+        return JsonRepository(path, LogStore(path, compact_min=25, compact_ratio=0.1))
+    return open_repository(path, backend)
+
+
+def writer(path, backend, worker):
+    repository = open_test_repository(path, backend)
+    for i in range(WRITES_PER_WORKER):
+        ticket = repository.add({"buyerId": worker, "eventId": i, "type": "VIP",
+                                 "price": 100, "status": "pending"})
+        if i % 10 == 0:
+            repository.update(ticket["id"], {"status": "confirmed"})
+    repository.compact()
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_parallel_writers_do_not_lose_records(tmp_path, backend):
+    path = str(tmp_path / "tickets.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=writer, args=(path, backend, worker))
+                 for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    tickets = open_test_repository(path, backend).all()
+    assert len(tickets) == WORKERS * WRITES_PER_WORKER
+    assert len({ticket["id"] for ticket in tickets}) == len(tickets)
+    for worker in range(WORKERS):
+        written = sorted(t["eventId"] for t in tickets if t["buyerId"] == worker)
+        assert written == list(range(WRITES_PER_WORKER))
+    confirmed = [t for t in tickets if t["status"] == "confirmed"]
+    assert len(confirmed) == WORKERS * WRITES_PER_WORKER // 10
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_reader_sees_other_workers_writes(tmp_path, backend):
+    path = str(tmp_path / "tickets.json")
+    reader = open_test_repository(path, backend)
+    writer_repository = open_test_repository(path, backend)
+
+    ticket = writer_repository.add({"buyerId": 1, "eventId": 1, "type": "VIP",
+                                    "price": 100, "status": "pending"})
+    assert reader.get(ticket["id"]) == ticket
+
+    writer_repository.delete(ticket["id"])
+    assert reader.get(ticket["id"]) is None
+    assert reader.all() == []
+
+
+def add_once(path, backend, worker):
+    repository = open_repository(path, backend, indexes=("ticketId",))
+    for ticket_id in range(WRITES_PER_WORKER):
+        repository.add_if_absent({"ticketId": ticket_id},
+                                 {"ticketId": ticket_id, "worker": worker})
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_add_if_absent_creates_one_record_across_workers(tmp_path, backend):
+    path = str(tmp_path / "bills.json")
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=add_once, args=(path, backend, worker))
+                 for worker in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    bills = open_repository(path, backend, indexes=("ticketId",)).all()
+    assert sorted(bill["ticketId"] for bill in bills) == list(range(WRITES_PER_WORKER))
+
+
+def test_reads_wait_for_a_compaction_reopening_the_log(tmp_path, monkeypatch):
+    path = str(tmp_path / "tickets.json")
+    repository = JsonRepository(path, LogStore(path))
+    ticket = repository.add({"buyerId": 1, "eventId": 1, "status": "pending"})
+    reopening = threading.Event()
+
+    def slow_open(file, mode="r", *args, **kwargs):
+        # Hold the compaction between closing the old log and opening the new one.
+        if file == path + ".log" and mode == "ab":
+            reopening.set()
+            time.sleep(0.2)
+        return open(file, mode, *args, **kwargs)
+
+    monkeypatch.setattr(repository_module, "open", slow_open, raising=False)
+    compactor = threading.Thread(target=repository.compact)
+    compactor.start()
+    assert reopening.wait(5)
+    assert repository.get(ticket["id"]) == ticket
+    assert len(repository) == 1
+    compactor.join()
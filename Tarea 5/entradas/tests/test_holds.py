@@ -0,0 +1,115 @@
+import pytest
+import app as tickets_app
+from holds import EXPIRED, HELD, HoldReaper, TimerWheel, reclaim_expired
+from inventory import Inventory
+from repository import open_repository
+
+HOLD = {"buyerId": 1, "eventId": 2, "type": "VIP", "price": 100}
+EVENT = {"id": 2, "capacity": 2}
+
+def test_timer_wheel_returns_due_keys_once():
+    wheel = TimerWheel(resolution=1.0, slots=4, clock=lambda: 100.0)
+    wheel.schedule("a", 101.5)
+    wheel.schedule("b", 103.0)
+    wheel.schedule("far", 110.0)  # more than one turn of the wheel away
+    wheel.schedule("cancelled", 101.0)
+    wheel.cancel("cancelled")
+    assert len(wheel) == 3
+
+    assert wheel.advance(101.0) == []
+    assert wheel.advance(102.0) == ["a"]
+    assert wheel.advance(105.0) == ["b"]
+    assert wheel.advance(105.0) == []
+    assert wheel.advance(112.0) == ["far"]
+    assert len(wheel) == 0
+
+def test_timer_wheel_reschedules_key():
+    wheel = TimerWheel(resolution=1.0, clock=lambda: 0.0)
+    wheel.schedule("a", 5.0)
+    wheel.schedule("a", 1.0)
+    assert wheel.advance(2.0) == ["a"]
+    assert wheel.advance(10.0) == []
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    repository = open_repository(str(tmp_path / "tickets.json"),
+                                 indexes=tickets_app.TICKET_INDEXES)
+    monkeypatch.setattr(tickets_app, "tickets_repository", repository)
+    return repository
+
+@pytest.fixture
+def inventory(repository, tmp_path):
+    return Inventory(repository, str(tmp_path / "inventory.lock"))
+
+@pytest.fixture
+def client(repository, inventory, monkeypatch):
+    monkeypatch.setattr(tickets_app, "inventory", inventory)
+    monkeypatch.setattr(tickets_app, "hold_reaper", HoldReaper(repository, inventory))
+    monkeypatch.setattr(tickets_app, "validate_references", lambda data: (EVENT, None))
+    tickets_app.app.config['TESTING'] = True
+    with tickets_app.app.test_client() as client:
+        yield client
+
+def test_hold_then_confirm(client, repository):
+    rv = client.post('/tickets/holds', json=HOLD)
+    assert rv.status_code == 201
+    ticket = rv.get_json()
+    assert ticket["status"] == HELD and ticket["holdExpiresAt"] > 0
+    assert len(tickets_app.hold_reaper.wheel) == 1
+
+    rv = client.post(f'/tickets/{ticket["id"]}/confirm')
+    assert rv.status_code == 200 and rv.get_json()["status"] == "confirmed"
+    assert len(tickets_app.hold_reaper.wheel) == 0
+    assert client.post(f'/tickets/{ticket["id"]}/confirm').status_code == 409
+    assert client.post('/tickets/99/confirm').status_code == 404
+
+def test_holds_count_against_capacity_until_released(client):
+    first = client.post('/tickets/holds', json=HOLD).get_json()
+    client.post('/tickets/holds', json=HOLD)
+    rv = client.post('/tickets/holds', json=HOLD)
+    assert rv.status_code == 409
+    assert rv.get_json() == {"error": "Event sold out"}
+
+    rv = client.post(f'/tickets/{first["id"]}/release')
+    assert rv.status_code == 200 and rv.get_json()["status"] == "cancelled"
+    assert client.post('/tickets/holds', json=HOLD).status_code == 201
+
+def test_expired_hold_cannot_be_confirmed(client, monkeypatch):
+    monkeypatch.setattr(tickets_app, "HOLD_SECONDS", -1)
+    ticket = client.post('/tickets/holds', json=HOLD).get_json()
+    rv = client.post(f'/tickets/{ticket["id"]}/confirm')
+    assert rv.status_code == 409
+    assert rv.get_json() == {"error": "Hold expired"}
+    assert tickets_app.tickets_repository.get(ticket["id"])["status"] == EXPIRED
+
+def test_sold_out_event_reclaims_lapsed_holds(client, monkeypatch):
+    monkeypatch.setattr(tickets_app, "HOLD_SECONDS", -1)
+    lapsed = [client.post('/tickets/holds', json=HOLD).get_json() for _ in range(2)]
+    monkeypatch.setattr(tickets_app, "HOLD_SECONDS", 300)
+    # The reaper has not run yet: admission expires the lapsed holds itself.
+    assert client.post('/tickets/holds', json=HOLD).status_code == 201
+    assert client.post('/tickets', json={**HOLD, "status": "pending"}).status_code == 201
+    assert {tickets_app.tickets_repository.get(t["id"])["status"] for t in lapsed} == {EXPIRED}
+
+def test_reaper_expires_due_holds_in_bulk(repository, inventory):
+    clock = [1000.0]
+    reaper = HoldReaper(repository, inventory, clock=lambda: clock[0])
+    due = [repository.add({**HOLD, "eventId": i % 2, "status": HELD,
+                           "holdExpiresAt": 1005.0}) for i in range(4)]
+    later = repository.add({**HOLD, "status": HELD, "holdExpiresAt": 1100.0})
+    confirmed = repository.add({**HOLD, "status": HELD, "holdExpiresAt": 1005.0})
+    reaper.start()
+    repository.update(confirmed["id"], {"status": "confirmed"})
+
+    assert reaper.reap(now=1004.0) == 0
+    assert reaper.reap(now=1006.0) == 4
+    assert [t["id"] for t in repository.find({"status": EXPIRED})] == [t["id"] for t in due]
+    assert repository.get(later["id"])["status"] == HELD
+    assert repository.get(confirmed["id"])["status"] == "confirmed"
+    assert inventory.sold(0) == 0 and inventory.sold(HOLD["eventId"]) == 2
+
+def test_reclaim_expired_only_touches_lapsed_holds(repository):
+    lapsed = repository.add({**HOLD, "status": HELD, "holdExpiresAt": 10.0})
+    repository.add({**HOLD, "status": HELD, "holdExpiresAt": 30.0})
+    assert reclaim_expired(repository, HOLD["eventId"], 20.0) == [{**lapsed, "status": EXPIRED}]
+    assert reclaim_expired(repository, HOLD["eventId"], 20.0) == []
@@ -0,0 +1,80 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+import requests
+import http_client
+from flask import Flask, g
+from log_utils import CORRELATION_ID_HEADER
+
+class EchoHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        if self.path == "/slow":
+            threading.Event().wait(1)
+        if self.path == "/etag" and self.headers.get("If-None-Match") == '"v1"':
+            self.send_response(304)
+            self.send_header("ETag", '"v1"')
+            self.end_headers()
+            return
+        body = (self.headers.get(CORRELATION_ID_HEADER) or "").encode()
+        self.send_response(404 if self.path == "/missing" else 200)
+        if self.path == "/etag":
+            body = b"full body"
+            self.send_header("ETag", '"v1"')
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.connections.add(self.client_address)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+    server.connections = set()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def url(server, path="/"):
+    return f"http://127.0.0.1:{server.server_port}{path}"
+
+def test_injects_correlation_id_inside_requests(server):
+    app = Flask(__name__)
+    with app.test_request_context():
+        g.correlation_id = "abc-123"
+        assert http_client.get(url(server)).text == "abc-123"
+    assert http_client.get(url(server)).text == ""
+
+def test_reuses_keep_alive_connections(server, monkeypatch):
+    monkeypatch.setattr(http_client, "session", http_client.create_session())
+    for _ in range(5):
+        assert http_client.get(url(server)).status_code == 200
+    assert len(server.connections) == 1
+
+def test_read_timeout(server, monkeypatch):
+    monkeypatch.setattr(http_client, "READ_TIMEOUT", 0.1)
+    with pytest.raises(requests.exceptions.Timeout):
+        http_client.get(url(server, "/slow"))
+
+def test_get_all_returns_responses_in_order(server):
+    responses = http_client.get_all([url(server, "/slow"), url(server)])
+    assert [response.status_code for response in responses] == [200, 200]
+
+def test_get_all_short_circuits_on_first_failure(server):
+    start = time.perf_counter()
+    slow, failed = http_client.get_all([url(server, "/slow"), url(server, "/missing")])
+    assert time.perf_counter() - start < 0.5
+    assert slow is None and failed.status_code == 404
+
+def test_revalidates_responses_with_an_etag(server, monkeypatch):
+    monkeypatch.setattr(http_client, "etag_cache", type(http_client.etag_cache)())
+    first = http_client.get(url(server, "/etag"))
+    second = http_client.get(url(server, "/etag"))
+    assert second is first and second.text == "full body"
+    assert http_client.get_all([url(server, "/etag")]) == [first]
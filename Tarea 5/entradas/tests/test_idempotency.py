@@ -0,0 +1,117 @@
+import pytest
+import app as tickets_app
+from idempotency import (DONE, IN_PROGRESS, MISMATCH, STARTED, IdempotencyStore)
+from inventory import Inventory
+from repository import open_repository
+
+TICKET = {"buyerId": 1, "eventId": 2, "type": "VIP", "price": 100, "status": "pending"}
+
+@pytest.fixture
+def clock():
+    return [1000.0]
+
+@pytest.fixture
+def store(tmp_path, clock):
+    return IdempotencyStore(str(tmp_path / "idempotency.db"), ttl=60, pending_ttl=10,
+                            clock=lambda: clock[0])
+
+def test_store_is_shared_between_workers(store, clock):
+    other = IdempotencyStore(store.path, ttl=60, clock=lambda: clock[0])
+    assert store.begin("POST /tickets", "k", "a") == (STARTED, None)
+    assert other.begin("POST /tickets", "k", "a") == (IN_PROGRESS, None)
+    assert other.begin("POST /tickets", "k", "b") == (MISMATCH, None)
+    assert other.begin("POST /bills", "k", "b") == (STARTED, None)
+
+    store.finish("POST /tickets", "k", 201, b"{}", "application/json")
+    assert other.begin("POST /tickets", "k", "a") == (DONE, (201, b"{}", "application/json"))
+
+def test_keys_expire(store, clock):
+    store.begin("POST /tickets", "done", "a")
+    store.finish("POST /tickets", "done", 201, b"{}", "application/json")
+    store.begin("POST /tickets", "stuck", "a")
+
+    clock[0] += 30  # the stuck request's worker is presumed dead
+    assert store.begin("POST /tickets", "stuck", "a") == (STARTED, None)
+    assert store.begin("POST /tickets", "done", "a")[0] == DONE
+    clock[0] += 31
+    assert store.begin("POST /tickets", "done", "b") == (STARTED, None)
+
+def test_abandoned_request_can_be_retried(store):
+    store.begin("POST /tickets", "k", "a")
+    store.abandon("POST /tickets", "k")
+    assert store.begin("POST /tickets", "k", "b") == (STARTED, None)
+
+def test_prune_keeps_newest_keys(store, clock):
+    store.max_keys = 3
+    for i in range(5):
+        clock[0] += 1
+        store.begin("POST /tickets", f"k{i}", "a")
+    store.prune()
+    assert len(store) == 3
+    assert store.begin("POST /tickets", "k4", "a") == (IN_PROGRESS, None)
+    assert store.begin("POST /tickets", "k0", "a") == (STARTED, None)
+
+@pytest.fixture
+def validations(tmp_path, monkeypatch, store):
+    repository = open_repository(str(tmp_path / "tickets.json"),
+                                 indexes=tickets_app.TICKET_INDEXES)
+    monkeypatch.setattr(tickets_app, "tickets_repository", repository)
+    monkeypatch.setattr(tickets_app, "inventory",
+                        Inventory(repository, str(tmp_path / "inventory.lock")))
+    monkeypatch.setattr(tickets_app, "idempotency_store", store)
+    calls = []
+    def validate_references(data):
+        calls.append(data)
+        return {"id": data["eventId"]}, None
+    monkeypatch.setattr(tickets_app, "validate_references", validate_references)
+    return calls
+
+@pytest.fixture
+def client(validations):
+    tickets_app.app.config['TESTING'] = True
+    with tickets_app.app.test_client() as client:
+        yield client
+
+def test_retry_replays_the_first_response(client, validations):
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post('/tickets', json=TICKET, headers=headers)
+    # Same content with another key order is the same request.
+    retry = client.post('/tickets', json=dict(reversed(TICKET.items())), headers=headers)
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert retry.headers["Idempotent-Replayed"] == "true"
+    assert len(validations) == 1
+    assert len(tickets_app.tickets_repository) == 1
+
+    assert client.post('/tickets', json={**TICKET, "price": 5}, headers=headers).status_code == 422
+    assert client.post('/tickets', json=TICKET).status_code == 201
+    assert len(tickets_app.tickets_repository) == 2
+
+def test_concurrent_retry_is_a_conflict(client, validations, monkeypatch):
+    headers = {"Idempotency-Key": "busy"}
+    retries = []
+    def validate_references(data):
+        # The client retries while the first request is still validating.
+        retries.append(tickets_app.app.test_client().post('/tickets', json=TICKET,
+                                                          headers=headers))
+        return {"id": data["eventId"]}, None
+    monkeypatch.setattr(tickets_app, "validate_references", validate_references)
+    assert client.post('/tickets', json=TICKET, headers=headers).status_code == 201
+    assert retries[0].status_code == 409
+
+def test_server_errors_are_not_replayed(client, monkeypatch):
+    validate_references = tickets_app.validate_references
+    monkeypatch.setattr(tickets_app, "validate_references",
+                        lambda data: (None, (tickets_app.jsonify({"error": "down"}), 500)))
+    headers = {"Idempotency-Key": "flaky"}
+    assert client.post('/tickets', json=TICKET, headers=headers).status_code == 500
+
+    monkeypatch.setattr(tickets_app, "validate_references", validate_references)
+    assert client.post('/tickets', json=TICKET, headers=headers).status_code == 201
+
+def test_client_errors_are_replayed(client, validations):
+    headers = {"Idempotency-Key": "invalid"}
+    assert client.post('/tickets', json={"price": 1}, headers=headers).status_code == 400
+    rv = client.post('/tickets', json={"price": 1}, headers=headers)
+    assert rv.status_code == 400 and rv.headers["Idempotent-Replayed"] == "true"
+    assert client.post('/tickets', json=TICKET, headers={"Idempotency-Key": ""}).status_code == 400
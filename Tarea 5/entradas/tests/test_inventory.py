@@ -0,0 +1,49 @@
+import multiprocessing
+import pytest
+from inventory import SEATS_INDEX, Inventory, SoldOut
+from repository import open_repository
+
+CAPACITY = 50
+WORKERS = 4
+ATTEMPTS_PER_WORKER = 30
+TICKET = {"buyerId": 1, "eventId": 7, "type": "VIP", "price": 100, "status": "pending"}
+
+def open_inventory(path, backend):
+    repository = open_repository(path, backend, indexes=("eventId", SEATS_INDEX))
+    return repository, Inventory(repository, path + ".inventory.lock", stripes=8)
+
+def buyer(path, backend, sold):
+    repository, inventory = open_inventory(path, backend)
+    for _ in range(ATTEMPTS_PER_WORKER):
+        try:
+            inventory.admit(TICKET, CAPACITY, lambda: repository.add(TICKET))
+            with sold.get_lock():
+                sold.value += 1
+        except SoldOut:
+            pass
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_parallel_buyers_never_oversell(tmp_path, backend):
+    path = str(tmp_path / "tickets.json")
+    context = multiprocessing.get_context("fork")
+    sold = context.Value("i", 0)
+    processes = [context.Process(target=buyer, args=(path, backend, sold))
+                 for _ in range(WORKERS)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=120)
+        assert process.exitcode == 0
+
+    repository, inventory = open_inventory(path, backend)
+    assert sold.value == CAPACITY
+    assert inventory.sold(TICKET["eventId"]) == CAPACITY
+    assert len(repository.find({"eventId": TICKET["eventId"]})) == CAPACITY
+
+def test_unlimited_without_capacity_or_seat(tmp_path):
+    repository, inventory = open_inventory(str(tmp_path / "tickets.json"), "json")
+    cancelled = {**TICKET, "status": "cancelled"}
+    inventory.admit(cancelled, 0, lambda: repository.add(cancelled))
+    with pytest.raises(SoldOut):
+        inventory.admit(TICKET, 0, lambda: repository.add(TICKET))
+    assert inventory.admit(TICKET, None, lambda: repository.add(TICKET))["id"] == 2
@@ -0,0 +1,27 @@
+from messaging import LocalBroker, PURCHASES_EXCHANGE
+
+def test_queue_consumers_compete_for_messages():
+    broker = LocalBroker()
+    first, second = [], []
+    broker.consume(PURCHASES_EXCHANGE, "facturacion.compras", first.append)
+    broker.consume(PURCHASES_EXCHANGE, "facturacion.compras", second.append)
+    broker.publish(PURCHASES_EXCHANGE, {"ticketId": 1})
+    assert first == [{"ticketId": 1}] and second == []
+
+def test_every_queue_gets_a_copy_and_failures_are_isolated():
+    broker = LocalBroker()
+    received = []
+    def failing(message):
+        raise RuntimeError("database is down")
+    broker.consume(PURCHASES_EXCHANGE, "facturacion.compras", failing)
+    broker.consume(PURCHASES_EXCHANGE, "notificaciones.compras", received.append)
+    broker.publish(PURCHASES_EXCHANGE, {"ticketId": 1})
+    assert received == [{"ticketId": 1}]
+
+def test_publish_many_delivers_in_order():
+    broker = LocalBroker()
+    subscribed, consumed = [], []
+    broker.subscribe(PURCHASES_EXCHANGE, subscribed.append)
+    broker.consume(PURCHASES_EXCHANGE, "facturacion.compras", consumed.append)
+    broker.publish_many([(PURCHASES_EXCHANGE, {"ticketId": i}) for i in range(3)])
+    assert subscribed == consumed == [{"ticketId": i} for i in range(3)]
@@ -0,0 +1,72 @@
+import time
+import pytest
+from messaging import LocalBroker
+from outbox import PUBLISHED_FIELD, UNPUBLISHED_INDEX, OutboxRelay
+from repository import open_repository
+
+def render(record):
+    return "compras", {"ticketId": record["id"]}
+
+@pytest.fixture
+def broker():
+    broker = LocalBroker()
+    broker.messages = []
+    broker.subscribe("compras", broker.messages.append)
+    return broker
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_relay_publishes_pending_records_in_batches(tmp_path, broker, backend):
+    repository = open_repository(str(tmp_path / "tickets.json"), backend,
+                                 indexes=(UNPUBLISHED_INDEX,))
+    batches = []
+    publish_many = broker.publish_many
+    broker.publish_many = lambda messages: (batches.append(len(messages)),
+                                            publish_many(messages))
+    for i in range(5):
+        repository.add({"status": "confirmed", PUBLISHED_FIELD: False})
+    repository.add({"status": "pending"})  # no event to publish
+
+    relay = OutboxRelay(repository, broker, str(tmp_path / "outbox.lock"), render,
+                        batch_size=2)
+    assert relay.relay() == 5
+    assert batches == [2, 2, 1]
+    assert broker.messages == [{"ticketId": i} for i in range(1, 6)]
+    assert relay.relay() == 0
+    assert all(record.get(PUBLISHED_FIELD, True) for record in repository.all())
+
+def test_failed_publish_keeps_events_pending(tmp_path, broker):
+    repository = open_repository(str(tmp_path / "tickets.json"), indexes=(UNPUBLISHED_INDEX,))
+    repository.add({PUBLISHED_FIELD: False})
+    relay = OutboxRelay(repository, broker, str(tmp_path / "outbox.lock"), render)
+    publish_many = broker.publish_many
+    def unavailable(messages):
+        raise OSError("broker down")
+    broker.publish_many = unavailable
+    with pytest.raises(OSError):
+        relay.relay()
+    assert repository.count_by(UNPUBLISHED_INDEX[0], 1) == 1
+
+    broker.publish_many = publish_many
+    assert relay.relay() == 1
+    assert repository.count_by(UNPUBLISHED_INDEX[0], 1) == 0
+
+def test_only_one_relay_holds_the_lease(tmp_path, broker):
+    repository = open_repository(str(tmp_path / "tickets.json"))
+    lease = str(tmp_path / "outbox.lock")
+    first = OutboxRelay(repository, broker, lease, render)
+    second = OutboxRelay(repository, broker, lease, render)
+    assert first.is_leader() and first.is_leader()
+    assert not second.is_leader()
+
+def test_woken_relay_thread_publishes_new_events(tmp_path, broker):
+    repository = open_repository(str(tmp_path / "tickets.json"),
+                                 indexes=(UNPUBLISHED_INDEX,))
+    relay = OutboxRelay(repository, broker, str(tmp_path / "outbox.lock"), render,
+                        interval=60)
+    relay.start()
+    record = repository.add({"status": "confirmed", PUBLISHED_FIELD: False})
+    relay.wake()
+    deadline = time.monotonic() + 5
+    while not broker.messages and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert broker.messages == [{"ticketId": record["id"]}]
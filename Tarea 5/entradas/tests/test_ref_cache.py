@@ -0,0 +1,49 @@
+from ref_cache import RefCache
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+def test_positive_and_negative_ttls():
+    clock = FakeClock()
+    cache = RefCache(ttl=30, negative_ttl=5, clock=clock)
+    cache.put(("users", 1), True)
+    cache.put(("users", 2), False)
+    assert cache.get(("users", 1)) is True
+    assert cache.get(("users", 2)) is False
+
+    clock.now = 5
+    assert cache.get(("users", 2)) is None
+    assert cache.get(("users", 1)) is True
+    clock.now = 30
+    assert cache.get(("users", 1)) is None
+    assert cache.stats()["expirations"] == 2
+
+def test_lru_eviction():
+    cache = RefCache(max_size=2)
+    cache.put(("users", 1), True)
+    cache.put(("users", 2), True)
+    cache.get(("users", 1))
+    cache.put(("users", 3), True)
+    assert cache.get(("users", 2)) is None
+    assert cache.get(("users", 1)) is True
+    assert cache.stats() == {"size": 2, "maxSize": 2, "hits": 2, "misses": 1,
+                             "evictions": 1, "expirations": 0}
+
+def test_invalidate():
+    cache = RefCache()
+    cache.put(("users", 1), True)
+    cache.put(("events", 1), True)
+    cache.invalidate(("users", 1))
+    assert cache.get(("users", 1)) is None
+    assert cache.get(("events", 1)) is True
+    cache.invalidate()
+    assert cache.stats()["size"] == 0
+
+def test_zero_ttl_disables_caching():
+    cache = RefCache(negative_ttl=0)
+    cache.put(("users", 1), False)
+    assert cache.get(("users", 1)) is None
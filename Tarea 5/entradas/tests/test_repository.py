@@ -0,0 +1,308 @@
+import json
+import os
+import pytest
+import repository as repository_module
+from repository import (IdAllocator, JsonRepository, LogStore, SqliteRepository,
+                        decode_cursor, encode_cursor, iter_records,
+                        migrate_json, open_repository)
+
+TICKET = {"buyerId": 1, "eventId": 2, "type": "VIP", "price": 100, "status": "pending"}
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "tickets.json")
+
+def test_empty_when_file_missing(path):
+    repository = JsonRepository(path)
+    assert repository.all() == []
+    assert repository.get(1) is None
+
+def test_add_assigns_next_id_and_writes_through(path):
+    repository = JsonRepository(path)
+    first = repository.add(TICKET)
+    second = repository.add(TICKET)
+    assert (first["id"], second["id"]) == (1, 2)
+
+    with open(path) as fileVar:
+        assert json.load(fileVar) == [first, second]
+
+def test_reload_from_file(path):
+    repository = JsonRepository(path)
+    ticket = repository.add(TICKET)
+
+    reloaded = JsonRepository(path)
+    assert reloaded.get(ticket["id"]) == ticket
+    assert len(reloaded) == 1
+
+def test_writes_catch_up_with_other_workers(path):
+    # Both loaded the file before either wrote; saving a stale copy would
+    # drop the other worker's tickets.
+    first = JsonRepository(path)
+    second = JsonRepository(path)
+    assert first.all() == second.all() == []
+    ticket = first.add(TICKET)
+    second.add({**TICKET, "buyerId": 2})
+    first.add(TICKET)
+    second.update(ticket["id"], {"status": "confirmed"})
+
+    assert sorted(ticket["buyerId"] for ticket in first.all()) == [1, 1, 2]
+    assert first.get(ticket["id"])["status"] == "confirmed"
+    assert JsonRepository(path).all() == first.all()
+
+def test_update_and_delete(path):
+    repository = JsonRepository(path)
+    ticket = repository.add(TICKET)
+
+    updated = repository.update(ticket["id"], {**TICKET, "status": "confirmed"})
+    assert updated["status"] == "confirmed"
+    assert repository.update(99, TICKET) is None
+
+    assert repository.delete(ticket["id"]) is True
+    assert repository.delete(ticket["id"]) is False
+    assert JsonRepository(path).all() == []
+
+def test_wal_appends_and_replays(path):
+    repository = JsonRepository(path, LogStore(path))
+    first = repository.add(TICKET)
+    second = repository.add(TICKET)
+    repository.update(first["id"], {"status": "confirmed"})
+    repository.delete(second["id"])
+
+    assert not os.path.exists(path)
+    with open(path + ".log") as fileVar:
+        assert len(fileVar.readlines()) == 4
+
+    reloaded = JsonRepository(path, LogStore(path))
+    assert reloaded.all() == [{**first, "status": "confirmed"}]
+
+def test_wal_compaction_folds_log_into_snapshot(path):
+    repository = JsonRepository(path, LogStore(path, compact_min=3))
+    tickets = [repository.add(TICKET) for _ in range(2)]
+    repository.compact()
+
+    with open(path) as fileVar:
+        assert json.load(fileVar) == tickets
+    assert os.path.getsize(path + ".log") == 0
+
+    repository.add(TICKET)
+    assert JsonRepository(path, LogStore(path)).get(3) is not None
+
+def test_wal_ignores_partial_last_line(path):
+    repository = JsonRepository(path, LogStore(path))
+    ticket = repository.add(TICKET)
+    with open(path + ".log", "a") as fileVar:
+        fileVar.write('{"op":"put","record":{"id":')
+
+    reloaded = JsonRepository(path, LogStore(path))
+    assert reloaded.all() == [ticket]
+    reloaded.add(TICKET)
+    assert len(JsonRepository(path, LogStore(path))) == 2
+
+def test_wal_writes_catch_up_with_other_workers(path):
+    first = JsonRepository(path, LogStore(path))
+    second = JsonRepository(path, LogStore(path))
+    first.add(TICKET)
+    ticket = second.add(TICKET)
+    first.update(ticket["id"], {"status": "confirmed"})
+    # Compaction replaces the snapshot and the log under the other worker.
+    first.compact()
+    second.add(TICKET)
+
+    assert len(second.all()) == 3
+    assert second.get(ticket["id"])["status"] == "confirmed"
+    assert JsonRepository(path, LogStore(path)).all() == second.all()
+
+def test_open_repository_rejects_unknown_backend(path):
+    with pytest.raises(ValueError):
+        open_repository(path, "csv")
+
+def test_ids_are_not_reused_after_deleting_last(path):
+    repository = JsonRepository(path)
+    ticket = repository.add(TICKET)
+    repository.delete(ticket["id"])
+    assert repository.add(TICKET)["id"] == ticket["id"] + 1
+    assert JsonRepository(path).add(TICKET)["id"] > ticket["id"] + 1
+
+def test_id_blocks_are_disjoint_between_workers(path):
+    first = JsonRepository(path, ids=IdAllocator(path + ".seq", block_size=10))
+    second = JsonRepository(path, ids=IdAllocator(path + ".seq", block_size=10))
+    assert [first.add(TICKET)["id"] for _ in range(3)] == [1, 2, 3]
+    assert [second.add(TICKET)["id"] for _ in range(3)] == [11, 12, 13]
+    assert first.add(TICKET)["id"] == 4
+
+def test_id_sequence_is_seeded_from_existing_data(path):
+    with open(path, "w") as fileVar:
+        json.dump([{"id": 41, **TICKET}], fileVar)
+    assert JsonRepository(path).add(TICKET)["id"] == 42
+
+def test_sqlite_crud(tmp_path):
+    repository = SqliteRepository(str(tmp_path / "tickets.db"))
+    ticket = repository.add(TICKET)
+    assert repository.get(ticket["id"]) == ticket
+
+    updated = repository.update(ticket["id"], {"status": "confirmed"})
+    assert updated == {**ticket, "status": "confirmed"}
+    assert repository.update(99, TICKET) is None
+
+    assert repository.delete(ticket["id"]) is True
+    assert repository.delete(ticket["id"]) is False
+    assert repository.add(TICKET)["id"] == ticket["id"] + 1
+    assert len(repository) == 1
+
+def test_migrate_json_keeps_ids(path, tmp_path):
+    source = JsonRepository(path, LogStore(path))
+    tickets = [source.add(TICKET) for _ in range(3)]
+    source.delete(tickets[1]["id"])
+
+    target = open_repository(path, "sqlite")
+    assert migrate_json(path, target) == 2
+    assert target.all() == [tickets[0], tickets[2]]
+    assert target.add(TICKET)["id"] == tickets[2]["id"] + 1
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_secondary_indexes_follow_writes(path, backend):
+    repository = open_repository(path, backend, indexes=("buyerId", "eventId"))
+    first = repository.add({**TICKET, "buyerId": 1, "eventId": 7})
+    second = repository.add({**TICKET, "buyerId": 2, "eventId": 7})
+    assert repository.find({"eventId": 7}) == [first, second]
+    assert repository.count_by("eventId", 7) == 2
+
+    repository.update(first["id"], {"eventId": 8})
+    assert repository.find({"eventId": 7}) == [second]
+    assert repository.find({"eventId": 8, "buyerId": 1})[0]["id"] == first["id"]
+    assert repository.find({"eventId": 8, "status": "confirmed"}) == []
+
+    repository.delete(second["id"])
+    assert repository.count_by("eventId", 7) == 0
+
+    # Another worker sees the same index state, including its own catch-up.
+    other = open_repository(path, backend, indexes=("buyerId", "eventId"))
+    assert [t["id"] for t in other.find({"buyerId": 1})] == [first["id"]]
+    repository.add({**TICKET, "buyerId": 1, "eventId": 8})
+    assert other.count_by("eventId", 8) == 2
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_index_on_list_field(path, backend):
+    repository = open_repository(path, backend, indexes=("users.id",))
+    notification = repository.add({"users": [{"id": 1}, {"id": 2}], "type": "info"})
+    repository.add({"users": [{"id": 2}], "type": "info"})
+    assert repository.find({"users.id": 1}) == [notification]
+    assert repository.count_by("users.id", 2) == 2
+
+def test_sqlite_backfills_new_indexes(path):
+    repository = open_repository(path, "sqlite")
+    ticket = repository.add(TICKET)
+    reopened = open_repository(path, "sqlite", indexes=("eventId",))
+    assert reopened.find({"eventId": TICKET["eventId"]}) == [ticket]
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_keyset_pagination(path, backend):
+    repository = open_repository(path, backend, indexes=("eventId",))
+    tickets = [repository.add({**TICKET, "eventId": i % 2}) for i in range(7)]
+    even = [t for t in tickets if t["eventId"] == 0]
+
+    page, after = repository.page({"eventId": 0}, limit=2)
+    assert page == even[:2]
+    page, after = repository.page({"eventId": 0}, limit=2, after=after)
+    assert page == even[2:4] and after is None
+
+    page, after = repository.page({}, limit=5)
+    assert page == tickets[:5]
+    # Records deleted behind the cursor do not shift the next page.
+    repository.delete(tickets[0]["id"])
+    assert repository.page({}, limit=5, after=after) == (tickets[5:], None)
+
+def test_cursor_round_trip():
+    assert decode_cursor(encode_cursor(42)) == 42
+    for cursor in ("zz", encode_cursor("x"), "bm9wZTox"):
+        with pytest.raises(ValueError):
+            decode_cursor(cursor)
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_iter_records_walks_every_batch(path, backend):
+    repository = open_repository(path, backend, indexes=("eventId",))
+    tickets = [repository.add({**TICKET, "eventId": i % 3}) for i in range(10)]
+    assert list(iter_records(repository, {}, batch_size=3)) == tickets
+    assert list(iter_records(repository, {"eventId": 0}, batch_size=2)) == tickets[::3]
+    assert list(iter_records(repository, {}, after=tickets[6]["id"], limit=2,
+                             batch_size=1)) == tickets[7:9]
+
+@pytest.mark.parametrize("backend", ["json", "sqlite"])
+def test_get_many(path, backend, monkeypatch):
+    monkeypatch.setattr(SqliteRepository, "MAX_VARIABLES", 2)
+    repository = open_repository(path, backend)
+    tickets = [repository.add(TICKET) for _ in range(5)]
+    found = repository.get_many([5, 99, 1, 3, 1])
+    assert found == {1: tickets[0], 3: tickets[2], 5: tickets[4]}
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_etags_and_generation_follow_writes(path, backend):
+    repository = open_repository(path, backend)
+    first = repository.add(TICKET)
+    second = repository.add(TICKET)
+    generation = repository.generation()
+    _, etag = repository.get_versioned(first["id"])
+    assert repository.get_versioned(first["id"]) == (first, etag)
+    assert repository.get_versioned(99) == (None, None)
+
+    other = open_repository(path, backend)
+    assert other.generation() == generation
+    other.update(first["id"], {"status": "confirmed"})
+    assert repository.get_versioned(first["id"])[1] != etag
+    assert repository.generation() != generation
+
+    generation = repository.generation()
+    other.delete(second["id"])
+    assert repository.generation() != generation
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_derived_index(path, backend):
+    active = ("active", lambda t: [] if t["status"] == "cancelled" else [t["eventId"]])
+    repository = open_repository(path, backend, indexes=("eventId", active))
+    ticket = repository.add(TICKET)
+    repository.add({**TICKET, "status": "cancelled"})
+    assert repository.count_by("active", TICKET["eventId"]) == 1
+    assert repository.find({"eventId": TICKET["eventId"], "active": TICKET["eventId"]}) == [ticket]
+
+    repository.update(ticket["id"], {"status": "cancelled"})
+    assert repository.count_by("active", TICKET["eventId"]) == 0
+    assert open_repository(path, backend, indexes=(active,)).count_by("active", TICKET["eventId"]) == 0
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_update_many(path, backend):
+    repository = open_repository(path, backend, indexes=("status",))
+    tickets = [repository.add(TICKET) for _ in range(3)]
+    updated = repository.update_many({tickets[0]["id"]: {"status": "expired"},
+                                      tickets[2]["id"]: {"status": "expired"},
+                                      99: {"status": "expired"}})
+    assert [t["id"] for t in updated] == [tickets[0]["id"], tickets[2]["id"]]
+    assert repository.count_by("status", "expired") == 2
+    assert repository.update_many({}) == []
+
+    reopened = open_repository(path, backend, indexes=("status",))
+    assert [t["id"] for t in reopened.find({"status": "expired"})] == [1, 3]
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_add_if_absent(path, backend):
+    repository = open_repository(path, backend, indexes=("ticketId",))
+    bill, created = repository.add_if_absent({"ticketId": 7}, {"ticketId": 7, "amount": 1})
+    assert created
+    again, created = repository.add_if_absent({"ticketId": 7}, {"ticketId": 7, "amount": 2})
+    assert not created and again == bill
+    assert len(repository) == 1
+
+@pytest.mark.parametrize("backend", ["json", "wal", "sqlite"])
+def test_page_scans_the_smallest_index_bucket(path, backend, monkeypatch):
+    repository = open_repository(path, backend, indexes=("status", "eventId"))
+    for event_id in range(20):
+        repository.add({**TICKET, "eventId": event_id})
+    seen = []
+    real_matches = repository_module.matches
+    def counting_matches(record, filters, indexes=None):
+        seen.append(record["id"])
+        return real_matches(record, filters, indexes)
+    monkeypatch.setattr(repository_module, "matches", counting_matches)
+
+    found = repository.find({"status": "pending", "eventId": 3})
+    assert [ticket["eventId"] for ticket in found] == [3]
+    assert len(seen) == 1
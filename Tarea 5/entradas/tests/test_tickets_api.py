@@ -0,0 +1,202 @@
+import json
+import pytest
+import app as tickets_app
+from messaging import CHANGES_EXCHANGE, PURCHASES_EXCHANGE, LocalBroker
+from ref_cache import RefCache
+from repository import open_repository
+
+TICKET = {"buyerId": 1, "eventId": 2, "type": "VIP", "price": 100, "status": "pending"}
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    repository = open_repository(str(tmp_path / "tickets.json"),
+                                 indexes=tickets_app.TICKET_INDEXES)
+    monkeypatch.setattr(tickets_app, "tickets_repository", repository)
+    return repository
+
+@pytest.fixture
+def client(repository, monkeypatch, tmp_path):
+    monkeypatch.setattr(tickets_app, "reference_cache", RefCache())
+    inventory = tickets_app.Inventory(repository, str(tmp_path / "inventory.lock"))
+    monkeypatch.setattr(tickets_app, "inventory", inventory)
+    monkeypatch.setattr(tickets_app, "hold_reaper", tickets_app.HoldReaper(repository, inventory))
+    tickets_app.app.config['TESTING'] = True
+    with tickets_app.app.test_client() as client:
+        yield client
+
+def test_get_tickets_empty(client):
+    rv = client.get('/tickets')
+    assert rv.status_code == 200
+    assert rv.get_json() == []
+    assert "X-Next-Cursor" not in rv.headers
+
+def test_paginate_tickets_with_filters(client, repository):
+    for i in range(5):
+        repository.add({**TICKET, "status": "confirmed" if i % 2 else "pending"})
+
+    seen = []
+    rv = client.get('/tickets?status=pending&limit=2')
+    while True:
+        assert rv.status_code == 200
+        seen += [ticket["id"] for ticket in rv.get_json()]
+        if "X-Next-Cursor" not in rv.headers:
+            break
+        rv = client.get(f'/tickets?status=pending&limit=2&cursor={rv.headers["X-Next-Cursor"]}')
+    assert seen == [1, 3, 5]
+
+def test_invalid_list_query(client):
+    assert client.get('/tickets?limit=0').status_code == 400
+    assert client.get('/tickets?eventId=abc').status_code == 400
+    assert client.get('/tickets?cursor=not-a-cursor').status_code == 400
+
+def test_stream_tickets_as_ndjson(client, repository):
+    tickets = [repository.add(TICKET) for _ in range(3)]
+    rv = client.get('/tickets', headers={"Accept": "application/x-ndjson"})
+    assert rv.status_code == 200
+    assert rv.mimetype == "application/x-ndjson"
+    assert [json.loads(line) for line in rv.get_data(as_text=True).splitlines()] == tickets
+
+    rv = client.get('/tickets?limit=1', headers={"Accept": "application/x-ndjson"})
+    assert len(rv.get_data(as_text=True).splitlines()) == 1
+
+def test_unreachable_service_is_a_server_error(client, monkeypatch):
+    def unreachable(urls):
+        raise tickets_app.requests.exceptions.ConnectionError(urls[0])
+    monkeypatch.setattr(tickets_app.http_client, "get_all", unreachable)
+    rv = client.post('/tickets', json=TICKET)
+    assert rv.status_code == 500
+    assert rv.get_json() == {"error": "Unable to verify buyer and event"}
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body if body is not None else {"id": 1, "capacity": 100}
+
+    def json(self):
+        return self.body
+
+@pytest.mark.parametrize("responses, error", [
+    ((FakeResponse(404), None), "Buyer not found"),
+    ((None, FakeResponse(404)), "Event not found"),
+])
+def test_first_failed_reference_is_reported(client, monkeypatch, responses, error):
+    monkeypatch.setattr(tickets_app.http_client, "get_all", lambda urls: list(responses))
+    rv = client.post('/tickets', json=TICKET)
+    assert rv.status_code == 404
+    assert rv.get_json() == {"error": error}
+
+def test_add_ticket_with_valid_references(client, monkeypatch):
+    monkeypatch.setattr(tickets_app.http_client, "get_all",
+                        lambda urls: [FakeResponse(200) for _ in urls])
+    rv = client.post('/tickets', json=TICKET)
+    assert rv.status_code == 201
+    assert rv.get_json() == {**TICKET, "id": 1}
+
+def test_references_are_cached(client, monkeypatch):
+    calls = []
+    def get_all(urls):
+        calls.append(urls)
+        return [FakeResponse(200) for _ in urls]
+    monkeypatch.setattr(tickets_app.http_client, "get_all", get_all)
+    client.post('/tickets', json=TICKET)
+    client.post('/tickets', json=TICKET)
+    client.post('/tickets', json={**TICKET, "eventId": 3})
+    assert [len(urls) for urls in calls] == [2, 1]
+    stats = client.get('/cache/stats').get_json()
+    assert (stats["hits"], stats["misses"]) == (3, 3)
+
+def test_server_errors_are_not_cached(client, monkeypatch):
+    monkeypatch.setattr(tickets_app.http_client, "get_all",
+                        lambda urls: [FakeResponse(503) for _ in urls])
+    assert client.post('/tickets', json=TICKET).status_code == 404
+    assert tickets_app.reference_cache.stats()["size"] == 0
+
+def test_change_events_evict_cached_references(client, monkeypatch):
+    monkeypatch.setattr(tickets_app.http_client, "get_all",
+                        lambda urls: [FakeResponse(200) for _ in urls])
+    client.post('/tickets', json=TICKET)
+    assert tickets_app.reference_cache.get(("users", TICKET["buyerId"]))
+
+    tickets_app.broker.publish(CHANGES_EXCHANGE, {"resource": "users",
+                                                  "id": TICKET["buyerId"],
+                                                  "change": "deleted"})
+    assert tickets_app.reference_cache.get(("users", TICKET["buyerId"])) is None
+    assert tickets_app.reference_cache.get(("events", TICKET["eventId"]))
+
+def test_conditional_get_ticket(client, repository):
+    ticket = repository.add(TICKET)
+    rv = client.get(f'/tickets/{ticket["id"]}')
+    etag = rv.headers["ETag"]
+    rv = client.get(f'/tickets/{ticket["id"]}', headers={"If-None-Match": etag})
+    assert rv.status_code == 304 and rv.data == b""
+
+    repository.update(ticket["id"], {"status": "confirmed"})
+    rv = client.get(f'/tickets/{ticket["id"]}', headers={"If-None-Match": etag})
+    assert rv.status_code == 200 and rv.get_json()["status"] == "confirmed"
+
+def test_conditional_get_ticket_list(client, repository):
+    repository.add(TICKET)
+    etag = client.get('/tickets?limit=10').headers["ETag"]
+    assert client.get('/tickets?limit=10', headers={"If-None-Match": etag}).status_code == 304
+    assert client.get('/tickets?limit=5', headers={"If-None-Match": etag}).status_code == 200
+
+    repository.add(TICKET)
+    rv = client.get('/tickets?limit=10', headers={"If-None-Match": etag})
+    assert rv.status_code == 200 and len(rv.get_json()) == 2
+
+def test_capacity_is_enforced(client, monkeypatch):
+    event = {"id": TICKET["eventId"], "capacity": 2}
+    monkeypatch.setattr(tickets_app.http_client, "get_all",
+                        lambda urls: [FakeResponse(200, {"id": 1}), FakeResponse(200, event)])
+    first = client.post('/tickets', json=TICKET).get_json()
+    cancelled = client.post('/tickets', json={**TICKET, "status": "cancelled"}).get_json()
+    client.post('/tickets', json=TICKET)
+    rv = client.post('/tickets', json=TICKET)
+    assert rv.status_code == 409
+    assert rv.get_json() == {"error": "Event sold out"}
+
+    # Updating a ticket that already holds a seat is fine, reactivating one is not.
+    assert client.put(f'/tickets/{first["id"]}', json={**TICKET, "status": "confirmed"}).status_code == 200
+    assert client.put(f'/tickets/{cancelled["id"]}', json=TICKET).status_code == 409
+
+    client.delete(f'/tickets/{first["id"]}')
+    assert client.post('/tickets', json=TICKET).status_code == 201
+
+def test_updating_a_missing_ticket_of_a_full_event_is_not_found(client, monkeypatch):
+    event = {"id": TICKET["eventId"], "capacity": 1}
+    monkeypatch.setattr(tickets_app.http_client, "get_all",
+                        lambda urls: [FakeResponse(200, {"id": 1}), FakeResponse(200, event)])
+    assert client.post('/tickets', json=TICKET).status_code == 201
+    rv = client.put('/tickets/99', json=TICKET)
+    assert rv.status_code == 404
+    assert rv.get_json() == {"error": "Ticket not found"}
+
+def test_status_is_validated(client):
+    rv = client.post('/tickets', json={**TICKET, "status": "held"})
+    assert rv.status_code == 400
+    assert "status" in rv.get_json()
+
+@pytest.fixture
+def purchases(client, repository, monkeypatch, tmp_path):
+    broker = LocalBroker()
+    relay = tickets_app.OutboxRelay(repository, broker, str(tmp_path / "outbox.lock"),
+                                    tickets_app.purchase_event)
+    monkeypatch.setattr(tickets_app, "outbox_relay", relay)
+    monkeypatch.setattr(tickets_app.http_client, "get_all",
+                        lambda urls: [FakeResponse(200) for _ in urls])
+    messages = []
+    broker.subscribe(PURCHASES_EXCHANGE, messages.append)
+    return messages
+
+def test_purchase_is_accepted_and_relayed(client, purchases):
+    order = {key: TICKET[key] for key in ("buyerId", "eventId", "type", "price")}
+    rv = client.post('/purchases', json=order)
+    assert rv.status_code == 202
+    ticket = rv.get_json()
+    assert ticket.items() >= {**order, "id": 1, "status": "confirmed", "published": False}.items()
+    assert purchases == []
+
+    assert tickets_app.outbox_relay.relay() == 1
+    assert purchases == [{"ticketId": 1, "buyerId": 1, "eventId": 2, "type": "VIP",
+                          "price": 100, "purchasedAt": ticket["purchasedAt"]}]
+    assert client.get('/tickets/1').get_json()["published"] is True
@@ -1,19 +1,28 @@
-import json
 import os
-from flask import Flask, request, jsonify, g
-from marshmallow import Schema, fields, ValidationError
+from flask import Flask, Response, request, jsonify, g, stream_with_context
+from marshmallow import Schema, fields, validate, ValidationError
 from flasgger import Swagger
 import logging
 import requests
+import http_client
 from dotenv import load_dotenv
 import os
 import requests
+from messaging import create_broker, publish_change
+from etags import collection_etag, not_modified
 from log_utils import init_logging, CORRELATION_ID_HEADER
+from repository import (decode_cursor, encode_cursor, iter_records, migrate_json,
+                        open_repository)
 import uuid
 
 load_dotenv("config.env")
 
-DATA_FILE = "events.json"
+DATA_FILE = os.getenv("DATA_FILE", "events.json")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Query parameter -> indexed field path
+EVENT_FILTERS = {"organizerId": "organizerId", "location": "location"}
 USERS_SERVICE = os.getenv("USUARIOS_SERVICE")
 
 # ---------------------------- Flask App ---------------------------
@@ -59,21 +68,23 @@ class EventsSchema(Schema):
 
 events_schema = EventsSchema()
 
-#  ------------------------ File Helpers --------------------------
+class EventsQuerySchema(Schema):
+    organizerId = fields.Integer()
+    location = fields.String()
+    limit = fields.Integer(validate=validate.Range(min=1, max=MAX_PAGE_SIZE))
+    cursor = fields.String()
 
-def load_events():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r") as fileVar:
-        return json.load(fileVar)
+events_query_schema = EventsQuerySchema()
 
-def save_events(events):
-    with open(DATA_FILE, "w") as fileVar:
-        json.dump(events, fileVar, indent=2)
+#  ------------------------- Repository --------------------------
 
-def find_event(event_id):
-    events = load_events()
-    return next((event for event in events if event["id"] == event_id), None)
+events_repository = open_repository(DATA_FILE, STORAGE_BACKEND,
+                                    indexes=EVENT_FILTERS.values())
+
+#  -------------------------- Messaging --------------------------
+
+# Create/update/delete events for the services that cache events
+broker = create_broker()
 
 # ----------------------------- Routes ----------------------------
 
@@ -83,14 +94,77 @@ def find_event(event_id):
 def get_events():
     """Get all events
     ---
+    produces:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: organizerId
+        in: query
+        type: integer
+        required: false
+        description: Only events of this organizer
+      - name: location
+        in: query
+        type: string
+        required: false
+        description: Only events at this location
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-1000). Without it every match is returned.
+          With Accept application/x-ndjson it caps the streamed records.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: X-Next-Cursor header of the previous page
     responses:
       200:
         description: List of events
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor of the next page, absent on the last one
+      304:
+        description: Not modified since the ETag sent in If-None-Match
+      400:
+        description: Invalid query
     """
-    events = load_events()
+    try:
+        args = events_query_schema.load(request.args)
+        after = decode_cursor(args["cursor"]) if "cursor" in args else None
+    except ValidationError as err:
+        app.logger.info("Invalid events query: %s", err.messages)
+        return jsonify(err.messages), 400
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    filters = {EVENT_FILTERS[name]: value for name, value in args.items()
+               if name in EVENT_FILTERS}
+    if request.accept_mimetypes.best_match(
+            ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        app.logger.info("Streaming events as NDJSON")
+        records = iter_records(events_repository, filters, after, args.get("limit"))
+        lines = (app.json.dumps(record) + "\n" for record in records)
+        return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+
+    # The generation is read before the page: a concurrent write can only
+    # make the ETag older than the body, never newer.
+    etag = collection_etag(events_repository.generation())
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    events, next_id = events_repository.page(
+        filters, args.get("limit"), after)
     app.logger.info(
         "Returning list of events with length: %d", len(events))
-    return jsonify(events), 200
+    response = jsonify(events)
+    response.set_etag(etag)
+    if next_id is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_id)
+    return response, 200
 
 # >>>>>>>>>>>>>> Get event by ID <<<<<<<<<<<<
 
@@ -125,6 +199,8 @@ def get_event(event_id):
             capacity:
               type: integer
 
+      304:
+        description: Not modified since the ETag sent in If-None-Match
       404:
         description: Event not found
         schema:
@@ -133,11 +209,17 @@ def get_event(event_id):
             error:
               type: string
     """
-    event = find_event(event_id)
+    event, etag = events_repository.get_versioned(event_id)
 
     if event:
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            app.logger.info("Event with id %d not modified", event_id)
+            return unchanged
         app.logger.info("Event with id %d found", event_id)
-        return jsonify(event), 200
+        response = jsonify(event)
+        response.set_etag(etag)
+        return response, 200
 
     app.logger.info("Event with id %d not found", event_id)
     return jsonify({"error": "Event not found"}), 404
@@ -187,10 +269,7 @@ def add_event():
                     organizer_id, g.correlation_id)
 
     try:
-        response = requests.get(
-            f"{USERS_SERVICE}/users/{organizer_id}/is_organizer",
-            headers={CORRELATION_ID_HEADER: g.correlation_id}
-        )
+        response = http_client.get(f"{USERS_SERVICE}/users/{organizer_id}/is_organizer")
         app.logger.info("Users service response for organizer %d: status=%d, correlation_id: %s",
                         organizer_id, response.status_code, g.correlation_id)
 
@@ -202,16 +281,10 @@ def add_event():
     except requests.exceptions.RequestException as e:
         return jsonify({"error": "Unable to verify organizer"}), 500
 
-    # Load existing events and add the new event
-    events = load_events()
-    new_event = {
-        "id": events[-1]["id"] + 1 if events else 1,
-        **data
-    }
-
-    events.append(new_event)
-    save_events(events)
+    # Add the new event
+    new_event = events_repository.add(data)
     app.logger.info("Successfully created event with id %d", new_event["id"])
+    publish_change(broker, "events", new_event["id"], "created")
     return jsonify(new_event), 201
 
 # >>>>>>>>>>>>>> Update event by ID <<<<<<<<<<<<
@@ -250,8 +323,6 @@ def update_event(event_id):
       404:
         description: Event not found
     """
-    events = load_events()
-
     try:
         data = events_schema.load(request.get_json())
     except ValidationError as err:
@@ -264,10 +335,7 @@ def update_event(event_id):
                     organizer_id, g.correlation_id)
 
     try:
-      response = requests.get(
-          f"{USERS_SERVICE}/users/{organizer_id}/is_organizer",
-          headers={CORRELATION_ID_HEADER: g.correlation_id}
-      )
+      response = http_client.get(f"{USERS_SERVICE}/users/{organizer_id}/is_organizer")
       app.logger.info("Users service response for organizer %d: status=%d, correlation_id: %s",
                       organizer_id, response.status_code, g.correlation_id)
       if response.status_code == 404:
@@ -278,11 +346,10 @@ def update_event(event_id):
     except requests.exceptions.RequestException as e:
         return jsonify({"error": "Unable to verify organizer"}), 500
 
-    for event in events:
-        if event["id"] == event_id:
-            event.update(data)
-            save_events(events)
-            return jsonify(event), 200
+    event = events_repository.update(event_id, data)
+    if event:
+        publish_change(broker, "events", event_id, "updated")
+        return jsonify(event), 200
 
     return jsonify({"error": "Event not found"}), 404
 
@@ -303,14 +370,22 @@ def delete_event(event_id):
       404:
         description: Event not found
     """
-    events = load_events()
-    if not any(event["id"] == event_id for event in events):
+    if not events_repository.delete(event_id):
         return jsonify({"error": "Event not found"}), 404
 
-    events = [event for event in events if event["id"] != event_id]
-    save_events(events)
+    publish_change(broker, "events", event_id, "deleted")
     return "", 204
 
+# ------------------------------ CLI ------------------------------
+
+@app.cli.command("migrate-json")
+def migrate_json_command():
+    """Import events.json into the SQLite database (flask migrate-json)."""
+    repository = open_repository(DATA_FILE, "sqlite",
+                                 indexes=EVENT_FILTERS.values())
+    count = migrate_json(DATA_FILE, repository)
+    print(f"Imported {count} events from {DATA_FILE}")
+
 # ------------------------------ Main -----------------------------
 if __name__ == '__main__':
     app.run(debug=True, port=5002)
@@ -0,0 +1,223 @@
+import json
+import logging
+import os
+import threading
+import time
+import pika
+
+# Fanout exchange with the create/update/delete events of usuarios and eventos
+CHANGES_EXCHANGE = "cambios"
+# Fanout exchange with the tickets bought through entradas' POST /purchases
+PURCHASES_EXCHANGE = "compras"
+# Exchanges whose messages are persisted and must survive a broker restart
+DURABLE_EXCHANGES = (PURCHASES_EXCHANGE,)
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBroker:
+    """In-process stand-in for RabbitMQ.
+
+    Delivers every message synchronously to the subscribers and queue
+    consumers of the same process. Used when RABBITMQ_HOST is not set and
+    in the tests.
+    """
+
+    def __init__(self):
+        self._subscribers = {}
+        self._consumers = {}  # exchange -> {queue: callback}
+
+    def publish_many(self, messages):
+        for exchange, message in messages:
+            self.publish(exchange, message)
+
+    def publish(self, exchange, message):
+        for callback in list(self._subscribers.get(exchange, ())):
+            callback(message)
+        for queue, callback in list(self._consumers.get(exchange, {}).items()):
+            try:
+                callback(message)
+            except Exception:
+                logger.exception("Could not handle message from %s", queue)
+
+    def subscribe(self, exchange, callback, on_connect=None):
+        if on_connect:
+            on_connect()
+        self._subscribers.setdefault(exchange, []).append(callback)
+
+    def consume(self, exchange, queue, callback):
+        # Consumers of one queue compete for its messages: the first one wins.
+        self._consumers.setdefault(exchange, {}).setdefault(queue, callback)
+
+
+class RabbitBroker:
+    """Publishes and consumes JSON messages on RabbitMQ fanout exchanges.
+
+    Publishing shares one connection per process behind a lock (pika
+    connections are not thread-safe) and reconnects once if it was dropped.
+    Each subscription runs on a daemon thread with its own connection and an
+    exclusive queue, so every gunicorn worker receives every message. The
+    thread reconnects after ``reconnect_delay`` seconds and calls
+    ``on_connect`` after every (re)connection, because messages published
+    while it was disconnected are lost.
+
+    consume() instead reads a durable queue shared by every worker of a
+    service, so each message is handled once per service. Messages are
+    acked after the callback returns; a message whose callback fails is
+    requeued once and then dead-lettered to ``<queue>.dlq``, where it is
+    kept until someone moves it back (e.g. with the RabbitMQ shovel).
+    Messages on DURABLE_EXCHANGES are published as persistent.
+
+    publish_many() sends a batch as one AMQP transaction on its own
+    channel: the commit returns once the broker has taken every message,
+    in a single round trip (pika's blocking publisher confirms wait for
+    each message instead).
+    """
+
+    def __init__(self, host, reconnect_delay=5, prefetch=10):
+        # Bounded connect and blocked-publish waits keep requests from hanging
+        # when the broker is down.
+        self._parameters = pika.ConnectionParameters(
+            host, heartbeat=30, socket_timeout=2, blocked_connection_timeout=5)
+        self._connection = self._channel = self._batch_channel = None
+        self._declared = set()
+        self._lock = threading.Lock()
+        self.reconnect_delay = reconnect_delay
+        self.prefetch = prefetch
+
+    def publish(self, exchange, message):
+        body = json.dumps(message)
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    channel = self._publish_channel(exchange)
+                    channel.basic_publish(exchange=exchange, routing_key="",
+                                          body=body, properties=_properties(exchange))
+                    return
+                except (pika.exceptions.AMQPError, OSError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def publish_many(self, messages):
+        """Publish ``(exchange, message)`` pairs; all or none are sent."""
+        bodies = [(exchange, json.dumps(message)) for exchange, message in messages]
+        with self._lock:
+            for attempt in range(2):
+                try:
+                    for exchange, _ in bodies:
+                        self._publish_channel(exchange)
+                    if self._batch_channel is None:
+                        self._batch_channel = self._connection.channel()
+                        self._batch_channel.tx_select()
+                    for exchange, body in bodies:
+                        self._batch_channel.basic_publish(
+                            exchange=exchange, routing_key="", body=body,
+                            properties=_properties(exchange))
+                    self._batch_channel.tx_commit()
+                    return
+                except (pika.exceptions.AMQPError, OSError):
+                    self._close()
+                    if attempt:
+                        raise
+
+    def subscribe(self, exchange, callback, on_connect=None):
+        thread = threading.Thread(target=self._consume, name=f"subscriber-{exchange}",
+                                  args=(exchange, callback, on_connect), daemon=True)
+        thread.start()
+        return thread
+
+    def consume(self, exchange, queue, callback):
+        thread = threading.Thread(target=self._consume, name=f"consumer-{queue}",
+                                  args=(exchange, callback, None, queue), daemon=True)
+        thread.start()
+        return thread
+
+    def _publish_channel(self, exchange):
+        if self._connection is None or self._connection.is_closed:
+            self._connection = pika.BlockingConnection(self._parameters)
+            self._channel = self._connection.channel()
+            self._batch_channel = None
+            self._declared = set()
+        if exchange not in self._declared:
+            _declare_exchange(self._channel, exchange)
+            self._declared.add(exchange)
+        return self._channel
+
+    def _close(self):
+        try:
+            if self._connection is not None and self._connection.is_open:
+                self._connection.close()
+        except (pika.exceptions.AMQPError, OSError):
+            pass
+        self._connection = self._channel = self._batch_channel = None
+
+    def _consume(self, exchange, callback, on_connect, queue=None):
+        # Without a ``queue``, an exclusive auto-ack queue per subscriber.
+        def deliver(channel, method, properties, body):
+            try:
+                callback(json.loads(body))
+            except Exception:
+                logger.exception("Could not handle message from %s", queue or exchange)
+                if queue:
+                    # The second failure goes to the dead-letter queue.
+                    channel.basic_nack(method.delivery_tag, requeue=not method.redelivered)
+                return
+            if queue:
+                channel.basic_ack(method.delivery_tag)
+
+        while True:
+            try:
+                connection = pika.BlockingConnection(self._parameters)
+                channel = connection.channel()
+                _declare_exchange(channel, exchange)
+                if queue:
+                    channel.queue_declare(queue=f"{queue}.dlq", durable=True)
+                    consumed = channel.queue_declare(queue=queue, durable=True, arguments={
+                        "x-dead-letter-exchange": "",
+                        "x-dead-letter-routing-key": f"{queue}.dlq",
+                    }).method.queue
+                    channel.basic_qos(prefetch_count=self.prefetch)
+                else:
+                    consumed = channel.queue_declare(queue="", exclusive=True).method.queue
+                channel.queue_bind(exchange=exchange, queue=consumed)
+                if on_connect:
+                    on_connect()
+                logger.info("Subscribed to %s", queue or exchange)
+                channel.basic_consume(queue=consumed, on_message_callback=deliver,
+                                      auto_ack=not queue)
+                channel.start_consuming()
+            except (pika.exceptions.AMQPError, OSError):
+                logger.warning("Lost connection to RabbitMQ (%s), retrying in %s s",
+                               exchange, self.reconnect_delay)
+                time.sleep(self.reconnect_delay)
+
+
+def _declare_exchange(channel, exchange):
+    channel.exchange_declare(exchange=exchange, exchange_type="fanout",
+                             durable=exchange in DURABLE_EXCHANGES)
+
+
+def _properties(exchange):
+    return pika.BasicProperties(
+        content_type="application/json",
+        delivery_mode=2 if exchange in DURABLE_EXCHANGES else 1)
+
+
+def create_broker():
+    """RabbitBroker on RABBITMQ_HOST, or a LocalBroker when it is not set."""
+    host = os.getenv("RABBITMQ_HOST")
+    return RabbitBroker(host) if host else LocalBroker()
+
+
+def publish_change(broker, resource, record_id, change):
+    """Announce that ``resource`` ``record_id`` was created, updated or deleted.
+
+    Best effort: a failure is logged and does not fail the request, since
+    subscribers still expire their cached entries by TTL.
+    """
+    message = {"resource": resource, "id": record_id, "change": change}
+    try:
+        broker.publish(CHANGES_EXCHANGE, message)
+    except Exception:
+        logger.exception("Could not publish change %s", message)
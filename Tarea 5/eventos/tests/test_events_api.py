@@ -0,0 +1,58 @@
+import pytest
+import app as events_app
+from messaging import CHANGES_EXCHANGE, LocalBroker
+from repository import open_repository
+
+EVENT = {"organizerId": 1, "name": "Concierto", "date": "2025-01-01",
+         "location": "San José", "description": "Rock", "capacity": 100}
+
+class FakeResponse:
+    def __init__(self, status_code, body=True):
+        self.status_code = status_code
+        self.body = body
+
+    def json(self):
+        return self.body
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    repository = open_repository(str(tmp_path / "events.json"),
+                                 indexes=events_app.EVENT_FILTERS.values())
+    monkeypatch.setattr(events_app, "events_repository", repository)
+    events_app.app.config['TESTING'] = True
+    with events_app.app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def organizer(monkeypatch):
+    response = FakeResponse(200)
+    monkeypatch.setattr(events_app.http_client, "get", lambda url, **kwargs: response)
+    return response
+
+def test_add_event_checks_the_organizer(client, organizer):
+    rv = client.post('/events', json=EVENT)
+    assert rv.status_code == 201
+    assert rv.get_json() == {**EVENT, "id": 1}
+
+    organizer.body = False
+    assert client.post('/events', json=EVENT).status_code == 400
+    organizer.status_code = 404
+    assert client.post('/events', json=EVENT).status_code == 404
+
+def test_filter_by_location(client, organizer):
+    client.post('/events', json=EVENT)
+    client.post('/events', json={**EVENT, "location": "Cartago"})
+    events = client.get('/events?location=Cartago').get_json()
+    assert [event["location"] for event in events] == ["Cartago"]
+
+def test_changes_are_broadcast(client, organizer, monkeypatch):
+    broker = LocalBroker()
+    messages = []
+    broker.subscribe(CHANGES_EXCHANGE, messages.append)
+    monkeypatch.setattr(events_app, "broker", broker)
+
+    event_id = client.post('/events', json=EVENT).get_json()["id"]
+    client.put(f'/events/{event_id}', json={**EVENT, "capacity": 50})
+    client.delete(f'/events/{event_id}')
+    assert messages == [{"resource": "events", "id": event_id, "change": change}
+                        for change in ("created", "updated", "deleted")]
@@ -1,19 +1,34 @@
-import json
 import os
-from flask import Flask, jsonify, request, g
-from marshmallow import Schema, fields, ValidationError
+from flask import Flask, Response, jsonify, request, g, stream_with_context
+from marshmallow import Schema, fields, validate, ValidationError
 from flasgger import Swagger
 import logging
 import requests
+import http_client
+from idempotency import IdempotencyStore, idempotent
+from messaging import CHANGES_EXCHANGE, PURCHASES_EXCHANGE, create_broker
+from ref_cache import RefCache
 from dotenv import load_dotenv
 import os
 import requests
+from etags import collection_etag, not_modified
 from log_utils import init_logging, CORRELATION_ID_HEADER
+from repository import (decode_cursor, encode_cursor, iter_records, migrate_json,
+                        open_repository)
 import uuid
 
 load_dotenv("config.env")
 
-DATA_FILE = "bills.json"
+DATA_FILE = os.getenv("DATA_FILE", "bills.json")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Query parameter -> indexed field path
+BILL_FILTERS = {"userId": "userId", "eventId": "eventId"}
+# ticketId finds the bill of a purchase, to skip redelivered purchase events
+BILL_INDEXES = [*BILL_FILTERS.values(), "ticketId"]
+# Durable queue shared by the workers, bound to the purchases exchange
+PURCHASES_QUEUE = "facturacion.compras"
 USERS_SERVICE = os.getenv("USUARIOS_SERVICE")
 EVENTS_SERVICE = os.getenv("EVENTOS_SERVICE")
 
@@ -58,21 +73,105 @@ class BillsSchema(Schema):
 
 bills_schema = BillsSchema()
 
-#  ------------------------ File Helpers --------------------------
+class BillsQuerySchema(Schema):
+    userId = fields.Integer()
+    eventId = fields.Integer()
+    limit = fields.Integer(validate=validate.Range(min=1, max=MAX_PAGE_SIZE))
+    cursor = fields.String()
 
-def load_bills():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r") as fileVar:
-        return json.load(fileVar)
+bills_query_schema = BillsQuerySchema()
 
-def save_bills(bills):
-    with open(DATA_FILE, "w") as fileVar:
-        json.dump(bills, fileVar, indent=2)
+#  ------------------------- Repository --------------------------
 
-def find_bill(bill_id):
-    bills = load_bills()
-    return next((bill for bill in bills if bill["id"] == bill_id), None)
+bills_repository = open_repository(DATA_FILE, STORAGE_BACKEND,
+                                   indexes=BILL_INDEXES)
+
+# Responses to POSTs sent with an Idempotency-Key, shared by the workers
+idempotency_store = IdempotencyStore(
+    DATA_FILE + ".idempotency.db",
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", "86400")),
+    max_keys=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000")),
+)
+
+# ------------------------ Downstream services ------------------------
+
+# Existence answers from usuarios/eventos, reused across requests
+reference_cache = RefCache(
+    max_size=int(os.getenv("REF_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("REF_CACHE_TTL", "30")),
+    negative_ttl=float(os.getenv("REF_CACHE_NEGATIVE_TTL", "5")),
+)
+
+# Evict entries as soon as usuarios and eventos announce a change. After a
+# (re)connection the whole cache is dropped, since changes may have been
+# missed while disconnected.
+broker = create_broker()
+
+def on_reference_change(message):
+    reference_cache.invalidate((message["resource"], message["id"]))
+
+broker.subscribe(CHANGES_EXCHANGE, on_reference_change,
+                 on_connect=reference_cache.invalidate)
+
+def validate_references(data):
+    """Error response if the user or the event does not exist, else None.
+
+    Answers cached in ``reference_cache`` are reused; the remaining services
+    are called concurrently and the first failure answers without waiting
+    for the other call.
+    """
+    references = [(("users", data['userId']), f"{USERS_SERVICE}/users/{data['userId']}", "User not found"),
+                  (("events", data['eventId']), f"{EVENTS_SERVICE}/events/{data['eventId']}", "Event not found")]
+    exists = {reference: reference_cache.get(reference) for reference, _, _ in references}
+    unknown = [(reference, url) for reference, url, _ in references if exists[reference] is None]
+
+    if unknown:
+        app.logger.info("Calling services to validate %s with correlation_id: %s",
+                        [reference for reference, _ in unknown], g.correlation_id)
+        try:
+            responses = http_client.get_all([url for _, url in unknown])
+        except requests.exceptions.RequestException:
+            app.logger.exception("Unable to verify user and event")
+            return jsonify({"error": "Unable to verify user and event"}), 500
+
+        for (reference, _), response in zip(unknown, responses):
+            if response is None:  # Abandoned after the other call failed
+                continue
+            exists[reference] = response.status_code == 200
+            # Only definite answers are cached, not server errors.
+            if response.status_code in (200, 404):
+                reference_cache.put(reference, exists[reference])
+
+    for reference, _, error in references:
+        if exists[reference] is False:
+            return jsonify({"error": error}), 404
+    return None
+
+# --------------------------- Purchases ---------------------------
+
+def on_purchase(message):
+    """Bill a ticket bought through entradas (POST /purchases).
+
+    Entradas already validated the buyer and the event. A purchase that
+    already has a bill is a redelivery and is skipped; the check and the
+    insert are atomic, so workers handling copies at once bill it once.
+    """
+    bill, created = bills_repository.add_if_absent(
+        {"ticketId": message["ticketId"]}, {
+            "userId": message["buyerId"],
+            "eventId": message["eventId"],
+            "amount": float(message["price"]),
+            "details": f"Ticket {message['ticketId']} ({message['type']})",
+            "date": message["purchasedAt"],
+            "ticketId": message["ticketId"],
+        })
+    if not created:
+        app.logger.info("Ticket %d is already billed", message["ticketId"])
+        return
+    app.logger.info("Bill %d created for ticket %d",
+                    bill["id"], message["ticketId"])
+
+broker.consume(PURCHASES_EXCHANGE, PURCHASES_QUEUE, on_purchase)
 
 # ----------------------------- Routes ----------------------------
 
@@ -82,14 +181,77 @@ def find_bill(bill_id):
 def get_bills():
     """Get all bills
     ---
+    produces:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: userId
+        in: query
+        type: integer
+        required: false
+        description: Only bills of this user
+      - name: eventId
+        in: query
+        type: integer
+        required: false
+        description: Only bills for this event
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-1000). Without it every match is returned.
+          With Accept application/x-ndjson it caps the streamed records.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: X-Next-Cursor header of the previous page
     responses:
       200:
         description: List of bills
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor of the next page, absent on the last one
+      304:
+        description: Not modified since the ETag sent in If-None-Match
+      400:
+        description: Invalid query
     """
-    bills = load_bills()
+    try:
+        args = bills_query_schema.load(request.args)
+        after = decode_cursor(args["cursor"]) if "cursor" in args else None
+    except ValidationError as err:
+        app.logger.info("Invalid bills query: %s", err.messages)
+        return jsonify(err.messages), 400
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    filters = {BILL_FILTERS[name]: value for name, value in args.items()
+               if name in BILL_FILTERS}
+    if request.accept_mimetypes.best_match(
+            ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        app.logger.info("Streaming bills as NDJSON")
+        records = iter_records(bills_repository, filters, after, args.get("limit"))
+        lines = (app.json.dumps(record) + "\n" for record in records)
+        return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+
+    # The generation is read before the page: a concurrent write can only
+    # make the ETag older than the body, never newer.
+    etag = collection_etag(bills_repository.generation())
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    bills, next_id = bills_repository.page(
+        filters, args.get("limit"), after)
     app.logger.info(
         "Returning list of bills with length: %d", len(bills))
-    return jsonify(bills), 200
+    response = jsonify(bills)
+    response.set_etag(etag)
+    if next_id is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_id)
+    return response, 200
 
 # >>>>>>>>>>>>>> Get bill by ID <<<<<<<<<<<<
 
@@ -121,6 +283,8 @@ def get_bill(bill_id):
               type: string
             date:
               type: string
+      304:
+        description: Not modified since the ETag sent in If-None-Match
       404:
         description: Bill not found
         schema:
@@ -129,11 +293,17 @@ def get_bill(bill_id):
             error:
               type: string
     """
-    bill = find_bill(bill_id)
+    bill, etag = bills_repository.get_versioned(bill_id)
 
     if bill:
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            app.logger.info("Bill with id %d not modified", bill_id)
+            return unchanged
         app.logger.info("Bill with id %d found", bill_id)
-        return jsonify(bill), 200
+        response = jsonify(bill)
+        response.set_etag(etag)
+        return response, 200
 
     app.logger.info("Bill with id %d not found", bill_id)
     return jsonify({"error": "Bill not found"}), 404
@@ -141,11 +311,17 @@ def get_bill(bill_id):
 # >>>>>>>>>>>>>> Add new bill <<<<<<<<<<<<
 
 @app.route('/bills', methods=['POST'])
+@idempotent(lambda: idempotency_store)
 def add_bill():
     """
     Add a new bill
     ---
     parameters:
+      - name: Idempotency-Key
+        in: header
+        type: string
+        required: false
+        description: Retries with the same key replay the first response
       - name: body
         in: body
         required: true
@@ -175,36 +351,13 @@ def add_bill():
         app.logger.info("Invalid bill data: %s", err.messages)
         return jsonify(err.messages), 400
 
-    # Validate userId
-    app.logger.info("Calling users service to validate user %d with correlation_id: %s",
-                    data['userId'], g.correlation_id)
-    buyer_response = requests.get(
-        f"{USERS_SERVICE}/users/{data['userId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    if buyer_response.status_code != 200:
-        return jsonify({"error": "User not found"}), 404
-
-    # Validate eventId
-    app.logger.info("Calling events service to validate event %d with correlation_id: %s",
-                    data['eventId'], g.correlation_id)
-    event_response = requests.get(
-        f"{EVENTS_SERVICE}/events/{data['eventId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    if event_response.status_code != 200:
-        return jsonify({"error": "Event not found"}), 404
+    error = validate_references(data)
+    if error:
+        return error
 
     app.logger.info("Adding new bill: %s", data)
 
-    bills = load_bills()
-    new_bill = {
-        "id": bills[-1]["id"] + 1 if bills else 1,
-        **data
-    }
-
-    bills.append(new_bill)
-    save_bills(bills)
+    new_bill = bills_repository.add(data)
     return jsonify(new_bill), 201
 
 # >>>>>>>>>>>>>> Update bill by ID <<<<<<<<<<<<
@@ -248,33 +401,13 @@ def update_bill(bill_id):
         app.logger.info("Invalid Bill data: %s", err.messages)
         return jsonify(err.messages), 400
 
-    # Validate userId
-    app.logger.info("Calling users service to validate user %d with correlation_id: %s",
-                    data['userId'], g.correlation_id)
-    buyer_response = requests.get(
-        f"{USERS_SERVICE}/users/{data['userId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    if buyer_response.status_code != 200:
-        return jsonify({"error": "User not found"}), 404
-
-    # Validate eventId
-    app.logger.info("Calling events service to validate event %d with correlation_id: %s",
-                    data['eventId'], g.correlation_id)
-    event_response = requests.get(
-        f"{EVENTS_SERVICE}/events/{data['eventId']}",
-        headers={CORRELATION_ID_HEADER: g.correlation_id}
-    )
-    if event_response.status_code != 200:
-        return jsonify({"error": "Event not found"}), 404
-
-    bills = load_bills()
-
-    for bill in bills:
-        if bill["id"] == bill_id:
-            bill.update(data)
-            save_bills(bills)
-            return jsonify(bill), 200
+    error = validate_references(data)
+    if error:
+        return error
+
+    bill = bills_repository.update(bill_id, data)
+    if bill:
+        return jsonify(bill), 200
 
     return jsonify({"error": "Bill not found"}), 404
 
@@ -295,14 +428,48 @@ def delete_bill(bill_id):
       404:
         description: Bill not found
     """
-    bills = load_bills()
-    if not any(bill["id"] == bill_id for bill in bills):
+    if not bills_repository.delete(bill_id):
         return jsonify({"error": "Bill not found"}), 404
 
-    bills = [bill for bill in bills if bill["id"] != bill_id]
-    save_bills(bills)
     return "", 204
 
+# >>>>>>>>>>>>>> Reference cache statistics <<<<<<<<<<<<
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit, miss and eviction counters of this worker's reference cache
+    ---
+    responses:
+      200:
+        description: Cache statistics
+        schema:
+          type: object
+          properties:
+            size:
+              type: integer
+            maxSize:
+              type: integer
+            hits:
+              type: integer
+            misses:
+              type: integer
+            evictions:
+              type: integer
+            expirations:
+              type: integer
+    """
+    return jsonify(reference_cache.stats()), 200
+
+# ------------------------------ CLI ------------------------------
+
+@app.cli.command("migrate-json")
+def migrate_json_command():
+    """Import bills.json into the SQLite database (flask migrate-json)."""
+    repository = open_repository(DATA_FILE, "sqlite",
+                                 indexes=BILL_INDEXES)
+    count = migrate_json(DATA_FILE, repository)
+    print(f"Imported {count} bills from {DATA_FILE}")
+
 # ------------------------------ Main -----------------------------
 if __name__ == '__main__':
     app.run(debug=True, port=5005)
@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import requests
+from requests.adapters import HTTPAdapter
+from flask import has_request_context, g
+from log_utils import CORRELATION_ID_HEADER
+
+# Seconds to wait for the TCP connection and for each read of the response.
+CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "2"))
+READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "5"))
+# Keep-alive connections kept per downstream host.
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+# GET responses with an ETag kept for revalidation (If-None-Match).
+ETAG_CACHE_SIZE = int(os.getenv("HTTP_ETAG_CACHE_SIZE", "1000"))
+
+
+def create_session(pool_size=POOL_SIZE):
+    """Session whose connection pools keep connections alive per host."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# One session and one pool of calling threads per process: gunicorn imports
+# the app after forking, so no sockets or threads are shared between workers.
+session = create_session()
+executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix="http-client")
+etag_cache = OrderedDict()  # url -> last 200 response carrying an ETag
+etag_cache_lock = threading.Lock()
+
+
+def request(method, url, **kwargs):
+    """Send a request to another service through the shared pool.
+
+    Adds the default timeouts and, inside a Flask request, the current
+    correlation id header.
+    """
+    return session.request(method, url, **_prepare(kwargs))
+
+
+def get(url, **kwargs):
+    """GET that revalidates a previously fetched response instead of
+    downloading it again: a 304 answer returns the stored response."""
+    return _conditional_get(url, **_prepare(kwargs))
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def get_all(urls, ok=lambda response: response.status_code == 200, **kwargs):
+    """GET every url concurrently; return the responses in url order.
+
+    Returns as soon as a response fails ``ok`` (or a call raises), without
+    waiting for the calls still in flight: their slots are None. Latency is
+    therefore that of the slowest call, or of the first failure.
+    """
+    # The calling threads have no Flask context, so headers are built here.
+    kwargs = _prepare(kwargs)
+    futures = {executor.submit(_conditional_get, url, **kwargs): index
+               for index, url in enumerate(urls)}
+    responses = [None] * len(urls)
+    pending = set(futures)
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            response = future.result()
+            responses[futures[future]] = response
+            if not ok(response):
+                for other in pending:
+                    other.cancel()
+                return responses
+    return responses
+
+
+def _conditional_get(url, **kwargs):
+    with etag_cache_lock:
+        cached = etag_cache.get(url)
+    if cached is not None:
+        kwargs["headers"] = {**kwargs["headers"],
+                             "If-None-Match": cached.headers["ETag"]}
+    response = session.get(url, **kwargs)
+    if response.status_code == 304 and cached is not None:
+        with etag_cache_lock:
+            if url in etag_cache:
+                etag_cache.move_to_end(url)
+        return cached
+
+    with etag_cache_lock:
+        if response.status_code == 200 and "ETag" in response.headers:
+            etag_cache[url] = response
+            etag_cache.move_to_end(url)
+            while len(etag_cache) > ETAG_CACHE_SIZE:
+                etag_cache.popitem(last=False)
+        else:
+            etag_cache.pop(url, None)
+    return response
+
+
+def _prepare(kwargs):
+    """Request kwargs with the default timeouts and correlation id header."""
+    headers = dict(kwargs.pop("headers", None) or {})
+    if has_request_context() and "correlation_id" in g:
+        headers.setdefault(CORRELATION_ID_HEADER, g.correlation_id)
+    kwargs.setdefault("timeout", (CONNECT_TIMEOUT, READ_TIMEOUT))
+    return {**kwargs, "headers": headers}
@@ -0,0 +1,66 @@
+import threading
+import time
+from collections import OrderedDict
+
+
+class RefCache:
+    """Bounded LRU cache of "does this id exist" answers from other services.
+
+    Keys are ``(resource, id)`` tuples such as ``("users", 7)``. The value
+    is False for ids that do not exist, and otherwise whatever the caller
+    keeps about the record (True, or the fetched record). Positive
+    answers are kept for ``ttl`` seconds and negative ones for
+    ``negative_ttl``, so a deleted user stops validating at most ``ttl``
+    seconds later, or right away once invalidate() is called. When
+    ``max_size`` entries are cached the least recently used one is evicted.
+    Each gunicorn worker has its own cache.
+    """
+
+    def __init__(self, max_size=10000, ttl=30.0, negative_ttl=5.0, clock=time.monotonic):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._clock = clock
+        self._entries = OrderedDict()  # key -> (value, expires at)
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = self.expirations = 0
+
+    def get(self, key):
+        """The cached value if it is fresh, else None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] <= self._clock():
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        ttl = self.negative_ttl if value is False else self.ttl
+        if ttl <= 0 or self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key=None):
+        """Forget ``key``, or every entry when no key is given."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "maxSize": self.max_size,
+                    "hits": self.hits, "misses": self.misses,
+                    "evictions": self.evictions, "expirations": self.expirations}
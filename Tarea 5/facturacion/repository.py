@@ -0,0 +1,906 @@
+import base64
+import binascii
+import fcntl
+import functools
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+
+# Every repository exposes the same interface to the services:
+# all(), get(id), get_versioned(id), get_many(ids), find(filters),
+# page(filters, limit, after), count_by(path, value), generation(),
+# add(data), update(id, data), update_many(updates), delete(id) and
+# compact().
+STORAGE_BACKENDS = ("json", "wal", "sqlite")
+
+
+def index_values(record, path):
+    """Hashable values found at a dotted ``path`` of ``record``.
+
+    Lists are traversed, so ``"users.id"`` yields the id of every entry of
+    a notification's ``users`` list.
+    """
+    values = [record]
+    for key in path.split("."):
+        found = []
+        for value in values:
+            for item in value if isinstance(value, list) else [value]:
+                if isinstance(item, dict) and key in item:
+                    found.append(item[key])
+        values = found
+    flat = []
+    for value in values:
+        flat.extend(value if isinstance(value, list) else [value])
+    return {value for value in flat if not isinstance(value, (dict, list))}
+
+
+def index_spec(index):
+    """``(name, values function)`` of an index.
+
+    An index is either a dotted path (see ``index_values``) or a
+    ``(name, function)`` pair whose function derives the values from the
+    whole record, e.g. the event of the tickets that still hold a seat.
+    """
+    if isinstance(index, str):
+        return index, functools.partial(index_values, path=index)
+    name, function = index
+    return name, lambda record: set(function(record))
+
+
+def matches(record, filters, indexes=None):
+    """Whether ``record`` holds every filter value; filters may name the
+    derived indexes in ``indexes`` (name -> values function)."""
+    indexes = indexes or {}
+    return all(value in (indexes[path](record) if path in indexes
+                         else index_values(record, path))
+               for path, value in filters.items())
+
+
+def encode_cursor(record_id):
+    """Opaque pagination cursor pointing just after ``record_id``."""
+    return base64.urlsafe_b64encode(f"id:{record_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Record id encoded in ``cursor``; raises ValueError when malformed."""
+    try:
+        prefix, _, record_id = base64.urlsafe_b64decode(cursor).decode().partition(":")
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    if prefix != "id":
+        raise ValueError(f"Invalid cursor '{cursor}'")
+    return int(record_id)
+
+
+def _hash(text):
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def _file_version(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+
+def _replace_file(path, write):
+    """Write a file through a temporary copy and an atomic rename."""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as fileVar:
+        write(fileVar)
+        fileVar.flush()
+        os.fsync(fileVar.fileno())
+    os.replace(tmp_path, path)
+
+
+class FileLock:
+    """Advisory lock shared by every process that opens the same data file."""
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    @contextmanager
+    def shared(self):
+        fcntl.flock(self._fd, fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def exclusive(self):
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+
+class IdAllocator:
+    """Monotonic id sequence shared by every worker through ``<path>.seq``.
+
+    The file holds the highest id handed out to any worker. Each worker
+    reserves a block of ``block_size`` ids under a file lock and then serves
+    ids from memory, so most inserts never touch the file. Ids are never
+    reused, even after deleting the last record; ids left in a block when a
+    worker exits are simply skipped.
+    """
+
+    def __init__(self, path, block_size=100):
+        self.path = path
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._next = 1
+        self._end = 0
+
+    def next_id(self, floor=lambda: 0):
+        """Return the next id; ``floor`` seeds a missing sequence file."""
+        with self._lock:
+            if self._next > self._end:
+                self._reserve(floor)
+            record_id = self._next
+            self._next += 1
+            return record_id
+
+    def _reserve(self, floor):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            content = os.read(fd, 32).strip()
+            last_id = int(content) if content else floor()
+            end = last_id + self.block_size
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(end).encode())
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        self._next, self._end = last_id + 1, end
+
+
+# ---------------------------- Stores -----------------------------
+#
+# Stores are only called while the repository holds the file lock: shared
+# for load/catch_up from a reader, exclusive for everything else.
+
+class JsonFileStore:
+    """Rewrites the whole JSON array on every change (original behaviour).
+
+    The file is replaced atomically, and its inode/mtime/size act as the
+    generation other workers compare against.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._version = None
+
+    def load(self, exclusive=False):
+        self._version = _file_version(self.path)
+        if self._version is None:
+            return {}
+        with open(self.path, "r") as fileVar:
+            return {record["id"]: record for record in json.load(fileVar)}
+
+    def changed(self):
+        return _file_version(self.path) != self._version
+
+    def generation(self):
+        return str(self._version)
+
+    def catch_up(self, records, exclusive=False):
+        return self.load(exclusive), None
+
+    def put(self, records, record):
+        self.save(records)
+
+    def put_many(self, records, batch):
+        self.save(records)
+
+    def delete(self, records, record_id):
+        self.save(records)
+
+    def should_compact(self, records):
+        return False
+
+    def compact(self, records):
+        self.save(records)
+
+    def save(self, records):
+        _replace_file(self.path, lambda fileVar: json.dump(
+            list(records.values()), fileVar, indent=2))
+        self._version = _file_version(self.path)
+
+
+class LogStore:
+    """JSON snapshot plus an append-only log of mutations.
+
+    Each put/delete appends one line to ``<path>.log``, so the cost of a
+    write does not depend on the size of the collection. Loading reads the
+    snapshot and replays the log on top of it. Compaction folds the log into
+    a new snapshot once it holds more entries than
+    ``max(compact_min, compact_ratio * len(records))``, which keeps the
+    amortised write cost constant as the collection grows.
+
+    Other workers' appends are picked up by replaying the log from the last
+    known offset; a new snapshot or log inode (after a compaction) forces a
+    full reload.
+    """
+
+    def __init__(self, path, compact_min=1000, compact_ratio=1.0, fsync=False):
+        self.path = path
+        self.log_path = path + ".log"
+        self.compact_min = compact_min
+        self.compact_ratio = compact_ratio
+        self.fsync = fsync
+        self._log = None
+        self._log_entries = 0
+        self._log_offset = 0
+        self._snapshot_version = None
+
+    def load(self, exclusive=False):
+        snapshot = JsonFileStore(self.path)
+        records = snapshot.load()
+        self._snapshot_version = snapshot._version
+        if self._log:
+            self._log.close()
+        self._log = open(self.log_path, "ab")
+        self._log_entries = 0
+        self._log_offset = 0
+        self._replay(records, exclusive)
+        return records
+
+    def changed(self):
+        if _file_version(self.path) != self._snapshot_version:
+            return True
+        try:
+            stat = os.stat(self.log_path)
+        except FileNotFoundError:
+            return True
+        return (stat.st_ino != os.fstat(self._log.fileno()).st_ino
+                or stat.st_size != self._log_offset)
+
+    def generation(self):
+        return str((self._snapshot_version, os.fstat(self._log.fileno()).st_ino,
+                    self._log_offset))
+
+    def catch_up(self, records, exclusive=False):
+        same_snapshot = _file_version(self.path) == self._snapshot_version
+        try:
+            same_log = (os.stat(self.log_path).st_ino
+                        == os.fstat(self._log.fileno()).st_ino)
+        except FileNotFoundError:
+            same_log = False
+        if not (same_snapshot and same_log):
+            return self.load(exclusive), None
+        return records, self._replay(records, exclusive)
+
+    def put(self, records, record):
+        self._append({"op": "put", "record": record})
+
+    def put_many(self, records, batch):
+        self._append(*({"op": "put", "record": record} for record in batch))
+
+    def delete(self, records, record_id):
+        self._append({"op": "delete", "id": record_id})
+
+    def should_compact(self, records):
+        return self._log_entries >= max(self.compact_min,
+                                        self.compact_ratio * len(records))
+
+    def compact(self, records):
+        _replace_file(self.path, lambda fileVar: json.dump(
+            list(records.values()), fileVar, indent=2))
+        self._snapshot_version = _file_version(self.path)
+
+        # The snapshot now contains every logged change. The log is replaced
+        # rather than truncated so other workers notice the new inode.
+        _replace_file(self.log_path, lambda fileVar: None)
+        self._log.close()
+        self._log = open(self.log_path, "ab")
+        self._log_entries = 0
+        self._log_offset = 0
+
+    def _append(self, *entries):
+        lines = b"".join((json.dumps(entry, separators=(",", ":")) + "\n").encode()
+                         for entry in entries)
+        self._log.write(lines)
+        self._log.flush()
+        if self.fsync:
+            os.fsync(self._log.fileno())
+        self._log_entries += len(entries)
+        self._log_offset += len(lines)
+
+    def _replay(self, records, exclusive):
+        """Apply the log from the current offset; return (old, new) pairs."""
+        changes = []
+        with open(self.log_path, "rb") as fileVar:
+            fileVar.seek(self._log_offset)
+            for line in fileVar:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A crash in the middle of an append leaves a partial
+                    # last line; drop it so new entries start cleanly.
+                    if exclusive:
+                        os.truncate(self.log_path, self._log_offset)
+                    break
+                if entry["op"] == "put":
+                    record = entry["record"]
+                    changes.append((records.get(record["id"]), record))
+                    records[record["id"]] = record
+                else:
+                    changes.append((records.pop(entry["id"], None), None))
+                self._log_offset += len(line)
+                self._log_entries += 1
+        return changes
+
+
+# -------------------------- Repository ---------------------------
+
+class JsonRepository:
+    """In-memory repository for a collection persisted as JSON.
+
+    The data is loaded once when the repository is created. Records are kept
+    in a dict keyed by ``id`` (insertion ordered, like the original list), so
+    lookups are O(1) instead of a full parse plus a linear scan. Every
+    mutation is written through to the store before returning; stores that
+    need compaction are compacted on a background thread.
+
+    Several processes (gunicorn workers) can share the same file: writes
+    hold an exclusive lock on ``<path>.lock`` and first catch up with
+    changes made by other workers, and reads only reload when the store's
+    generation on disk differs from the one this worker last saw.
+
+    ``indexes`` lists dotted field paths or derived indexes (see
+    ``index_spec``) that get a secondary index: a dict from value to the
+    sorted ids of the records holding it, maintained incrementally on every
+    write.
+
+    Record ETags (a hash of the record) are computed on first use and
+    dropped when the record changes. The collection generation is the
+    store's on-disk version, so every worker reports the same one.
+
+    Returned records are the stored dicts; callers must not mutate them.
+    """
+
+    def __init__(self, path, store=None, ids=None, indexes=()):
+        self.path = path
+        self._store = store or JsonFileStore(path)
+        self._ids = ids or IdAllocator(path + ".seq")
+        self._index_functions = dict(map(index_spec, indexes))
+        self._lock = threading.RLock()
+        self._file_lock = FileLock(path + ".lock")
+        self._compacting = False
+        self._etags = {}
+        with self._file_lock.shared():
+            self._set_records(self._store.load(), None)
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self._records)
+
+    # ---------------------------- Reads ----------------------------
+
+    def all(self):
+        with self._lock:
+            self._refresh()
+            return list(self._records.values())
+
+    def get(self, record_id):
+        # Under the lock: a compaction on another thread reopens the log
+        # file that _refresh() looks at.
+        with self._lock:
+            self._refresh()
+            return self._records.get(record_id)
+
+    def get_versioned(self, record_id):
+        """``(record, etag)``, or ``(None, None)`` when it does not exist."""
+        with self._lock:
+            self._refresh()
+            record = self._records.get(record_id)
+            if record is None:
+                return None, None
+            etag = self._etags.get(record_id)
+            if etag is None:
+                etag = self._etags[record_id] = _hash(json.dumps(
+                    record, sort_keys=True, separators=(",", ":")))
+            return record, etag
+
+    def get_many(self, record_ids):
+        """Records of the ``record_ids`` that exist, keyed by id."""
+        with self._lock:
+            self._refresh()
+            return {record_id: self._records[record_id]
+                    for record_id in record_ids if record_id in self._records}
+
+    def find(self, filters):
+        """Records whose ``path`` holds ``value`` for every filter, by id."""
+        return self.page(filters)[0]
+
+    def page(self, filters, limit=None, after=None):
+        """Up to ``limit`` matching records with an id greater than ``after``.
+
+        Returns the records (by id) and the id to resume from, or None on
+        the last page. The smallest matching index bucket (or the sorted id
+        list) drives the scan and is entered with a binary search, so a
+        page costs the same however deep it is; filters on paths without
+        an index are checked record by record.
+        """
+        with self._lock:
+            self._refresh()
+            indexed = [path for path in filters if path in self._indexes]
+            if indexed:
+                path = min(indexed, key=lambda p: len(
+                    self._indexes[p].get(filters[p], ())))
+                ids = self._indexes[path].get(filters[path], [])
+                filters = {p: v for p, v in filters.items() if p != path}
+            else:
+                ids = self._ids_in_order
+            position = bisect_right(ids, after) if after is not None else 0
+
+            records = []
+            while position < len(ids):
+                record = self._records[ids[position]]
+                position += 1
+                if matches(record, filters, self._index_functions):
+                    if limit is not None and len(records) == limit:
+                        return records, records[-1]["id"]
+                    records.append(record)
+            return records, None
+
+    def count_by(self, path, value):
+        with self._lock:
+            self._refresh()
+            return len(self._indexes[path].get(value, ()))
+
+    def generation(self):
+        """Opaque token that changes whenever any record changes."""
+        with self._lock:
+            self._refresh()
+            return self._store.generation()
+
+    # ---------------------------- Writes ---------------------------
+
+    def add(self, data):
+        with self._write():
+            return self._add(data)
+
+    def add_if_absent(self, filters, data):
+        """Add ``data`` unless a record matches ``filters``.
+
+        Returns ``(record, created)``. The lookup and the insert happen under
+        the write lock, so concurrent callers (other threads or workers)
+        create at most one record.
+        """
+        with self._write():
+            existing = self.page(filters, 1)[0]
+            if existing:
+                return existing[0], False
+            return self._add(data), True
+
+    def update(self, record_id, data):
+        with self._write():
+            record = self._records.get(record_id)
+            if record is None:
+                return None
+            self._apply(record, data)
+            self._store.put(self._records, record)
+            return record
+
+    def update_many(self, updates):
+        """Apply ``{id: data}`` in a single store write.
+
+        Returns the updated records; ids that do not exist are skipped.
+        """
+        with self._write():
+            records = [self._records[record_id] for record_id in updates
+                       if record_id in self._records]
+            for record in records:
+                self._apply(record, updates[record["id"]])
+            if records:
+                self._store.put_many(self._records, records)
+            return records
+
+    def delete(self, record_id):
+        with self._write():
+            record = self._records.pop(record_id, None)
+            if record is None:
+                return False
+            del self._ids_in_order[bisect_left(self._ids_in_order, record_id)]
+            self._unindex(record)
+            self._etags.pop(record_id, None)
+            self._store.delete(self._records, record_id)
+            return True
+
+    def _add(self, data):
+        record_id = self._ids.next_id(lambda: max(self._records, default=0))
+        record = {"id": record_id, **data}
+        self._records[record["id"]] = record
+        insort(self._ids_in_order, record_id)
+        self._index(record)
+        self._store.put(self._records, record)
+        return record
+
+    # ------------------------- Compaction --------------------------
+
+    def compact(self, force=True):
+        with self._lock, self._file_lock.exclusive():
+            self._set_records(*self._store.catch_up(self._records, exclusive=True))
+            if force or self._store.should_compact(self._records):
+                self._store.compact(self._records)
+            self._compacting = False
+
+    # --------------------------- Indexes ---------------------------
+
+    def _apply(self, record, data):
+        self._unindex(record)
+        record.update(data)
+        self._etags.pop(record["id"], None)
+        self._index(record)
+
+    def _index(self, record):
+        for path, values in self._index_functions.items():
+            index = self._indexes[path]
+            for value in values(record):
+                insort(index.setdefault(value, []), record["id"])
+
+    def _unindex(self, record):
+        for path, values in self._index_functions.items():
+            index = self._indexes[path]
+            for value in values(record):
+                ids = index[value]
+                del ids[bisect_left(ids, record["id"])]
+                if not ids:
+                    del index[value]
+
+    def _set_records(self, records, changes):
+        """Adopt the store's records, patching indexes with ``changes``.
+
+        ``changes`` is a list of (old, new) records, or None when the store
+        reloaded everything and the indexes must be rebuilt.
+        """
+        self._records = records
+        if changes is None:
+            self._etags = {}
+            self._ids_in_order = sorted(records)
+            self._indexes = {path: {} for path in self._index_functions}
+            for record in records.values():
+                self._index(record)
+            return
+        for old, new in changes:
+            self._etags.pop((old or new)["id"], None)
+            if old is not None:
+                self._unindex(old)
+            if new is not None:
+                self._index(new)
+            if old is None and new is not None:
+                insort(self._ids_in_order, new["id"])
+            elif new is None and old is not None:
+                del self._ids_in_order[bisect_left(self._ids_in_order, old["id"])]
+
+    # ------------------------ Coordination -------------------------
+
+    def _refresh(self):
+        if not self._store.changed():
+            return
+        with self._lock, self._file_lock.shared():
+            if self._store.changed():
+                self._set_records(*self._store.catch_up(self._records))
+
+    @contextmanager
+    def _write(self):
+        with self._lock:
+            with self._file_lock.exclusive():
+                if self._store.changed():
+                    self._set_records(*self._store.catch_up(self._records,
+                                                            exclusive=True))
+                yield
+            if not self._compacting and self._store.should_compact(self._records):
+                self._compacting = True
+                threading.Thread(target=self.compact, args=(False,),
+                                 daemon=True).start()
+
+
+class SqliteRepository:
+    """Repository stored in an SQLite database in WAL mode.
+
+    Records live in a single ``records`` table: the id is the INTEGER
+    PRIMARY KEY (AUTOINCREMENT, so ids are never reused) and the remaining
+    fields are stored as a JSON document. Lookups are primary-key searches,
+    and all statements are constant parametrised SQL, so the per-connection
+    statement cache reuses the prepared statements. Each thread gets its own
+    connection; SQLite's own locking makes it safe across gunicorn workers.
+
+    Secondary ``indexes`` are kept in the ``record_index`` table, one row
+    per (path, value, id), clustered on that key and updated in the same
+    transaction as the record. Paths added later are backfilled on startup;
+    a derived index whose function changes needs a new name.
+
+    Triggers bump the single row of the ``generation`` table on every
+    change to ``records``; record ETags hash the stored JSON text.
+    """
+
+    # Ids bound per ``IN (...)`` statement in get_many().
+    MAX_VARIABLES = 500
+
+    def __init__(self, path, indexes=()):
+        self.path = path
+        self._index_functions = dict(map(index_spec, indexes))
+        self._local = threading.local()
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS records ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS record_index ("
+                "path TEXT NOT NULL, value NOT NULL, record_id INTEGER NOT NULL, "
+                "PRIMARY KEY (path, value, record_id)) WITHOUT ROWID")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS record_index_by_record "
+                "ON record_index (record_id)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS indexed_paths (path TEXT PRIMARY KEY)")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS generation ("
+                "id INTEGER PRIMARY KEY CHECK (id = 0), value INTEGER NOT NULL)")
+            connection.execute(
+                "INSERT OR IGNORE INTO generation (id, value) VALUES (0, 0)")
+            for event in ("INSERT", "UPDATE", "DELETE"):
+                connection.execute(
+                    f"CREATE TRIGGER IF NOT EXISTS records_{event.lower()} "
+                    f"AFTER {event} ON records BEGIN "
+                    "UPDATE generation SET value = value + 1 WHERE id = 0; END")
+            built = {row[0] for row in connection.execute(
+                "SELECT path FROM indexed_paths")}
+            for index_path in self._index_functions:
+                if index_path not in built:
+                    self._backfill(connection, index_path)
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM records").fetchone()[0]
+
+    # ---------------------------- Reads ----------------------------
+
+    def all(self):
+        rows = self._connection().execute(
+            "SELECT id, data FROM records ORDER BY id")
+        return [self._record(row) for row in rows]
+
+    def get(self, record_id):
+        row = self._connection().execute(
+            "SELECT id, data FROM records WHERE id = ?", (record_id,)).fetchone()
+        return self._record(row) if row else None
+
+    def get_versioned(self, record_id):
+        row = self._connection().execute(
+            "SELECT id, data FROM records WHERE id = ?", (record_id,)).fetchone()
+        if row is None:
+            return None, None
+        return self._record(row), _hash(f"{row[0]}:{row[1]}")
+
+    def get_many(self, record_ids):
+        record_ids = list(dict.fromkeys(record_ids))
+        connection = self._connection()
+        found = {}
+        # Stay below SQLite's limit on bound parameters per statement.
+        for start in range(0, len(record_ids), self.MAX_VARIABLES):
+            chunk = record_ids[start:start + self.MAX_VARIABLES]
+            rows = connection.execute(
+                "SELECT id, data FROM records WHERE id IN (%s)"
+                % ",".join("?" * len(chunk)), chunk)
+            found.update((row[0], self._record(row)) for row in rows)
+        return found
+
+    def find(self, filters):
+        return self.page(filters)[0]
+
+    def page(self, filters, limit=None, after=None):
+        after = after if after is not None else -1
+        indexed = [(path, value) for path, value in filters.items()
+                   if path in self._index_functions]
+        if indexed:
+            # Like JsonRepository, scan the smallest bucket (a COUNT on the
+            # clustered key only reads that bucket's index entries).
+            path, value = min(indexed, key=lambda item: self.count_by(*item)) \
+                if len(indexed) > 1 else indexed[0]
+            rows = self._connection().execute(
+                "SELECT r.id, r.data FROM record_index i "
+                "JOIN records r ON r.id = i.record_id "
+                "WHERE i.path = ? AND i.value = ? AND i.record_id > ? "
+                "ORDER BY i.record_id", (path, value, after))
+            filters = {p: v for p, v in filters.items() if p != path}
+        else:
+            rows = self._connection().execute(
+                "SELECT id, data FROM records WHERE id > ? ORDER BY id", (after,))
+
+        # Rows are stepped lazily, so only the requested page is read.
+        records = []
+        for record in map(self._record, rows):
+            if matches(record, filters, self._index_functions):
+                if limit is not None and len(records) == limit:
+                    rows.close()
+                    return records, records[-1]["id"]
+                records.append(record)
+        return records, None
+
+    def count_by(self, path, value):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM record_index WHERE path = ? AND value = ?",
+            (path, value)).fetchone()[0]
+
+    def generation(self):
+        return str(self._connection().execute(
+            "SELECT value FROM generation WHERE id = 0").fetchone()[0])
+
+    # ---------------------------- Writes ---------------------------
+
+    def add(self, data):
+        with self._transaction() as connection:
+            return self._add(connection, data)
+
+    def add_if_absent(self, filters, data):
+        # BEGIN IMMEDIATE serialises the lookup and the insert across workers.
+        with self._transaction() as connection:
+            existing = self.page(filters, 1)[0]
+            if existing:
+                return existing[0], False
+            return self._add(connection, data), True
+
+    def update(self, record_id, data):
+        with self._transaction() as connection:
+            return self._update(connection, record_id, data)
+
+    def update_many(self, updates):
+        with self._transaction() as connection:
+            records = [self._update(connection, record_id, data)
+                       for record_id, data in updates.items()]
+            return [record for record in records if record is not None]
+
+    def delete(self, record_id):
+        with self._transaction() as connection:
+            cursor = connection.execute("DELETE FROM records WHERE id = ?",
+                                        (record_id,))
+            self._unindex(connection, record_id)
+            return cursor.rowcount > 0
+
+    def _add(self, connection, data):
+        cursor = connection.execute(
+            "INSERT INTO records (data) VALUES (?)", (self._dump(data),))
+        record = {"id": cursor.lastrowid, **data}
+        self._index(connection, record)
+        return record
+
+    def _update(self, connection, record_id, data):
+        row = connection.execute(
+            "SELECT id, data FROM records WHERE id = ?", (record_id,)).fetchone()
+        if row is None:
+            return None
+        record = {**self._record(row), **data}
+        connection.execute("UPDATE records SET data = ? WHERE id = ?",
+                           (self._dump(record), record_id))
+        self._unindex(connection, record_id)
+        self._index(connection, record)
+        return record
+
+    def import_records(self, records):
+        """Insert or replace records keeping their ids (used by migrations)."""
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO records (id, data) VALUES (?, ?)",
+                ((record["id"], self._dump(record)) for record in records))
+            for record in records:
+                self._unindex(connection, record["id"])
+                self._index(connection, record)
+        return len(records)
+
+    def compact(self, force=True):
+        self._connection().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+    # --------------------------- Indexes ---------------------------
+
+    def _index(self, connection, record):
+        connection.executemany(
+            "INSERT OR IGNORE INTO record_index (path, value, record_id) "
+            "VALUES (?, ?, ?)",
+            ((path, value, record["id"])
+             for path, values in self._index_functions.items()
+             for value in values(record)))
+
+    def _unindex(self, connection, record_id):
+        connection.execute("DELETE FROM record_index WHERE record_id = ?",
+                           (record_id,))
+
+    def _backfill(self, connection, path):
+        rows = connection.execute("SELECT id, data FROM records").fetchall()
+        connection.executemany(
+            "INSERT OR IGNORE INTO record_index (path, value, record_id) "
+            "VALUES (?, ?, ?)",
+            ((path, value, record["id"]) for record in map(self._record, rows)
+             for value in self._index_functions[path](record)))
+        connection.execute("INSERT INTO indexed_paths (path) VALUES (?)", (path,))
+
+    # --------------------------- Helpers ---------------------------
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        # IMMEDIATE takes the write lock up front, so concurrent writers
+        # wait on the busy timeout instead of failing on lock upgrade.
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    @staticmethod
+    def _dump(data):
+        return json.dumps({key: value for key, value in data.items()
+                           if key != "id"}, separators=(",", ":"))
+
+    @staticmethod
+    def _record(row):
+        return {"id": row[0], **json.loads(row[1])}
+
+
+def iter_records(repository, filters, after=None, limit=None, batch_size=500):
+    """Yield matching records one keyset page at a time.
+
+    No lock or database cursor is held between batches, so a slow consumer
+    (a streamed HTTP response) neither blocks writers nor holds the whole
+    result in memory.
+    """
+    remaining = limit
+    while remaining is None or remaining > 0:
+        size = batch_size if remaining is None else min(batch_size, remaining)
+        records, after = repository.page(filters, size, after)
+        yield from records
+        if after is None:
+            return
+        if remaining is not None:
+            remaining -= len(records)
+
+
+def open_repository(path, backend="json", indexes=(), id_block_size=100):
+    """Build the repository for ``path`` using the configured backend.
+
+    The sqlite backend stores the data next to the JSON file, in a ``.db``
+    file with the same name.
+    """
+    if backend == "json":
+        return JsonRepository(path, JsonFileStore(path),
+                              IdAllocator(path + ".seq", id_block_size), indexes)
+    if backend == "wal":
+        return JsonRepository(path, LogStore(path),
+                              IdAllocator(path + ".seq", id_block_size), indexes)
+    if backend == "sqlite":
+        return SqliteRepository(os.path.splitext(path)[0] + ".db", indexes)
+    raise ValueError(f"Unknown storage backend '{backend}', "
+                     f"expected one of {', '.join(STORAGE_BACKENDS)}")
+
+
+def migrate_json(path, repository):
+    """Copy the records of a JSON data file (and its log) into ``repository``."""
+    store = LogStore(path) if os.path.exists(path + ".log") else JsonFileStore(path)
+    with FileLock(path + ".lock").shared():
+        records = store.load()
+    return repository.import_records(list(records.values()))
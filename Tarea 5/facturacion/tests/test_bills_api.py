@@ -0,0 +1,71 @@
+import threading
+import pytest
+import app as bills_app
+from idempotency import IdempotencyStore
+from repository import open_repository
+
+PURCHASE = {"ticketId": 7, "buyerId": 3, "eventId": 2, "type": "VIP", "price": 100,
+            "purchasedAt": "2025-01-01T00:00:00+00:00"}
+
+@pytest.fixture(params=["json", "sqlite"])
+def client(request, tmp_path, monkeypatch):
+    repository = open_repository(str(tmp_path / "bills.json"), request.param,
+                                 indexes=bills_app.BILL_INDEXES)
+    monkeypatch.setattr(bills_app, "bills_repository", repository)
+    monkeypatch.setattr(bills_app, "idempotency_store",
+                        IdempotencyStore(str(tmp_path / "idempotency.db")))
+    bills_app.app.config['TESTING'] = True
+    with bills_app.app.test_client() as client:
+        yield client
+
+def test_purchase_events_bill_the_buyer(client):
+    bills_app.broker.publish(bills_app.PURCHASES_EXCHANGE, PURCHASE)
+    bills = client.get('/bills?userId=3').get_json()
+    assert len(bills) == 1
+    assert bills[0]["ticketId"] == 7 and bills[0]["amount"] == 100.0
+    assert bills[0]["date"] == PURCHASE["purchasedAt"]
+
+def test_redelivered_purchase_is_billed_once(client):
+    bills_app.broker.publish(bills_app.PURCHASES_EXCHANGE, PURCHASE)
+    bills_app.broker.publish(bills_app.PURCHASES_EXCHANGE, PURCHASE)
+    assert len(client.get('/bills').get_json()) == 1
+
+def test_concurrent_deliveries_are_billed_once(client):
+    threads = [threading.Thread(target=bills_app.on_purchase, args=(PURCHASE,))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(client.get('/bills').get_json()) == 1
+
+class FakeResponse:
+    status_code = 200
+
+@pytest.fixture
+def references(monkeypatch):
+    calls = []
+    def get_all(urls):
+        calls.append(urls)
+        return [FakeResponse() for _ in urls]
+    monkeypatch.setattr(bills_app.http_client, "get_all", get_all)
+    monkeypatch.setattr(bills_app, "reference_cache", bills_app.RefCache())
+    return calls
+
+BILL = {"userId": 1, "eventId": 2, "amount": 50.0, "details": "VIP", "date": "2025-01-01"}
+
+def test_idempotency_key_replays_the_first_bill(client, references):
+    headers = {"Idempotency-Key": "bill-1"}
+    first = client.post('/bills', json=BILL, headers=headers)
+    again = client.post('/bills', json=BILL, headers=headers)
+    assert first.status_code == again.status_code == 201
+    assert again.get_json() == first.get_json()
+    assert again.headers["Idempotent-Replayed"] == "true"
+    assert len(client.get('/bills').get_json()) == 1
+    assert len(references) == 1
+
+def test_idempotency_key_reused_with_another_body(client, references):
+    headers = {"Idempotency-Key": "bill-1"}
+    client.post('/bills', json=BILL, headers=headers)
+    rv = client.post('/bills', json={**BILL, "amount": 60.0}, headers=headers)
+    assert rv.status_code == 422
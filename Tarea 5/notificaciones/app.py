@@ -1,20 +1,37 @@
-import json
 import os
-from flask import Flask, jsonify, request, g
-from marshmallow import Schema, fields, ValidationError
+from flask import Flask, Response, jsonify, request, g, stream_with_context
+from marshmallow import Schema, fields, validate, ValidationError
 from flasgger import Swagger
 import logging
 import requests
+import http_client
+from idempotency import IdempotencyStore, idempotent
+from messaging import CHANGES_EXCHANGE, PURCHASES_EXCHANGE, create_broker
+from ref_cache import RefCache
 from dotenv import load_dotenv
 import os
 import requests
+from etags import collection_etag, not_modified
 from log_utils import init_logging, CORRELATION_ID_HEADER
+from repository import (decode_cursor, encode_cursor, iter_records, migrate_json,
+                        open_repository)
 import uuid
 
 load_dotenv("config.env")
 
-DATA_FILE = "notifications.json"
+DATA_FILE = os.getenv("DATA_FILE", "notifications.json")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+MAX_PAGE_SIZE = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Query parameter -> indexed field path
+NOTIFICATION_FILTERS = {"userId": "users.id", "type": "type", "status": "status"}
+# ticketId finds the notification of a purchase, to skip redelivered events
+NOTIFICATION_INDEXES = [*NOTIFICATION_FILTERS.values(), "ticketId"]
+# Durable queue shared by the workers, bound to the purchases exchange
+PURCHASES_QUEUE = "notificaciones.compras"
 USERS_SERVICE = os.getenv("USUARIOS_SERVICE")
+# Ids per POST /users/lookup call (the users service accepts up to 1000)
+USERS_LOOKUP_CHUNK = int(os.getenv("USERS_LOOKUP_CHUNK", "1000"))
 
 # ---------------------------- Flask App ---------------------------
 
@@ -57,21 +74,100 @@ class NotificationsSchema(Schema):
 
 notifications_schema = NotificationsSchema()
 
-#  ------------------------ File Helpers --------------------------
+class NotificationsQuerySchema(Schema):
+    userId = fields.Integer()
+    type = fields.String()
+    status = fields.String()
+    limit = fields.Integer(validate=validate.Range(min=1, max=MAX_PAGE_SIZE))
+    cursor = fields.String()
 
-def load_notifications():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r") as fileVar:
-        return json.load(fileVar)
+notifications_query_schema = NotificationsQuerySchema()
 
-def save_notifications(notifications):
-    with open(DATA_FILE, "w") as fileVar:
-        json.dump(notifications, fileVar, indent=2)
+#  ------------------------- Repository --------------------------
 
-def find_notification(notification_id):
-    notifications = load_notifications()
-    return next((notification for notification in notifications if notification["id"] == notification_id), None)
+notifications_repository = open_repository(DATA_FILE, STORAGE_BACKEND,
+                                           indexes=NOTIFICATION_INDEXES)
+
+# Responses to POSTs sent with an Idempotency-Key, shared by the workers
+idempotency_store = IdempotencyStore(
+    DATA_FILE + ".idempotency.db",
+    ttl=float(os.getenv("IDEMPOTENCY_TTL", "86400")),
+    max_keys=int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000")),
+)
+
+# ------------------------ Downstream services ------------------------
+
+# Existence answers from usuarios, reused across requests
+reference_cache = RefCache(
+    max_size=int(os.getenv("REF_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("REF_CACHE_TTL", "30")),
+    negative_ttl=float(os.getenv("REF_CACHE_NEGATIVE_TTL", "5")),
+)
+
+# Evict entries as soon as usuarios announce a change. After a
+# (re)connection the whole cache is dropped, since changes may have been
+# missed while disconnected.
+broker = create_broker()
+
+def on_reference_change(message):
+    reference_cache.invalidate((message["resource"], message["id"]))
+
+broker.subscribe(CHANGES_EXCHANGE, on_reference_change,
+                 on_connect=reference_cache.invalidate)
+
+def find_missing_users(user_ids):
+    """Ids in ``user_ids`` unknown to the users service.
+
+    Ids with an answer in ``reference_cache`` are not asked again. The rest
+    are validated with one POST /users/lookup per USERS_LOOKUP_CHUNK ids
+    instead of one GET per user.
+    """
+    missing, unknown = [], []
+    for user_id in dict.fromkeys(user_ids):
+        exists = reference_cache.get(("users", user_id))
+        if exists is None:
+            unknown.append(user_id)
+        elif not exists:
+            missing.append(user_id)
+
+    for start in range(0, len(unknown), USERS_LOOKUP_CHUNK):
+        chunk = unknown[start:start + USERS_LOOKUP_CHUNK]
+        app.logger.info("Calling users service to validate %d users with correlation_id: %s",
+                        len(chunk), g.correlation_id)
+        response = http_client.post(f"{USERS_SERVICE}/users/lookup", json={"ids": chunk})
+        response.raise_for_status()
+        chunk_missing = response.json()["missing"]
+        missing_set = set(chunk_missing)
+        for user_id in chunk:
+            reference_cache.put(("users", user_id), user_id not in missing_set)
+        missing += chunk_missing
+    return missing
+
+# --------------------------- Purchases ---------------------------
+
+def on_purchase(message):
+    """Notify the buyer of a ticket bought through entradas (POST /purchases).
+
+    A purchase that already has a notification is a redelivery and is
+    skipped; the check and the insert are atomic, so workers handling
+    copies at once notify it once.
+    """
+    notification, created = notifications_repository.add_if_absent(
+        {"ticketId": message["ticketId"]}, {
+            "users": [{"id": message["buyerId"]}],
+            "type": "purchase",
+            "content": f"Your {message['type']} ticket {message['ticketId']} for event "
+                       f"{message['eventId']} is confirmed",
+            "status": "pending",
+            "ticketId": message["ticketId"],
+        })
+    if not created:
+        app.logger.info("Ticket %d is already notified", message["ticketId"])
+        return
+    app.logger.info("Notification %d created for ticket %d",
+                    notification["id"], message["ticketId"])
+
+broker.consume(PURCHASES_EXCHANGE, PURCHASES_QUEUE, on_purchase)
 
 # ----------------------------- Routes ----------------------------
 
@@ -81,14 +177,82 @@ def find_notification(notification_id):
 def get_notifications():
     """Get all notifications
     ---
+    produces:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: userId
+        in: query
+        type: integer
+        required: false
+        description: Only notifications sent to this user
+      - name: type
+        in: query
+        type: string
+        required: false
+        description: Only notifications of this type
+      - name: status
+        in: query
+        type: string
+        required: false
+        description: Only notifications with this status
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-1000). Without it every match is returned.
+          With Accept application/x-ndjson it caps the streamed records.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: X-Next-Cursor header of the previous page
     responses:
       200:
         description: List of notifications
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor of the next page, absent on the last one
+      304:
+        description: Not modified since the ETag sent in If-None-Match
+      400:
+        description: Invalid query
     """
-    notifications = load_notifications()
+    try:
+        args = notifications_query_schema.load(request.args)
+        after = decode_cursor(args["cursor"]) if "cursor" in args else None
+    except ValidationError as err:
+        app.logger.info("Invalid notifications query: %s", err.messages)
+        return jsonify(err.messages), 400
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    filters = {NOTIFICATION_FILTERS[name]: value for name, value in args.items()
+               if name in NOTIFICATION_FILTERS}
+    if request.accept_mimetypes.best_match(
+            ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        app.logger.info("Streaming notifications as NDJSON")
+        records = iter_records(notifications_repository, filters, after, args.get("limit"))
+        lines = (app.json.dumps(record) + "\n" for record in records)
+        return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+
+    # The generation is read before the page: a concurrent write can only
+    # make the ETag older than the body, never newer.
+    etag = collection_etag(notifications_repository.generation())
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    notifications, next_id = notifications_repository.page(
+        filters, args.get("limit"), after)
     app.logger.info(
         "Returning list of notifications with length: %d", len(notifications))
-    return jsonify(notifications), 200
+    response = jsonify(notifications)
+    response.set_etag(etag)
+    if next_id is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_id)
+    return response, 200
 
 # >>>>>>>>>>>>>> Get notification by ID <<<<<<<<<<<<
 
@@ -123,6 +287,8 @@ def get_notification(notification_id):
               type: string
             status:
               type: string
+      304:
+        description: Not modified since the ETag sent in If-None-Match
       404:
         description: Notification not found
         schema:
@@ -131,11 +297,17 @@ def get_notification(notification_id):
             error:
               type: string
     """
-    notification = find_notification(notification_id)
+    notification, etag = notifications_repository.get_versioned(notification_id)
 
     if notification:
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            app.logger.info("Notification with id %d not modified", notification_id)
+            return unchanged
         app.logger.info("Notification with id %d found", notification_id)
-        return jsonify(notification), 200
+        response = jsonify(notification)
+        response.set_etag(etag)
+        return response, 200
 
     app.logger.info("Notification with id %d not found", notification_id)
     return jsonify({"error": "Notification not found"}), 404
@@ -143,11 +315,17 @@ def get_notification(notification_id):
 # >>>>>>>>>>>>>> Add new notification <<<<<<<<<<<<
 
 @app.route('/notifications', methods=['POST'])
+@idempotent(lambda: idempotency_store)
 def add_notification():
     """
     Add a new notification
     ---
     parameters:
+      - name: Idempotency-Key
+        in: header
+        type: string
+        required: false
+        description: Retries with the same key replay the first response
       - name: body
         in: body
         required: true
@@ -181,28 +359,18 @@ def add_notification():
         return jsonify(err.messages), 400
 
     # Validate users
-    for user in data["users"]:
-        user_id = user["id"]
-        app.logger.info("Calling users service to validate user %d with correlation_id: %s",
-                        user_id, g.correlation_id)
-        response = requests.get(
-            f"{USERS_SERVICE}/users/{user_id}",
-            headers={CORRELATION_ID_HEADER: g.correlation_id}
-        )
-        if response.status_code != 200:
-            app.logger.info("User with id %d not found", user_id)
-            return jsonify({"error": f"User with id {user_id} not found"}), 404
+    try:
+        missing = find_missing_users([user["id"] for user in data["users"]])
+    except requests.exceptions.RequestException:
+        return jsonify({"error": "Unable to verify users"}), 500
+    if missing:
+        app.logger.info("Users with ids %s not found", missing)
+        return jsonify({"error": f"User with id {missing[0]} not found",
+                        "missing": missing}), 404
 
     app.logger.info("Adding new notification: %s", data)
 
-    notifications = load_notifications()
-    new_notification = {
-        "id": notifications[-1]["id"] + 1 if notifications else 1,
-        **data
-    }
-
-    notifications.append(new_notification)
-    save_notifications(notifications)
+    new_notification = notifications_repository.add(data)
     return jsonify(new_notification), 201
 
 # >>>>>>>>>>>>>> Update notification by ID <<<<<<<<<<<<
@@ -242,8 +410,6 @@ def update_notification(notification_id):
       404:
         description: Notification not found
     """
-    notifications = load_notifications()
-
     try:
         data = notifications_schema.load(request.get_json())
     except ValidationError as err:
@@ -251,23 +417,18 @@ def update_notification(notification_id):
         return jsonify(err.messages), 400
 
     # Validate users
-    for user in data["users"]:
-        user_id = user["id"]
-        app.logger.info("Calling users service to validate user %d with correlation_id: %s",
-                        user_id, g.correlation_id)
-        response = requests.get(
-            f"{USERS_SERVICE}/users/{user_id}",
-            headers={CORRELATION_ID_HEADER: g.correlation_id}
-        )
-        if response.status_code != 200:
-            app.logger.info("User with id %d not found", user_id)
-            return jsonify({"error": f"User with id {user_id} not found"}), 404
-
-    for notification in notifications:
-        if notification["id"] == notification_id:
-            notification.update(data)
-            save_notifications(notifications)
-            return jsonify(notification), 200
+    try:
+        missing = find_missing_users([user["id"] for user in data["users"]])
+    except requests.exceptions.RequestException:
+        return jsonify({"error": "Unable to verify users"}), 500
+    if missing:
+        app.logger.info("Users with ids %s not found", missing)
+        return jsonify({"error": f"User with id {missing[0]} not found",
+                        "missing": missing}), 404
+
+    notification = notifications_repository.update(notification_id, data)
+    if notification:
+        return jsonify(notification), 200
 
     return jsonify({"error": "Notification not found"}), 404
 
@@ -288,14 +449,48 @@ def delete_notification(notification_id):
       404:
         description: Notification not found
     """
-    notifications = load_notifications()
-    if not any(notification["id"] == notification_id for notification in notifications):
+    if not notifications_repository.delete(notification_id):
         return jsonify({"error": "Notification not found"}), 404
 
-    notifications = [notification for notification in notifications if notification["id"] != notification_id]
-    save_notifications(notifications)
     return "", 204
 
+# >>>>>>>>>>>>>> Reference cache statistics <<<<<<<<<<<<
+
+@app.route('/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """Hit, miss and eviction counters of this worker's reference cache
+    ---
+    responses:
+      200:
+        description: Cache statistics
+        schema:
+          type: object
+          properties:
+            size:
+              type: integer
+            maxSize:
+              type: integer
+            hits:
+              type: integer
+            misses:
+              type: integer
+            evictions:
+              type: integer
+            expirations:
+              type: integer
+    """
+    return jsonify(reference_cache.stats()), 200
+
+# ------------------------------ CLI ------------------------------
+
+@app.cli.command("migrate-json")
+def migrate_json_command():
+    """Import notifications.json into the SQLite database (flask migrate-json)."""
+    repository = open_repository(DATA_FILE, "sqlite",
+                                 indexes=NOTIFICATION_INDEXES)
+    count = migrate_json(DATA_FILE, repository)
+    print(f"Imported {count} notifications from {DATA_FILE}")
+
 # ------------------------------ Main -----------------------------
 if __name__ == '__main__':
     app.run(debug=True, port=5004)
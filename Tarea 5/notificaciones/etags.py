@@ -0,0 +1,16 @@
+import hashlib
+from flask import Response, request
+
+
+def collection_etag(generation):
+    """Strong ETag of a list response: the collection generation plus the query."""
+    return hashlib.sha1(f"{generation}|{request.full_path}".encode()).hexdigest()
+
+
+def not_modified(etag):
+    """304 Not Modified if the request's If-None-Match lists ``etag``, else None."""
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+    return None
@@ -0,0 +1,198 @@
+import functools
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, jsonify, make_response, request
+
+IDEMPOTENCY_KEY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 255
+
+# IdempotencyStore.begin() outcomes
+STARTED = "started"
+IN_PROGRESS = "in_progress"
+MISMATCH = "mismatch"
+DONE = "done"
+
+
+class IdempotencyStore:
+    """Responses to requests sent with an ``Idempotency-Key``, in SQLite.
+
+    One row per (scope, key) holds a fingerprint of the request body and,
+    once the request finished, its status, body and mimetype. SQLite's
+    locking makes the store shared by every gunicorn worker; each thread
+    gets its own connection.
+
+    Rows expire ``ttl`` seconds after the first request. A request still
+    running after ``pending_ttl`` seconds is assumed to have died with its
+    worker, and the key can be used again. At most ``max_keys`` rows are
+    kept: every ``PRUNE_EVERY`` new keys, expired rows and then the oldest
+    ones over the limit are deleted.
+    """
+
+    PRUNE_EVERY = 100
+
+    def __init__(self, path, ttl=86400, max_keys=100000, pending_ttl=60,
+                 clock=time.time):
+        self.path = path
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.pending_ttl = pending_ttl
+        self._clock = clock
+        self._local = threading.local()
+        self._inserts = 0
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+                "scope TEXT NOT NULL, key TEXT NOT NULL, fingerprint TEXT NOT NULL, "
+                "created_at REAL NOT NULL, status INTEGER, body BLOB, mimetype TEXT, "
+                "PRIMARY KEY (scope, key))")
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idempotency_keys_by_age "
+                "ON idempotency_keys (created_at)")
+
+    def __len__(self):
+        return self._connection().execute(
+            "SELECT COUNT(*) FROM idempotency_keys").fetchone()[0]
+
+    def begin(self, scope, key, fingerprint):
+        """Claim ``key`` for a request; return ``(outcome, saved response)``.
+
+        STARTED means the caller runs the request and then calls finish()
+        or abandon(). DONE comes with the saved ``(status, body, mimetype)``.
+        IN_PROGRESS and MISMATCH (same key, different body) come with None.
+        """
+        now = self._clock()
+        with self._transaction() as connection:
+            row = connection.execute(
+                "SELECT fingerprint, created_at, status, body, mimetype "
+                "FROM idempotency_keys WHERE scope = ? AND key = ?",
+                (scope, key)).fetchone()
+            if row is not None and not self._expired(row, now):
+                if row[0] != fingerprint:
+                    return MISMATCH, None
+                if row[2] is None:
+                    return IN_PROGRESS, None
+                return DONE, (row[2], row[3], row[4])
+            connection.execute(
+                "INSERT OR REPLACE INTO idempotency_keys "
+                "(scope, key, fingerprint, created_at) VALUES (?, ?, ?, ?)",
+                (scope, key, fingerprint, now))
+            self._inserts += 1
+            if self._inserts % self.PRUNE_EVERY == 0:
+                self._prune(connection, now)
+            return STARTED, None
+
+    def finish(self, scope, key, status, body, mimetype):
+        with self._transaction() as connection:
+            connection.execute(
+                "UPDATE idempotency_keys SET status = ?, body = ?, mimetype = ? "
+                "WHERE scope = ? AND key = ?", (status, body, mimetype, scope, key))
+
+    def abandon(self, scope, key):
+        """Forget a request that failed, so a retry runs it again."""
+        with self._transaction() as connection:
+            connection.execute(
+                "DELETE FROM idempotency_keys WHERE scope = ? AND key = ? "
+                "AND status IS NULL", (scope, key))
+
+    def prune(self):
+        with self._transaction() as connection:
+            self._prune(connection, self._clock())
+
+    # --------------------------- Helpers ---------------------------
+
+    def _expired(self, row, now):
+        ttl = self.pending_ttl if row[2] is None else self.ttl
+        return row[1] + ttl <= now
+
+    def _prune(self, connection, now):
+        connection.execute(
+            "DELETE FROM idempotency_keys WHERE created_at <= ? "
+            "OR (status IS NULL AND created_at <= ?)",
+            (now - self.ttl, now - self.pending_ttl))
+        connection.execute(
+            "DELETE FROM idempotency_keys WHERE rowid IN ("
+            "SELECT rowid FROM idempotency_keys ORDER BY created_at DESC "
+            "LIMIT -1 OFFSET ?)", (self.max_keys,))
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30,
+                                         isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    @contextmanager
+    def _transaction(self):
+        connection = self._connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+
+def fingerprint():
+    """Hash of the request body; JSON bodies are compared by content."""
+    body = request.get_json(silent=True)
+    if body is None:
+        data = request.get_data()
+    else:
+        data = json.dumps(body, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha1(data).hexdigest()
+
+
+def idempotent(get_store):
+    """Decorate a view so repeats of an ``Idempotency-Key`` replay its response.
+
+    ``get_store()`` returns the IdempotencyStore, looked up on every
+    request. Requests without the header run as usual. A repeat gets the
+    saved response without running the view again; 409 if the first
+    request is still running, 422 if the key was used with another body.
+    Server errors are not saved, so the client can retry them.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+            if key is None:
+                return view(*args, **kwargs)
+            if not key or len(key) > MAX_KEY_LENGTH:
+                return jsonify({"error": f"Invalid {IDEMPOTENCY_KEY_HEADER} header"}), 400
+
+            store = get_store()
+            scope = f"{request.method} {request.path}"
+            outcome, saved = store.begin(scope, key, fingerprint())
+            if outcome == IN_PROGRESS:
+                return jsonify({"error": "A request with this Idempotency-Key is in progress"}), 409
+            if outcome == MISMATCH:
+                return jsonify({"error": "Idempotency-Key was used with a different request"}), 422
+            if outcome == DONE:
+                status, body, mimetype = saved
+                response = Response(body, status=status, mimetype=mimetype)
+                response.headers[REPLAYED_HEADER] = "true"
+                return response
+
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                store.abandon(scope, key)
+                raise
+            if response.status_code >= 500:
+                store.abandon(scope, key)
+            else:
+                store.finish(scope, key, response.status_code,
+                             response.get_data(), response.mimetype)
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,80 @@
+import pytest
+import app as notifications_app
+from idempotency import IdempotencyStore
+from ref_cache import RefCache
+from repository import open_repository
+
+NOTIFICATION = {"type": "info", "content": "Hello world", "status": "sent"}
+
+class FakeResponse:
+    def __init__(self, missing):
+        self.missing = missing
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {"missing": self.missing}
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    repository = open_repository(str(tmp_path / "notifications.json"),
+                                 indexes=notifications_app.NOTIFICATION_INDEXES)
+    monkeypatch.setattr(notifications_app, "notifications_repository", repository)
+    monkeypatch.setattr(notifications_app, "reference_cache", RefCache())
+    monkeypatch.setattr(notifications_app, "idempotency_store",
+                        IdempotencyStore(str(tmp_path / "idempotency.db")))
+    notifications_app.app.config['TESTING'] = True
+    with notifications_app.app.test_client() as client:
+        yield client
+
+@pytest.fixture
+def lookups(monkeypatch):
+    """Record every users lookup; ids >= 1000 do not exist."""
+    calls = []
+    def fake_post(url, json):
+        calls.append(json["ids"])
+        return FakeResponse([user_id for user_id in json["ids"] if user_id >= 1000])
+    monkeypatch.setattr(notifications_app.http_client, "post", fake_post)
+    monkeypatch.setattr(notifications_app, "USERS_LOOKUP_CHUNK", 400)
+    return calls
+
+def test_recipients_validated_in_chunks(client, lookups):
+    users = [{"id": user_id} for user_id in range(1, 1000)]
+    rv = client.post('/notifications', json={**NOTIFICATION, "users": users})
+    assert rv.status_code == 201
+    assert [len(chunk) for chunk in lookups] == [400, 400, 199]
+
+def test_missing_recipients(client, lookups):
+    users = [{"id": 1}, {"id": 1000}, {"id": 1001}]
+    rv = client.post('/notifications', json={**NOTIFICATION, "users": users})
+    assert rv.status_code == 404
+    assert rv.get_json()["missing"] == [1000, 1001]
+    assert client.get('/notifications').get_json() == []
+
+def test_cached_recipients_are_not_looked_up_again(client, lookups):
+    users = [{"id": user_id} for user_id in (1, 2, 1000)]
+    client.post('/notifications', json={**NOTIFICATION, "users": users})
+    users.append({"id": 3})
+    rv = client.post('/notifications', json={**NOTIFICATION, "users": users})
+    assert rv.status_code == 404
+    assert lookups == [[1, 2, 1000], [3]]
+
+def test_retried_post_creates_one_notification(client, lookups):
+    body = {**NOTIFICATION, "users": [{"id": 1}]}
+    headers = {"Idempotency-Key": "retry-1"}
+    first = client.post('/notifications', json=body, headers=headers)
+    retry = client.post('/notifications', json=body, headers=headers)
+    assert first.status_code == retry.status_code == 201
+    assert retry.get_json() == first.get_json()
+    assert len(client.get('/notifications').get_json()) == 1
+    assert len(lookups) == 1
+
+def test_purchase_events_notify_the_buyer_once(client):
+    purchase = {"ticketId": 7, "buyerId": 3, "eventId": 2, "type": "VIP", "price": 100,
+                "purchasedAt": "2025-01-01T00:00:00+00:00"}
+    notifications_app.broker.publish(notifications_app.PURCHASES_EXCHANGE, purchase)
+    notifications_app.broker.publish(notifications_app.PURCHASES_EXCHANGE, purchase)
+    notifications = client.get('/notifications?userId=3').get_json()
+    assert len(notifications) == 1
+    assert notifications[0]["type"] == "purchase" and notifications[0]["ticketId"] == 7
@@ -1,14 +1,26 @@
-import json
 import os
-from flask import Flask, jsonify, request, g
-from marshmallow import Schema, fields, ValidationError
+from flask import Flask, Response, jsonify, request, g, stream_with_context
+from marshmallow import Schema, fields, validate, ValidationError
 from flasgger import Swagger
 import logging
 import requests
+from messaging import create_broker, publish_change
+from etags import collection_etag, not_modified
 from log_utils import init_logging, CORRELATION_ID_HEADER
+from repository import (decode_cursor, encode_cursor, iter_records, migrate_json,
+                        open_repository)
 import uuid
+from dotenv import load_dotenv
 
-DATA_FILE = "users.json"
+load_dotenv("config.env")
+
+DATA_FILE = os.getenv("DATA_FILE", "users.json")
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "json")
+MAX_PAGE_SIZE = 1000
+MAX_LOOKUP_IDS = 1000
+NDJSON_MIMETYPE = "application/x-ndjson"
+# Query parameter -> indexed field path
+USER_FILTERS = {"isOrganizer": "isOrganizer", "email": "email"}
 
 # ---------------------------- Flask App ---------------------------
 
@@ -51,21 +63,29 @@ class UsersSchema(Schema):
 
 user_schema = UsersSchema()
 
-#  ------------------------ File Helpers --------------------------
+class UsersQuerySchema(Schema):
+    isOrganizer = fields.Boolean()
+    email = fields.String()
+    limit = fields.Integer(validate=validate.Range(min=1, max=MAX_PAGE_SIZE))
+    cursor = fields.String()
+
+users_query_schema = UsersQuerySchema()
+
+class UsersLookupSchema(Schema):
+    ids = fields.List(fields.Integer(), required=True,
+                      validate=validate.Length(min=1, max=MAX_LOOKUP_IDS))
 
-def load_users():
-    if not os.path.exists(DATA_FILE):
-        return []
-    with open(DATA_FILE, "r") as fileVar:
-        return json.load(fileVar)
+users_lookup_schema = UsersLookupSchema()
 
-def save_users(users):
-    with open(DATA_FILE, "w") as fileVar:
-        json.dump(users, fileVar, indent=2)
+#  ------------------------- Repository --------------------------
 
-def find_user(user_id):
-    users = load_users()
-    return next((user for user in users if user["id"] == user_id), None)
+users_repository = open_repository(DATA_FILE, STORAGE_BACKEND,
+                                   indexes=USER_FILTERS.values())
+
+#  -------------------------- Messaging --------------------------
+
+# Create/update/delete events for the services that cache users
+broker = create_broker()
 
 # ----------------------------- Routes ----------------------------
 
@@ -75,14 +95,77 @@ def find_user(user_id):
 def get_users():
     """Get all users
     ---
+    produces:
+      - application/json
+      - application/x-ndjson
+    parameters:
+      - name: isOrganizer
+        in: query
+        type: boolean
+        required: false
+        description: Only organizers (true) or buyers (false)
+      - name: email
+        in: query
+        type: string
+        required: false
+        description: Only the user with this email
+      - name: limit
+        in: query
+        type: integer
+        required: false
+        description: Page size (1-1000). Without it every match is returned.
+          With Accept application/x-ndjson it caps the streamed records.
+      - name: cursor
+        in: query
+        type: string
+        required: false
+        description: X-Next-Cursor header of the previous page
     responses:
       200:
         description: List of users
+        headers:
+          X-Next-Cursor:
+            type: string
+            description: Cursor of the next page, absent on the last one
+      304:
+        description: Not modified since the ETag sent in If-None-Match
+      400:
+        description: Invalid query
     """
-    users = load_users()
+    try:
+        args = users_query_schema.load(request.args)
+        after = decode_cursor(args["cursor"]) if "cursor" in args else None
+    except ValidationError as err:
+        app.logger.info("Invalid users query: %s", err.messages)
+        return jsonify(err.messages), 400
+    except ValueError as err:
+        return jsonify({"error": str(err)}), 400
+
+    filters = {USER_FILTERS[name]: value for name, value in args.items()
+               if name in USER_FILTERS}
+    if request.accept_mimetypes.best_match(
+            ["application/json", NDJSON_MIMETYPE]) == NDJSON_MIMETYPE:
+        app.logger.info("Streaming users as NDJSON")
+        records = iter_records(users_repository, filters, after, args.get("limit"))
+        lines = (app.json.dumps(record) + "\n" for record in records)
+        return Response(stream_with_context(lines), mimetype=NDJSON_MIMETYPE)
+
+    # The generation is read before the page: a concurrent write can only
+    # make the ETag older than the body, never newer.
+    etag = collection_etag(users_repository.generation())
+    unchanged = not_modified(etag)
+    if unchanged is not None:
+        return unchanged
+
+    users, next_id = users_repository.page(
+        filters, args.get("limit"), after)
     app.logger.info(
         "Returning list of users with length: %d", len(users))
-    return jsonify(users), 200
+    response = jsonify(users)
+    response.set_etag(etag)
+    if next_id is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor(next_id)
+    return response, 200
 
 # >>>>>>>>>>>>>> Get user by ID <<<<<<<<<<<<
 
@@ -112,6 +195,8 @@ def get_user(user_id):
               type: string
             isOrganizer:
               type: boolean
+      304:
+        description: Not modified since the ETag sent in If-None-Match
       404:
         description: User not found
         schema:
@@ -120,15 +205,70 @@ def get_user(user_id):
             error:
               type: string
     """
-    user = find_user(user_id)
+    user, etag = users_repository.get_versioned(user_id)
 
     if user:
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            app.logger.info("User with id %d not modified", user_id)
+            return unchanged
         app.logger.info("User with id %d found", user_id)
-        return jsonify(user), 200
+        response = jsonify(user)
+        response.set_etag(etag)
+        return response, 200
 
     app.logger.info("User with id %d not found", user_id)
     return jsonify({"error": "User not found"}), 404
 
+# >>>>>>>>>>>>>> Look up many users by ID <<<<<<<<<<<<
+
+@app.route('/users/lookup', methods=['POST'])
+def lookup_users():
+    """
+    Check which of a list of user ids exist
+    ---
+    parameters:
+      - name: body
+        in: body
+        required: true
+        schema:
+          type: object
+          properties:
+            ids:
+              type: array
+              maxItems: 1000
+              items:
+                type: integer
+    responses:
+      200:
+        description: Existing and unknown ids, in request order
+        schema:
+          type: object
+          properties:
+            found:
+              type: array
+              items:
+                type: integer
+            missing:
+              type: array
+              items:
+                type: integer
+      400:
+        description: Invalid input
+    """
+    try:
+        data = users_lookup_schema.load(request.get_json())
+    except ValidationError as err:
+        app.logger.info("Invalid users lookup: %s", err.messages)
+        return jsonify(err.messages), 400
+
+    ids = list(dict.fromkeys(data["ids"]))
+    users = users_repository.get_many(ids)
+    found = [user_id for user_id in ids if user_id in users]
+    missing = [user_id for user_id in ids if user_id not in users]
+    app.logger.info("Users lookup: %d found, %d missing", len(found), len(missing))
+    return jsonify({"found": found, "missing": missing}), 200
+
 # >>>>>>>>>>>>>> Add new user <<<<<<<<<<<<
 
 @app.route('/users', methods=['POST'])
@@ -166,14 +306,8 @@ def add_user():
 
     app.logger.info("Adding new user: %s", data)
 
-    users = load_users()
-    new_user = {
-        "id": users[-1]["id"] + 1 if users else 1,
-        **data
-    }
-
-    users.append(new_user)
-    save_users(users)
+    new_user = users_repository.add(data)
+    publish_change(broker, "users", new_user["id"], "created")
     return jsonify(new_user), 201
 
 # >>>>>>>>>>>>>> Update user by ID <<<<<<<<<<<<
@@ -208,19 +342,16 @@ def update_user(user_id):
       404:
         description: User not found
     """
-    users = load_users()
-
     try:
         data = user_schema.load(request.get_json())
     except ValidationError as err:
         app.logger.info("Invalid user data: %s", err.messages)
         return jsonify(err.messages), 400
 
-    for user in users:
-        if user["id"] == user_id:
-            user.update(data)
-            save_users(users)
-            return jsonify(user), 200
+    user = users_repository.update(user_id, data)
+    if user:
+        publish_change(broker, "users", user_id, "updated")
+        return jsonify(user), 200
 
     return jsonify({"error": "User not found"}), 404
 
@@ -241,12 +372,10 @@ def delete_user(user_id):
       404:
         description: User not found
     """
-    users = load_users()
-    if not any(user["id"] == user_id for user in users):
+    if not users_repository.delete(user_id):
         return jsonify({"error": "User not found"}), 404
 
-    users = [user for user in users if user["id"] != user_id]
-    save_users(users)
+    publish_change(broker, "users", user_id, "deleted")
     return "", 204
 
 # >>>>>>>>>>>>>> Check if user is organizer <<<<<<<<<<<<
@@ -268,15 +397,30 @@ def is_user_organizer(user_id):
       404:
         description: User not found
     """
-    user = find_user(user_id)
+    user, etag = users_repository.get_versioned(user_id)
 
     if user:
+        unchanged = not_modified(etag)
+        if unchanged is not None:
+            return unchanged
         app.logger.info("User with id %d isOrganizer: %s", user_id, user["isOrganizer"])
-        return jsonify(user["isOrganizer"]), 200
+        response = jsonify(user["isOrganizer"])
+        response.set_etag(etag)
+        return response, 200
 
     app.logger.info("User with id %d not found", user_id)
     return jsonify({"error": "User not found"}), 404
 
+# ------------------------------ CLI ------------------------------
+
+@app.cli.command("migrate-json")
+def migrate_json_command():
+    """Import users.json into the SQLite database (flask migrate-json)."""
+    repository = open_repository(DATA_FILE, "sqlite",
+                                 indexes=USER_FILTERS.values())
+    count = migrate_json(DATA_FILE, repository)
+    print(f"Imported {count} users from {DATA_FILE}")
+
 # ------------------------------ Main -----------------------------
 if __name__ == '__main__':
     app.run(debug=True, port=5003)
@@ -0,0 +1,45 @@
+import pytest
+import app as users_app
+from messaging import CHANGES_EXCHANGE, LocalBroker
+from repository import open_repository
+
+USER = {"name": "Ana", "email": "ana@example.com", "phone": "8888-8888", "isOrganizer": False}
+
+@pytest.fixture
+def repository(tmp_path, monkeypatch):
+    repository = open_repository(str(tmp_path / "users.json"),
+                                 indexes=users_app.USER_FILTERS.values())
+    monkeypatch.setattr(users_app, "users_repository", repository)
+    return repository
+
+@pytest.fixture
+def client(repository):
+    users_app.app.config['TESTING'] = True
+    with users_app.app.test_client() as client:
+        yield client
+
+def test_lookup_users(client, repository):
+    first = repository.add(USER)
+    second = repository.add(USER)
+    rv = client.post('/users/lookup', json={"ids": [second["id"], 99, first["id"], 99]})
+    assert rv.status_code == 200
+    assert rv.get_json() == {"found": [second["id"], first["id"]], "missing": [99]}
+
+def test_lookup_users_invalid(client):
+    assert client.post('/users/lookup', json={"ids": []}).status_code == 400
+    assert client.post('/users/lookup', json={"ids": ["abc"]}).status_code == 400
+    too_many = list(range(users_app.MAX_LOOKUP_IDS + 1))
+    assert client.post('/users/lookup', json={"ids": too_many}).status_code == 400
+
+def test_changes_are_broadcast(client, monkeypatch):
+    broker = LocalBroker()
+    messages = []
+    broker.subscribe(CHANGES_EXCHANGE, messages.append)
+    monkeypatch.setattr(users_app, "broker", broker)
+
+    user_id = client.post('/users', json=USER).get_json()["id"]
+    client.put(f'/users/{user_id}', json={**USER, "isOrganizer": True})
+    client.delete(f'/users/{user_id}')
+    client.delete(f'/users/{user_id}')
+    assert messages == [{"resource": "users", "id": user_id, "change": change}
+                        for change in ("created", "updated", "deleted")]